@@ -37,4 +37,19 @@ class Common:
 
     batch_size = ["8", "16", "32", "64", "128", "256"]
 
+    # Where frames are decoded and preprocessed, see detection.process_video
+    frame_grabber_backends = ["thread", "process"]
+
+    # How the model is run, see BatchYolov8
+    inference_backends = ["torch", "onnx"]
+
     weights_folder = Path(r"data/models")
+
+    # Models exported for the onnx backend, see OnnxModel
+    exported_models_folder = Path(r"data/exported_models")
+
+    # Detections of videos detected before, see DetectionCache
+    detection_cache_folder = Path(r"data/detection_cache")
+
+    # The fastest batch size and threads per host and model, see autotune
+    autotune_folder = Path(r"data/autotune")
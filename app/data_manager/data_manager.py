@@ -54,7 +54,7 @@ class DataManager:
         """Checking if tables aleady exist in the database
 
         Returns:
-            bool: Returns true if there is no tables in the database
+            bool: Returns true if any of the tables are missing from the database
         """
         try:
             # creates a cursor
@@ -63,11 +63,12 @@ class DataManager:
             # checks if there are tables in the database
             list_of_tables = cursor.execute(
                 """SELECT name FROM sqlite_master WHERE type='table'
-            AND name IN ('video', 'detection'); """
+            AND name IN ('video', 'detection', 'checkpoint'); """
             ).fetchall()
 
-            # returns true if there isnt any tables found in the database
-            if list_of_tables == []:
+            # returns true if any of the tables are missing, the script
+            # only creates the missing ones, for databases from older versions
+            if len(list_of_tables) < 3:
                 print("Tables not found!")
                 return True
 
@@ -88,8 +89,9 @@ class DataManager:
             cursor = self.sqlite_connection.cursor()
 
             # opens the sql file with the tables that are going to be created
+            # Next to this file, so the database can be made from any folder
             with open(
-                "app/data_manager/sqlite_tables.sql",
+                Path(__file__).parent / "sqlite_tables.sql",
                 "r",
                 encoding="ascii",
                 errors="ignore",
@@ -223,12 +225,8 @@ class DataManager:
 
             detections_exist = self.detection_check(str(video_id))
             if detections_exist:
-                sqlite_remove_query = (
-                    """DELLETE FROM detection WHERE videoid ='"""
-                    + str(video_id)
-                    + """';"""
-                )
-                cursor.execute(sqlite_remove_query)
+                sqlite_remove_query = """DELETE FROM detection WHERE videoid = ?;"""
+                cursor.execute(sqlite_remove_query, (str(video_id),))
                 print("Deleted previous entries!")
 
             # sets up query
@@ -282,6 +280,59 @@ class DataManager:
             print("Error while checking for sqlite table", error)
             return False
 
+    def get_checkpoint(self, video_id: Path, run_key: str) -> typing.Tuple[int, bool]:
+        """Returns how far a video got in a run with the same settings
+
+        Args:
+            video_id (Path): The path of the video
+            run_key (str): Identifies the video file and the settings of the run
+
+        Returns:
+            Tuple[int, bool]: The frame to resume detection at, and whether the video
+                              was done, or (0, False) if it wasn't started with the
+                              same run key
+        """
+        try:
+            cursor = self.sqlite_connection.cursor()
+            checkpoint = cursor.execute(
+                """SELECT frames, completed FROM checkpoint
+                WHERE videoid = ? AND runkey = ?;""",
+                (str(video_id), run_key),
+            ).fetchone()
+            cursor.close()
+
+            if checkpoint is None:
+                return 0, False
+            return int(checkpoint[0]), bool(checkpoint[1])
+
+        except sqlite3.Error as error:
+            logger.error("Failed to read the checkpoint of %s: %s", video_id, error)
+            return 0, False
+
+    def save_checkpoint(
+        self, video_id: Path, run_key: str, frames: int, completed: bool = False
+    ) -> None:
+        """Records how far a video got, replacing the checkpoint of any earlier run
+
+        Args:
+            video_id (Path): The path of the video
+            run_key (str): Identifies the video file and the settings of the run
+            frames (int): The frame to resume detection at
+            completed (bool): Whether the video is done
+        """
+        try:
+            cursor = self.sqlite_connection.cursor()
+            cursor.execute(
+                """INSERT OR REPLACE INTO checkpoint
+                (videoid, runkey, frames, completed) VALUES (?, ?, ?, ?);""",
+                (str(video_id), run_key, frames, int(completed)),
+            )
+            self.sqlite_connection.commit()
+            cursor.close()
+
+        except sqlite3.Error as error:
+            logger.error("Failed to save the checkpoint of %s: %s", video_id, error)
+
     def get_video_data(self, video_search: typing.List[str]) -> typing.List[typing.Any]:
         """Returns data about the video
 
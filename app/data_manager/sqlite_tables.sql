@@ -1,4 +1,4 @@
-CREATE TABLE video (
+CREATE TABLE IF NOT EXISTS video (
  id TEXT PRIMARY KEY,
  title TEXT NOT NULL,
  date DATETIME NOT NULL,
@@ -7,10 +7,17 @@ CREATE TABLE video (
  outputvideolength TIME NOT NULL
 );
 
-CREATE TABLE detection (
+CREATE TABLE IF NOT EXISTS detection (
  id INTEGER PRIMARY KEY AUTOINCREMENT,
  videoid TEXT NOT NULL,
  starttime TIME NOT NULL,
  endtime TIME NOT NULL,
  FOREIGN KEY (videoid) REFERENCES video(id)
 );
+
+CREATE TABLE IF NOT EXISTS checkpoint (
+ videoid TEXT PRIMARY KEY,
+ runkey TEXT NOT NULL,
+ frames INTEGER NOT NULL,
+ completed INTEGER NOT NULL
+);
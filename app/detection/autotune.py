@@ -0,0 +1,326 @@
+"""Finds the batch size, letterbox workers and torch threads that detect the most
+frames per second on this computer.
+
+The stages are measured on the first frames of a video: decoding, letterboxing, and
+the model at every batch size. The fastest batch size is then run through the whole
+pipeline with every number of letterbox workers and torch threads, which compete for
+the same cores. Tuning takes a while, so the result is cached per host and model.
+"""
+import json
+import os
+import socket
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import torch
+
+from app.common import Common
+from app.logger import get_logger
+
+from .batch_yolov8 import BatchYolov8
+from .detection_cache import file_hash
+from .frame_grabber import ThreadedFrameGrabber
+from .letterbox import BatchLetterbox
+
+logger = get_logger()
+
+AUTOTUNE_FRAMES = 128
+
+# A configuration that uses more cores must be this much faster to be picked
+MIN_SPEEDUP = 1.03
+
+
+@dataclass
+class Tuning:
+    """The fastest configuration of the pipeline for a model on a host, and the
+    frames/s of the stages it was picked from."""
+
+    batch_size: int
+    grabber_workers: int
+    torch_threads: int
+    fps: float
+    decode_fps: float = 0.0
+    letterbox_fps: float = 0.0
+    inference_fps: float = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"batch size {self.batch_size}, {self.grabber_workers} letterbox "
+            + f"workers and {self.torch_threads} torch threads ({self.fps:.1f} fps)"
+        )
+
+
+def tuning_cache_path(host: Optional[str] = None) -> Path:
+    """The file with the tunings of a host, this host by default."""
+    return Common.autotune_folder / f"{host or socket.gethostname()}.json"
+
+
+def tuning_key(
+    model: BatchYolov8, weights_path: Path, frame_shape: Tuple[int, int], cores: int
+) -> str:
+    """Identify what the speed of the pipeline depends on, besides the host.
+
+    Args:
+        model: The model to tune for.
+        weights_path: The weights of the model.
+        frame_shape: The (height, width) of the frames of the videos.
+        cores: The number of cores the pipeline may use.
+
+    Returns:
+        The key of the tuning in the cache of the host.
+    """
+    input_height, input_width = model.input_shape
+    frame_height, frame_width = frame_shape
+    return "/".join(
+        [
+            f"{weights_path.stem}-{file_hash(weights_path)[:16]}",
+            model.backend,
+            model.device.type,
+            f"{input_height}x{input_width}",
+            f"{frame_height}x{frame_width}",
+            f"{cores} cores",
+        ]
+    )
+
+
+def candidates(cores: int, frames: int) -> Tuple[List[int], List[int], List[int]]:
+    """The batch sizes, letterbox worker counts and torch thread counts to try.
+
+    Args:
+        cores: The number of cores the pipeline may use.
+        frames: The number of frames tuned on, larger batches are not tried.
+
+    Returns:
+        The batch sizes, worker counts and thread counts in increasing order.
+    """
+    batch_sizes = [int(size) for size in Common.batch_size if int(size) <= frames]
+    worker_counts = sorted({1, max(1, cores // 4), max(1, cores // 2), cores})
+    thread_counts = sorted({1, max(1, cores // 2), cores})
+    return batch_sizes or [int(Common.batch_size[0])], worker_counts, thread_counts
+
+
+def __read_frames(video_path: Path, frames: int) -> Tuple[List[Any], float]:
+    """Decode the first frames of a video.
+
+    Returns:
+        The frames, and the frames decoded per second.
+    """
+    capture = cv2.VideoCapture(str(video_path))
+    if not capture.isOpened():
+        raise RuntimeError(f"Could not open video file {video_path}")
+    decoded: List[Any] = []
+    start = time.perf_counter()
+    while len(decoded) < frames:
+        success, frame = capture.read()
+        if not success:
+            break
+        decoded.append(frame)
+    seconds = time.perf_counter() - start
+    capture.release()
+    if not decoded:
+        raise RuntimeError(f"Could not decode any frames of {video_path}")
+    return decoded, len(decoded) / seconds
+
+
+def __letterbox_fps(model: BatchYolov8, frames: List[Any]) -> float:
+    """The frames letterboxed per second by a single worker."""
+    letterbox = BatchLetterbox(
+        model.letterbox_params((frames[0].shape[0], frames[0].shape[1])), len(frames)
+    )
+    start = time.perf_counter()
+    letterbox(frames)
+    return len(frames) / (time.perf_counter() - start)
+
+
+def __inference_fps(model: BatchYolov8, frames: List[Any], batch_size: int) -> float:
+    """The frames run through the model and NMS per second, in batches of a size."""
+    batch = [frames[index % len(frames)] for index in range(batch_size)]
+    imgs = model.prepare_images(batch)
+    model.predict_batch_records(batch, imgs)  # warm up
+    repeats = max(1, len(frames) // batch_size)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.predict_batch_records(batch, imgs)
+    return batch_size * repeats / (time.perf_counter() - start)
+
+
+def __pipeline_fps(
+    model: BatchYolov8,
+    video_path: Path,
+    batch_size: int,
+    workers: int,
+    frames: int,
+) -> float:
+    """The frames of the first batches of a video detected per second, from decoding
+    to NMS."""
+    with ThreadedFrameGrabber(
+        batch_size=batch_size, model=model, video_path=video_path, num_workers=workers
+    ) as frame_grabber:
+        detected = 0
+        start = time.perf_counter()
+        while detected < frames and not frame_grabber.is_done():
+            batch = frame_grabber.get_batch()
+            if batch is None:
+                continue
+            processed_batch, original_batch, _ = batch
+            model.predict_batch_records(original_batch, processed_batch)
+            frame_grabber.release_batch(processed_batch)
+            detected += len(original_batch)
+        seconds = time.perf_counter() - start
+    return detected / seconds if detected else 0.0
+
+
+def __fastest(fps: Dict[Any, float]) -> Any:
+    """The fastest configuration, or a cheaper one that is almost as fast.
+
+    The configurations are in increasing order of the resources they use.
+    """
+    best = max(fps.values())
+    return next(config for config, speed in fps.items() if speed * MIN_SPEEDUP >= best)
+
+
+def autotune(  # pylint: disable=too-many-arguments,too-many-locals
+    model: BatchYolov8,
+    video_path: Path,
+    cores: int = 0,
+    frames: int = AUTOTUNE_FRAMES,
+    batch_sizes: Optional[List[int]] = None,
+    worker_counts: Optional[List[int]] = None,
+    thread_counts: Optional[List[int]] = None,
+) -> Tuning:
+    """Measure the pipeline on the first frames of a video, and find its fastest
+    configuration.
+
+    The torch threads are left as they were, apply the tuning with
+    torch.set_num_threads.
+
+    Args:
+        model: The model to tune for.
+        video_path: A video like the ones that will be detected.
+        cores: The number of cores the pipeline may use, all of them when 0.
+        frames: The number of frames to measure every configuration on.
+        batch_sizes: The batch sizes to try, see candidates.
+        worker_counts: The numbers of letterbox workers to try.
+        thread_counts: The numbers of torch threads to try. Only the current
+                       number is tried with the onnx backend, as its threads are set
+                       when the model is loaded.
+
+    Returns:
+        The fastest configuration.
+    """
+    cores = cores if cores > 0 else os.cpu_count() or 1
+    default_batch_sizes, default_workers, default_threads = candidates(cores, frames)
+    batch_sizes = batch_sizes or default_batch_sizes
+    worker_counts = worker_counts or default_workers
+    thread_counts = thread_counts or default_threads
+    initial_threads = torch.get_num_threads()
+    if model.backend == "onnx":
+        thread_counts = [initial_threads]
+
+    decoded, decode_fps = __read_frames(video_path, frames)
+    letterbox_fps = __letterbox_fps(model, decoded)
+
+    # Larger batches stop paying off at some point, and only get slower after that
+    torch.set_num_threads(max(thread_counts))
+    inference_fps: Dict[int, float] = {}
+    for batch_size in batch_sizes:
+        inference_fps[batch_size] = __inference_fps(model, decoded, batch_size)
+        logger.debug("Batch size %s: %.1f fps", batch_size, inference_fps[batch_size])
+        if inference_fps[batch_size] < max(inference_fps.values()) / MIN_SPEEDUP:
+            break
+    batch_size = __fastest(inference_fps)
+
+    pipeline_fps: Dict[Tuple[int, int], float] = {}
+    try:
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            for workers in worker_counts:
+                pipeline_fps[(threads, workers)] = __pipeline_fps(
+                    model, video_path, batch_size, workers, len(decoded)
+                )
+                logger.debug(
+                    "%s threads, %s workers: %.1f fps",
+                    threads,
+                    workers,
+                    pipeline_fps[(threads, workers)],
+                )
+    finally:
+        torch.set_num_threads(initial_threads)
+    threads, workers = __fastest(pipeline_fps)
+
+    return Tuning(
+        batch_size=batch_size,
+        grabber_workers=workers,
+        torch_threads=threads,
+        fps=pipeline_fps[(threads, workers)],
+        decode_fps=decode_fps,
+        letterbox_fps=letterbox_fps,
+        inference_fps=inference_fps[batch_size],
+    )
+
+
+def load_tunings(host: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """The cached tunings of a host by key, this host by default."""
+    path = tuning_cache_path(host)
+    if not path.exists():
+        return {}
+    try:
+        tunings: Dict[str, Dict[str, Any]] = json.loads(path.read_text("utf-8"))
+        return tunings
+    except (OSError, ValueError) as err:
+        logger.warning("Could not read the tunings in %s", path, exc_info=err)
+        return {}
+
+
+def load_or_autotune(
+    model: BatchYolov8,
+    weights_path: Path,
+    video_path: Path,
+    cores: int = 0,
+    frames: int = AUTOTUNE_FRAMES,
+) -> Tuning:
+    """The tuning of the model on this host, tuned on a video the first time.
+
+    Args:
+        model: The model to tune for.
+        weights_path: The weights of the model.
+        video_path: A video like the ones that will be detected.
+        cores: The number of cores the pipeline may use, all of them when 0.
+        frames: The number of frames to measure every configuration on.
+
+    Returns:
+        The fastest configuration.
+    """
+    cores = cores if cores > 0 else os.cpu_count() or 1
+    capture = cv2.VideoCapture(str(video_path))
+    frame_shape = (
+        int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+    )
+    capture.release()
+    key = tuning_key(model, weights_path, frame_shape, cores)
+
+    tunings = load_tunings()
+    if key in tunings:
+        try:
+            return Tuning(**tunings[key])
+        except TypeError:
+            logger.warning("Ignoring the outdated tuning of %s", key)
+
+    logger.info("Tuning %s on %s", key, video_path)
+    start = time.perf_counter()
+    tuning = autotune(model, video_path, cores, frames)
+    logger.info("Tuned in %.0f s: %s", time.perf_counter() - start, tuning)
+
+    # Other processes on this host may have tuned other models in the meantime
+    tunings = load_tunings()
+    tunings[key] = asdict(tuning)
+    path = tuning_cache_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+    temporary_path.write_text(json.dumps(tunings, indent=4), "utf-8")
+    os.replace(temporary_path, path)
+    return tuning
@@ -1,6 +1,8 @@
 """Yolov8 class for running inference on video. """
 import copy
+import json
 import os
+import time
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
@@ -13,10 +15,28 @@ from ultralytics.utils.checks import check_imgsz
 from ultralytics.utils.ops import non_max_suppression, scale_boxes
 from ultralytics.utils.torch_utils import select_device
 
+from app.detection.letterbox import LetterboxParams
+from app.detection.onnx_model import OnnxModel
+from app.detection.pipeline_metrics import PipelineMetrics
+from app.detection.tensor_pool import TensorPool
 from app.logger import get_logger
 
 logger = get_logger()
 
+# Columnar layout of a single detection, one row per box
+DETECTION_DTYPE = np.dtype(
+    [
+        ("xmin", np.int32),
+        ("ymin", np.int32),
+        ("xmax", np.int32),
+        ("ymax", np.int32),
+        ("width", np.int32),
+        ("height", np.int32),
+        ("class_id", np.int32),
+        ("conf", np.float32),
+    ]
+)
+
 
 class BatchYolov8:  # pylint: disable=too-many-instance-attributes
     """Yolov8 class for running inference on video."""
@@ -32,7 +52,29 @@ class BatchYolov8:  # pylint: disable=too-many-instance-attributes
         agnostic_nms: bool = False,
         classes: Optional[List[str]] = None,
         colors: Optional[List[Tuple[int, int, int]]] = None,
+        backend: str = "torch",
+        threads: int = 0,
     ) -> None:
+        """
+        Args:
+            weights_path: The weights of the model.
+            device: The device to run the model on.
+            img_size: The size of the images passed to the model.
+            conf_thres: The confidence a detection needs.
+            iou_thres: The overlap at which NMS removes a detection.
+            augment: Run the model on augmented images as well.
+            agnostic_nms: Run NMS across the classes.
+            classes: Only keep detections of these classes.
+            colors: The color of every class.
+            backend: "torch" runs the model in PyTorch, "onnx" exports it once and
+                     runs it with ONNX Runtime on the CPU. Weights in an .onnx file,
+                     like quantized models, always use "onnx" and their own size.
+            threads: The number of threads of an operator with the onnx backend,
+                     0 lets ONNX Runtime choose.
+
+        Raises:
+            RuntimeError: If the device, the weights or the backend can not be used.
+        """
         try:
             self.device = select_device(device)
         except Exception as err:
@@ -41,20 +83,34 @@ class BatchYolov8:  # pylint: disable=too-many-instance-attributes
 
         self.weights_name = os.path.split(weights_path)[-1]
 
-        try:
-            (self.model, _) = attempt_load_one_weight(
-                str(weights_path), device=self.device
+        self.model: Any
+        self.names: Any
+        if Path(weights_path).suffix == ".onnx":
+            # A quantized model, see app.detection.quantization
+            self.model = OnnxModel(Path(weights_path), threads)
+            self.names = {
+                int(class_id): name
+                for class_id, name in json.loads(self.model.metadata["names"]).items()
+            }
+            stride = int(self.model.metadata["stride"])
+            img_size = int(self.model.metadata["imgsz"])
+            backend = "onnx"
+        else:
+            try:
+                (self.model, _) = attempt_load_one_weight(
+                    str(weights_path), device=self.device
+                )
+                # self.model = attempt_load(weights_path, device=self.device) V5
+            except Exception as err:
+                logger.error("Failed to load model", exc_info=err)
+                raise RuntimeError("Failed to load model", err) from err
+
+            self.names = (
+                self.model.module.names
+                if hasattr(self.model, "module")
+                else self.model.names
             )
-            # self.model = attempt_load(weights_path, device=self.device) V5
-        except Exception as err:
-            logger.error("Failed to load model", exc_info=err)
-            raise RuntimeError("Failed to load model", err) from err
-
-        self.names = (
-            self.model.module.names
-            if hasattr(self.model, "module")
-            else self.model.names
-        )
+            stride = self.model.stride.max()
         if colors is None:
             self.colors: List[Tuple[int, int, int]] = [
                 (
@@ -67,7 +123,7 @@ class BatchYolov8:  # pylint: disable=too-many-instance-attributes
             logger.debug("Color is none, setting random colors.")
         else:
             self.colors = colors
-        self.imgsz = check_imgsz(img_size, stride=self.model.stride.max())
+        self.imgsz = check_imgsz(img_size, stride=stride)
         # self.imgsz = check_img_size(img_size, s=self.model.stride.max()) V5
         self.conf_thres = conf_thres
         self.iou_thres = iou_thres
@@ -75,6 +131,16 @@ class BatchYolov8:  # pylint: disable=too-many-instance-attributes
         self.agnostic_nms = agnostic_nms
         self.classes = classes
         self.half = self.device.type != "cpu"
+        self.backend = backend
+        if backend == "onnx":
+            if self.device.type != "cpu" or augment:
+                raise RuntimeError("The onnx backend runs on the CPU without augment")
+            if not isinstance(self.model, OnnxModel):
+                self.model = OnnxModel.from_weights(
+                    self.model, Path(weights_path), self.input_shape, threads
+                )
+        elif backend != "torch":
+            raise RuntimeError(f"Unknown inference backend {backend}")
         if self.half:
             self.model.half()
         if self.device.type != "cpu":
@@ -112,6 +178,7 @@ class BatchYolov8:  # pylint: disable=too-many-instance-attributes
     def __str__(self) -> str:
         out = [
             f"Model: {self.weights_name}",
+            f"Backend: {self.backend}",
             f"Image size: {self.imgsz}",
             f"Confidence threshold: {self.conf_thres}",
             f"IoU threshold: {self.iou_thres}",
@@ -149,13 +216,50 @@ class BatchYolov8:  # pylint: disable=too-many-instance-attributes
             A list of predictions.
         """
 
-        # imgs = self.prepare_images(img0s)
+        batch_output = []
+        for records in self.predict_batch_records(img0s, imgs, max_detections):
+            min_max_list = self.records_to_min_max_list(records)
+            if max_objects is not None:
+                min_max_list = self.max_objects_filter(
+                    min_max_list, max_objects, name_key="name"
+                )
+
+            batch_output.append(min_max_list)
+
+        return batch_output
+
+    def predict_batch_records(
+        self,
+        img0s: List[Any],
+        imgs: torch.Tensor,
+        max_detections: int = 300,
+        metrics: Optional[PipelineMetrics] = None,
+    ) -> List[np.ndarray[Any, Any]]:
+        """Predict on a batch of images and return the detections in columnar form.
+
+        The detections of the whole batch are moved to the host in one transfer.
+
+        Args:
+            img0s: The list of original images.
+            imgs: The prepared images.
+            max_detections: Max number of detections per image.
+            metrics: Record the time of inference, NMS and post-processing. The GPU
+                     is synchronized after inference, so it is not counted as NMS.
+
+        Returns:
+            A structured array with DETECTION_DTYPE for each image.
+        """
 
         with torch.no_grad():
+            start = time.perf_counter()
             # Run model
             inf_out, _ = self.model(
                 imgs, augment=self.augment
             )  # inference and training outputs
+            if metrics is not None:
+                if self.device.type == "cuda":
+                    torch.cuda.synchronize(self.device)
+                start = self.__record(metrics, "inference", start)
 
             # Run NMS
             preds = non_max_suppression(
@@ -164,20 +268,29 @@ class BatchYolov8:  # pylint: disable=too-many-instance-attributes
                 iou_thres=self.iou_thres,
                 max_det=max_detections,
             )
+            if metrics is not None:
+                start = self.__record(metrics, "nms", start)
 
-        batch_output = []
-        for det, img0, img in zip(preds, img0s, imgs):
-            if det is not None and len(det):
-                det[:, :4] = scale_boxes(img.shape[1:], det[:, :4], img0.shape).round()
-            min_max_list = self.min_max_list(det)
-            if min_max_list is not None and max_objects is not None:
-                min_max_list = self.max_objects_filter(
-                    min_max_list, max_objects, name_key="name"
-                )
+            for det, img0 in zip(preds, img0s):
+                if len(det):
+                    det[:, :4] = scale_boxes(
+                        imgs.shape[2:], det[:, :4], img0.shape
+                    ).round()
 
-            batch_output.append(min_max_list)
+            counts = [len(det) for det in preds]
+            detections = torch.cat(preds).cpu().numpy()
 
-        return batch_output
+        records = self.detections_to_records(detections)
+        if metrics is not None:
+            self.__record(metrics, "postprocess", start)
+        return np.split(records, np.cumsum(counts)[:-1])
+
+    @staticmethod
+    def __record(metrics: PipelineMetrics, stage: str, start: float) -> float:
+        """Record the time from start until now in a stage, and return now."""
+        end = time.perf_counter()
+        metrics.add(stage, start, end)
+        return end
 
     def prepare_image(self, original_img: np.ndarray[Any, Any] | List[Any]) -> Tensor:
         """Prepare image for inference by normalizing and reshaping.
@@ -196,6 +309,41 @@ class BatchYolov8:  # pylint: disable=too-many-instance-attributes
 
         return new_img
 
+    @property
+    def input_shape(self) -> Tuple[int, int]:
+        """The (height, width) of the images passed to the model."""
+        if isinstance(self.imgsz, int):
+            return (self.imgsz, self.imgsz)
+        return (int(self.imgsz[0]), int(self.imgsz[1]))
+
+    def create_tensor_pool(self, size: int, batch_size: int) -> TensorPool:
+        """Create a pool of input tensors for the model.
+
+        Args:
+            size: The number of batches in the pool.
+            batch_size: The number of images in a batch.
+
+        Returns:
+            The tensor pool.
+        """
+        return TensorPool(
+            size,
+            (batch_size, 3, *self.input_shape),
+            torch.float16 if self.half else torch.float32,
+            self.device,
+        )
+
+    def letterbox_params(self, frame_shape: Tuple[int, int]) -> LetterboxParams:
+        """Get the letterbox parameters for frames of the given shape.
+
+        Args:
+            frame_shape: The (height, width) of the frames.
+
+        Returns:
+            The letterbox parameters for the model input size.
+        """
+        return LetterboxParams.from_shape(frame_shape, self.imgsz)
+
     def reshape_copy_img(self, img: np.ndarray[Any, Any]) -> np.ndarray[Any, Any]:
         """Reshape and copy image.
 
@@ -253,6 +401,64 @@ class BatchYolov8:  # pylint: disable=too-many-instance-attributes
             return np.array(padded_img_list)
         return padded_img_list
 
+    @staticmethod
+    def detections_to_records(det: np.ndarray[Any, Any]) -> np.ndarray[Any, Any]:
+        """Convert detections to a structured array of bounding boxes.
+
+        Args:
+            det: The detections as an (n, 6) array of xyxy, confidence and class.
+
+        Returns:
+            The bounding boxes as a structured array with DETECTION_DTYPE.
+        """
+        coords = det[:, :4].astype(np.int32)
+        records = np.empty(len(det), dtype=DETECTION_DTYPE)
+        records["xmin"] = np.minimum(coords[:, 0], coords[:, 2])
+        records["xmax"] = np.maximum(coords[:, 0], coords[:, 2])
+        records["ymin"] = np.minimum(coords[:, 1], coords[:, 3])
+        records["ymax"] = np.maximum(coords[:, 1], coords[:, 3])
+        records["width"] = records["xmax"] - records["xmin"]
+        records["height"] = records["ymax"] - records["ymin"]
+        records["class_id"] = det[:, 5]
+        records["conf"] = det[:, 4]
+        return records
+
+    def records_to_min_max_list(self, records: np.ndarray[Any, Any]) -> List[Any]:
+        """Create a list of bounding boxes from a structured array of detections.
+
+        Args:
+            records: The detections as a structured array with DETECTION_DTYPE.
+
+        Returns:
+            The list of bounding boxes.
+        """
+        return [
+            {
+                "bndbox": {
+                    "xmin": xmin,
+                    "xmax": xmax,
+                    "ymin": ymin,
+                    "ymax": ymax,
+                    "width": width,
+                    "height": height,
+                },
+                "name": self.names[class_id],
+                "class_id": class_id,
+                "conf": conf,
+                "color": self.colors[class_id],
+            }
+            for (
+                xmin,
+                ymin,
+                xmax,
+                ymax,
+                width,
+                height,
+                class_id,
+                conf,
+            ) in records.tolist()
+        ]
+
     def min_max_list(self, det: Any) -> Optional[List[Any]]:
         """Create a list of bounding boxes from the detection.
 
@@ -262,30 +468,12 @@ class BatchYolov8:  # pylint: disable=too-many-instance-attributes
         Returns:
             The list of bounding boxes.
         """
-        min_max_list = []
-        if det is not None:
-            for i, class_id in enumerate(det[:, -1]):
-                obj = {
-                    "bndbox": {
-                        "xmin": min(int(det[i][0]), int(det[i][2])),
-                        "xmax": max(int(det[i][0]), int(det[i][2])),
-                        "ymin": min(int(det[i][1]), int(det[i][3])),
-                        "ymax": max(int(det[i][1]), int(det[i][3])),
-                        "width": max(int(det[i][0]), int(det[i][2]))
-                        - min(int(det[i][0]), int(det[i][2])),
-                        "height": max(int(det[i][1]), int(det[i][3]))
-                        - min(int(det[i][1]), int(det[i][3])),
-                    },
-                    "name": self.names[int(class_id)],
-                    "class_id": int(class_id),
-                    "conf": float(det[i][4]),
-                    "color": self.colors[int(det[i][5])],
-                }
-                min_max_list.append(obj)
-
-            return min_max_list
-
-        return None
+        if det is None:
+            return None
+
+        if isinstance(det, Tensor):
+            det = det.cpu().numpy()
+        return self.records_to_min_max_list(self.detections_to_records(det))
 
     @staticmethod
     def max_objects_filter(
@@ -1,22 +1,111 @@
 """Detection module for running inference on video."""
 import threading
 import time
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Any, Callable, List, Tuple
+from typing import Any, Callable, ContextManager, List, Tuple
 
 import cv2
+import numpy as np
 import torch
 from tqdm import tqdm
-from ultralytics.utils.plotting import Annotator
 
 from app import settings
 from app.logger import get_logger
+from app.video_processor.video_processor import Annotator
 
 from .batch_yolov8 import BatchYolov8
+from .detection_store import DetectionStore
 from .frame_grabber import ThreadedFrameGrabber
+from .frame_sampler import FrameSampler, expand_sampled_frames, sampled_frames_with_fish
+from .motion_gate import MotionGate
+from .pipeline_metrics import PipelineMetrics
+from .process_frame_grabber import ProcessFrameGrabber
 
 logger = get_logger()
 
+FrameGrabber = ThreadedFrameGrabber | ProcessFrameGrabber
+
+
+def __create_frame_grabber(  # pylint: disable=too-many-arguments
+    backend: str,
+    model: BatchYolov8,
+    video_path: Path,
+    batch_size: int,
+    decoders: int = 1,
+    sampler: FrameSampler | None = None,
+    motion_gate: MotionGate | None = None,
+    start_frame: int = 0,
+    workers: int = 0,
+    metrics: PipelineMetrics | None = None,
+) -> FrameGrabber:
+    """Create the frame grabber for a backend.
+
+    Args:
+        backend: "thread" to decode and preprocess in threads,
+                 "process" to do it in separate processes.
+        model: The Yolov8 batcher model.
+        video_path: The path to the video to process.
+        batch_size: The batch size.
+        decoders: The number of segments to decode in parallel, thread backend only.
+        sampler: Decides which frames are passed to the model, thread backend only.
+        motion_gate: Skips frames without motion, thread backend only.
+        start_frame: The batch boundary to start at, thread backend only.
+        workers: The number of threads or processes that letterbox the frames,
+                 0 uses half the cores.
+        metrics: Record the time of the decoding and letterboxing stages,
+                 thread backend only.
+
+    Raises:
+        ValueError: If the backend is not supported, or can't start at start_frame.
+
+    Returns:
+        The frame grabber.
+    """
+    match backend:
+        case "thread":
+            return ThreadedFrameGrabber(
+                model=model,
+                video_path=video_path,
+                batch_size=batch_size,
+                decoders=decoders,
+                sampler=sampler,
+                motion_gate=motion_gate,
+                start_frame=start_frame,
+                num_workers=workers,
+                metrics=metrics,
+            )
+        case "process":
+            if start_frame > 0:
+                raise ValueError("The process backend can't start mid-video")
+            if decoders > 1:
+                logger.warning("The process backend decodes with a single decoder")
+            if sampler is not None or motion_gate is not None:
+                logger.warning("The process backend runs the model on every frame")
+            return ProcessFrameGrabber(
+                model=model,
+                video_path=video_path,
+                batch_size=batch_size,
+                num_workers=workers,
+            )
+    raise ValueError(f"Unsupported frame grabber backend {backend}")
+
+
+def __get_fps(video_path: Path) -> float:
+    """Get the FPS of a video."""
+    cap = cv2.VideoCapture(str(video_path))
+    fps = float(cap.get(cv2.CAP_PROP_FPS))
+    cap.release()
+    return fps
+
+
+def __get_frame_count(video_path: Path) -> int:
+    """Get the number of frames in a video."""
+    cap = cv2.VideoCapture(str(video_path))
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return frame_count
+
 
 def __create_video_writer(
     save_path: Path,
@@ -47,54 +136,62 @@ def __annotate_batch(
     vid_writer: cv2.VideoWriter,
     results: List[torch.Tensor],
     img0s: List[Any],
-    names: List[str],
+    annotator: Annotator,
     colors: List[Tuple[int, int, int]],
 ) -> None:
-    """Annotates a batch of images and writes them to a video."""
+    """Annotates a batch of images in place and writes them to a video."""
 
     for predictions, img0 in zip(results, img0s):
-        # pred = F.softmax(res, dim=1)  # probabilities
-        annotator = Annotator(img0, line_width=2, example=str(names), pil=True)
         for pred in predictions:
-            # top5i = prob.argsort(0, descending=True)[:5].tolist()  # top 5 indices
             text = f"{pred['conf']:.2f} {pred['name']}"
-            # annotator.text((32, 32), text, txt_color=(0, 255, 255))
             bndbox = pred["bndbox"]
 
-            xyxy = (bndbox["xmin"], bndbox["ymin"], bndbox["xmax"], bndbox["ymax"])
-            annotator.box_label(xyxy, text, color=colors[pred["class_id"]])
-        im0 = annotator.result()
+            xyxy = (
+                int(bndbox["xmin"]),
+                int(bndbox["ymin"]),
+                int(bndbox["xmax"]),
+                int(bndbox["ymax"]),
+            )
+            annotator.draw(img0, xyxy, text, color=tuple(colors[pred["class_id"]]))
 
         # Write to the video
-        vid_writer.write(im0)
+        vid_writer.write(img0)
 
 
 def __process_batch(
     original_batch: List[Any],
     processed_batch: torch.Tensor,
     model: BatchYolov8,
-) -> Tuple[List[torch.Tensor], float]:
+    metrics: PipelineMetrics | None = None,
+) -> Tuple[List[np.ndarray[Any, Any]], float]:
     """Process a batch of frames.
 
     Args:
         batch: Batch of frames
         model: The Yolov8 model
+        metrics: Record the time of inference, NMS and post-processing.
 
     Returns:
-        The time it took to process the batch.
+        The detections of every frame as structured arrays,
+        and the time it took to process the batch.
     """
 
     start_time = time.time()
-    predictions = model.predict_batch(
-        original_batch, processed_batch, max_detections=settings.max_detections
+    records = model.predict_batch_records(
+        original_batch,
+        processed_batch,
+        max_detections=settings.max_detections,
+        metrics=metrics,
     )
     end_time = time.time()
     delta = end_time - start_time
-    return predictions, delta
+    return records, delta
 
 
 # pylint: disable=too-many-arguments
 # pylint: disable=too-many-locals
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
 def process_video(
     model: BatchYolov8,
     video_path: Path,
@@ -103,6 +200,20 @@ def process_video(
     output_path: Path | None,
     stop_event: threading.Event,
     notify_progress: Callable[[int], None] | None = None,
+    backend: str = "thread",
+    decoders: int = 1,
+    stride: int = 1,
+    adaptive: bool = False,
+    motion_gate: MotionGate | None = None,
+    notify_frames: (
+        Callable[[List[int], List[Any], List[torch.Tensor]], None] | None
+    ) = None,
+    detection_store: DetectionStore | None = None,
+    start_frame: int = 0,
+    notify_checkpoint: Callable[[int], None] | None = None,
+    conf_thres: float = 0.0,
+    grabber_workers: int = 0,
+    metrics: PipelineMetrics | None = None,
 ) -> Tuple[List[int], List[torch.Tensor]]:
     """Runs inference on a video.
     And returns a list of frames containing fish and a list of predictions for each frame.
@@ -113,76 +224,188 @@ def process_video(
         batch_size: The batch size.
         max_batches_to_queue: The maximum number of batches to queue.
         output_path: The path to save the output video to.
+        backend: The frame grabber backend, "thread" or "process".
+        decoders: The number of keyframe aligned segments to decode in parallel.
+        stride: Run the model on every stride-th frame only. Every skipped frame gets
+                the predictions of the frame before it, and the frames next to a
+                frame with fish are considered to contain fish too.
+        adaptive: Run the model on every frame within the frame gap tolerance
+                  after a detection, and on every stride-th frame otherwise.
+        motion_gate: Skip the model on frames where nothing moved. Like with the
+                     stride, skipped frames get the predictions of the frame before
+                     them. The gate counts the gated and inferred frames.
+        notify_frames: Called with the frame indices, the original frames and the
+                       predictions of every batch, before the frames are released.
+        detection_store: Append the detections to this store as they are found,
+                         instead of keeping the predictions of every frame in memory.
+        start_frame: Resume a run that was stopped at this frame, as given to
+                     notify_checkpoint. The detections of the frames before it are
+                     read from the detection_store, opened with DetectionStore.resume.
+        notify_checkpoint: Called with the frame to resume at after every batch, once
+                           the detections of the frames before it are in the
+                           detection_store. A run can only be resumed without
+                           adaptive sampling and the motion gate.
+        conf_thres: The confidence a box must be above to count as fish. The boxes
+                    between the model's own threshold and this one are only
+                    appended to the detection_store, so it can be raised later.
+        grabber_workers: The number of threads or processes that letterbox the
+                         frames, 0 uses half the cores.
+        metrics: Record the time spent in every stage of the pipeline, and the
+                 sizes of its queues. Only the stages on this thread are recorded
+                 with the process backend.
 
     Returns:
         A tuple containing:
         1. A list of frames containing fish.
-        2. A list of predictions for each frame.
+        2. A list of predictions for each frame, empty with a detection_store.
     """
 
-    with ThreadedFrameGrabber(
-        model=model,
-        video_path=video_path,
-        batch_size=batch_size,
+    if (start_frame > 0 or notify_checkpoint is not None) and detection_store is None:
+        raise ValueError("Resuming needs the detection store of the stopped run")
+
+    # The last checkpoint is the end of the video, all detections are in the store
+    if detection_store is not None and 0 < __get_frame_count(video_path) <= start_frame:
+        logger.info("Detection already done up to frame %s", start_frame)
+        detection_store.conf_thres = conf_thres
+        frames_with_fish = sampled_frames_with_fish(
+            *detection_store.sampled_frames(), start_frame
+        )
+        detection_store.close(start_frame)
+        if notify_progress is not None:
+            notify_progress(100)
+        return frames_with_fish, []
+
+    sampler = None
+    if stride > 1:
+        sampler = FrameSampler(
+            stride=stride,
+            adaptive=adaptive,
+            dense_frames=int(__get_fps(video_path) * settings.frame_buffer_seconds),
+        )
+
+    with __create_frame_grabber(
+        backend,
+        model,
+        video_path,
+        batch_size,
+        decoders,
+        sampler,
+        motion_gate,
+        start_frame,
+        grabber_workers,
+        metrics,
     ) as frame_grabber:
         if output_path is not None:
             vid_cap = frame_grabber.capture
+            width = int(vid_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(vid_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
             video_writer = __create_video_writer(
                 save_path=output_path,
                 fps=vid_cap.get(cv2.CAP_PROP_FPS),
-                width=int(vid_cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
-                height=int(vid_cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                width=width,
+                height=height,
             )
+            annotator = Annotator((width, height), line_width=2)
 
-        frames_with_fish = []
         fps_count = 0.0
-        frame_count = 0
-        processed_frames = 0
-
-        predictions_per_frame: List[torch.Tensor] = []
+        batch_count = 0
+        processed_frames = start_frame
+        # Every batch is sampled from the same number of frames with a fixed stride
+        frames_per_batch = batch_size * stride
+
+        sampled_frames: List[int] = []
+        sampled_fish: List[bool] = []
+        if start_frame > 0 and detection_store is not None:
+            detection_store.conf_thres = conf_thres
+            sampled_frames, sampled_fish = detection_store.sampled_frames()
+        sampled_predictions: List[torch.Tensor] = []
+        keep_predictions = (
+            detection_store is None
+            or output_path is not None
+            or notify_frames is not None
+        )
+
+        def timed(stage: str) -> ContextManager[None]:
+            return nullcontext() if metrics is None else metrics.time(stage)
 
         with tqdm(
-            total=frame_grabber.frame_count, desc="Processing frames", leave=False
+            total=frame_grabber.frame_count,
+            initial=start_frame,
+            desc="Processing frames",
+            leave=False,
         ) as pbar:
             while not frame_grabber.is_done():
                 if stop_event.is_set():
                     logger.info("Stopping video processing")
                     break
 
-                batch = frame_grabber.get_batch()
+                with timed("processed_queue_get"):
+                    batch = frame_grabber.get_batch()
                 if batch is None:
                     continue
 
-                processed_batch, original_batch = batch
+                processed_batch, original_batch, frame_indices = batch
 
-                (predictions, delta) = __process_batch(
-                    original_batch, processed_batch, model
+                (candidates, delta) = __process_batch(
+                    original_batch, processed_batch, model, metrics
+                )
+                if detection_store is not None:
+                    with timed("store"):
+                        detection_store.append(frame_indices, candidates)
+                records = [
+                    frame_candidates[frame_candidates["conf"] > conf_thres]
+                    for frame_candidates in candidates
+                ]
+                predictions: List[Any] = (
+                    [model.records_to_min_max_list(frame) for frame in records]
+                    if keep_predictions
+                    else []
                 )
 
                 batch_fps = len(processed_batch) / delta
                 fps_count += batch_fps
-                processed_frames += len(processed_batch)
-                pbar.update(len(processed_batch))
+                batch_count += 1
+                # Frames skipped by the sampler are processed too
+                pbar.update(frame_indices[-1] + 1 - processed_frames)
+                processed_frames = frame_indices[-1] + 1
                 pbar.set_description(f"Processing frames (FPS: {batch_fps:.2f})")
 
                 # Annotate the batch
                 if output_path is not None:
-                    __annotate_batch(
-                        vid_writer=video_writer,
-                        results=predictions,
-                        img0s=original_batch,
-                        names=model.names,
-                        colors=model.colors,
-                    )
+                    with timed("annotate"):
+                        __annotate_batch(
+                            vid_writer=video_writer,
+                            results=predictions,
+                            img0s=original_batch,
+                            annotator=annotator,
+                            colors=model.colors,
+                        )
 
                 # Check if any of the frames in the batch contain fish
-                for i, pred in enumerate(predictions):
-                    if len(pred) > 0:
-                        frames_with_fish.append(frame_count + i)
-                    predictions_per_frame.append(pred)
-
-                # Update the frame count
-                frame_count += len(original_batch)
+                for frame_index, frame_records in zip(frame_indices, records):
+                    if len(frame_records) > 0 and sampler is not None:
+                        sampler.report_detection(frame_index)
+                sampled_frames.extend(frame_indices)
+                sampled_fish.extend(len(frame_records) > 0 for frame_records in records)
+                if detection_store is None:
+                    sampled_predictions.extend(predictions)
+
+                if notify_frames is not None:
+                    notify_frames(frame_indices, original_batch, predictions)
+
+                # The frames may be reused once the batch is released
+                frame_grabber.release_batch(processed_batch)
+
+                if notify_checkpoint is not None and detection_store is not None:
+                    with timed("store"):
+                        detection_store.flush()
+                        notify_checkpoint(
+                            min(
+                                frame_grabber.frame_count,
+                                (frame_indices[-1] // frames_per_batch + 1)
+                                * frames_per_batch,
+                            )
+                        )
 
                 if notify_progress is not None:
                     notify_progress(
@@ -191,6 +414,20 @@ def process_video(
         if notify_progress is not None:
             notify_progress(100)
 
+        # The frames after the last sampled frame are processed too
+        if frame_grabber.is_done():
+            processed_frames = max(processed_frames, frame_grabber.frames_read)
+        if detection_store is None:
+            frames_with_fish, predictions_per_frame = expand_sampled_frames(
+                sampled_frames, sampled_predictions, processed_frames
+            )
+        else:
+            frames_with_fish = sampled_frames_with_fish(
+                sampled_frames, sampled_fish, processed_frames
+            )
+            predictions_per_frame = []
+            detection_store.close(processed_frames)
+
         # Close and release the video writer
         if output_path is not None and video_writer is not None:
             video_writer.release()
@@ -204,10 +441,30 @@ def process_video(
             )
 
         # Will be 0 if stop_event is set before any frames are processed
-        if processed_frames > 0:
+        if batch_count > 0:
+            logger.info("Average FPS: %s", {fps_count / batch_count})
+        if metrics is not None:
+            metrics.finish_detection(processed_frames - start_frame)
+            summary = metrics.summary()
             logger.info(
-                "Average FPS: %s",
-                {fps_count / (processed_frames / frame_grabber.batch_size)},
+                "Detected %s frames at %.1f FPS from decoding to NMS, %s-bound",
+                summary["frames"],
+                summary["fps"],
+                summary["bound"],
+            )
+        if motion_gate is not None:
+            logger.info(
+                "Motion gate skipped %s frames and passed %s frames",
+                motion_gate.gated_frames,
+                motion_gate.inferred_frames,
+            )
+        if sampler is not None or motion_gate is not None:
+            logger.info(
+                "Ran the model on %s of %s frames, skipped %s frames in %.2fs",
+                len(sampled_frames),
+                processed_frames,
+                frame_grabber.grabbed_frames,
+                frame_grabber.skip_seconds,
             )
 
     return frames_with_fish, predictions_per_frame
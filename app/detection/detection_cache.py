@@ -0,0 +1,166 @@
+"""Cache of the detections in videos, so unchanged videos are not detected again."""
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.logger import get_logger
+
+from .detection_store import DetectionStore
+
+logger = get_logger()
+
+# The number of chunks hashed from a video, spread evenly over the file
+FINGERPRINT_CHUNKS = 16
+FINGERPRINT_CHUNK_SIZE = 64 * 1024
+
+
+def video_fingerprint(
+    video_path: Path,
+    chunks: int = FINGERPRINT_CHUNKS,
+    chunk_size: int = FINGERPRINT_CHUNK_SIZE,
+) -> str:
+    """Hashes the size and evenly spread chunks of a video, without reading all of it.
+
+    Args:
+        video_path: The video to fingerprint.
+        chunks: The number of chunks to hash, including the first and the last.
+        chunk_size: The number of bytes in every chunk.
+
+    Returns:
+        The hex digest of the fingerprint.
+    """
+    size = video_path.stat().st_size
+    digest = hashlib.sha1(str(size).encode("utf-8"))
+    with open(video_path, "rb") as video_file:
+        if size <= chunks * chunk_size:
+            digest.update(video_file.read())
+        else:
+            last_chunk = size - chunk_size
+            for chunk in range(chunks):
+                video_file.seek(last_chunk * chunk // (chunks - 1))
+                digest.update(video_file.read(chunk_size))
+    return digest.hexdigest()
+
+
+def file_hash(path: Path) -> str:
+    """Hashes all of a file, like the weights of a model."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DetectionCache:
+    """Detection stores of earlier runs, found by the video and how it was detected.
+
+    An entry is the rows and the JSON file of a DetectionStore, named after the hash
+    of its key. Looking up an entry marks it as used, and the least recently used
+    entries are removed once the cache holds more than max_bytes.
+    """
+
+    def __init__(self, folder: Path, max_bytes: int) -> None:
+        """
+        Args:
+            folder: The folder to keep the entries in, created when needed.
+            max_bytes: The size the entries are trimmed down to.
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.__file_hashes: Dict[Tuple[str, int, int], str] = {}
+
+    def key(self, video_path: Path, weights_path: Path, **detection: Any) -> str:
+        """Builds the key of the detections in a video.
+
+        Args:
+            video_path: The video.
+            weights_path: The weights of the model, hashed once per file version.
+            detection: Everything else that changes the detections, like the image
+                       size and the thresholds of the model.
+
+        Returns:
+            The key, as a hex digest.
+        """
+        key = {
+            "video": video_fingerprint(video_path),
+            "weights": self.__weights_hash(weights_path),
+            "detection": detection,
+        }
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def __weights_hash(self, weights_path: Path) -> str:
+        """Hashes the weights, reusing the hash while the file is unchanged."""
+        stat = weights_path.stat()
+        version = (str(weights_path), stat.st_size, stat.st_mtime_ns)
+        if version not in self.__file_hashes:
+            self.__file_hashes[version] = file_hash(weights_path)
+        return self.__file_hashes[version]
+
+    def __entry_path(self, key: str) -> Path:
+        """The path of the rows of an entry."""
+        return self.folder / f"{key}.bin"
+
+    def get(self, key: str, store_path: Path) -> Optional[DetectionStore]:
+        """Copies the detections of a key to a store, if they are cached.
+
+        Args:
+            key: The key from DetectionCache.key.
+            store_path: The path of the store to copy the detections to.
+
+        Returns:
+            The store, or None if the key is not cached.
+        """
+        entry = DetectionStore(self.__entry_path(key))
+        if not entry.path.exists() or not entry.meta_path.exists():
+            return None
+
+        # The modification time is when the entry was last used
+        os.utime(entry.path)
+        store = DetectionStore(store_path)
+        shutil.copyfile(entry.path, store.path)
+        shutil.copyfile(entry.meta_path, store.meta_path)
+        return DetectionStore.load(store_path)
+
+    def put(self, key: str, store: DetectionStore) -> None:
+        """Caches the detections of a closed store under a key, and trims the cache.
+
+        Args:
+            key: The key from DetectionCache.key.
+            store: The store with all the detections in the video.
+        """
+        self.folder.mkdir(parents=True, exist_ok=True)
+        entry = DetectionStore(self.__entry_path(key))
+        # Copy the rows last, an entry without rows is not found
+        shutil.copyfile(store.meta_path, entry.meta_path)
+        # Unique to the process, as detection workers can share the cache
+        temporary_path = entry.path.with_name(f"{key}.{os.getpid()}.tmp")
+        shutil.copyfile(store.path, temporary_path)
+        os.replace(temporary_path, entry.path)
+        self.trim()
+
+    def trim(self) -> None:
+        """Removes the least recently used entries until the cache fits in max_bytes."""
+        entries: List[Tuple[float, int, Path]] = []
+        for path in self.folder.glob("*.bin"):
+            meta_path = path.with_suffix(".json")
+            try:
+                stat = path.stat()
+                size = stat.st_size
+                if meta_path.exists():
+                    size += meta_path.stat().st_size
+            except FileNotFoundError:
+                # Removed by another process trimming the cache
+                continue
+            entries.append((stat.st_mtime, size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logger.debug("Removing %s from the detection cache", path.stem)
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
+            total -= size
@@ -0,0 +1,268 @@
+"""On-disk store of the detections in a video, one row per box."""
+import json
+import os
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.video_processor import Detection
+
+from .frame_sampler import sampled_frames_with_fish
+
+STORE_DTYPE = np.dtype(
+    [
+        ("frame", np.int64),
+        ("class_id", np.int32),
+        ("conf", np.float32),
+        ("xmin", np.int32),
+        ("ymin", np.int32),
+        ("xmax", np.int32),
+        ("ymax", np.int32),
+    ]
+)
+
+# The class id of the row written for a frame the model ran on without finding fish
+NO_DETECTIONS = -1
+
+# The confidence the model keeps candidate boxes from, so the boxes above any higher
+# threshold can be picked from the store without running the model again
+CANDIDATE_CONFIDENCE = 0.05
+
+
+class DetectionStore(Mapping[int, List[Detection]]):
+    """Detections appended to a file of fixed-width rows as the model runs.
+
+    Every frame the model ran on has rows in the file, one per box, or a single row
+    with class id NO_DETECTIONS. The rows are read back through a memory map, and a
+    frame the model skipped holds the detections of the last frame before it that the
+    model ran on, like expand_sampled_frames. The class names and the number of
+    frames are kept in a JSON file next to the rows.
+
+    The rows can hold candidate boxes below the confidence threshold, only the boxes
+    with a confidence above conf_thres are looked up and counted as fish. As boxes
+    suppressed by NMS always overlap a box with a higher confidence, these are the
+    boxes the model finds with conf_thres as its own threshold.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        names: Optional[Dict[int, str]] = None,
+        frame_count: int = 0,
+        conf_thres: float = 0.0,
+    ) -> None:
+        """
+        Args:
+            path: The file with the rows, use create or load to open one.
+            names: The class names by class id.
+            frame_count: The number of frames in the video.
+            conf_thres: The confidence a box must be above to be looked up.
+        """
+        self.path = path
+        self.names: Dict[int, str] = names or {}
+        self.frame_count = frame_count
+        self.conf_thres = conf_thres
+        self.file: Optional[BinaryIO] = None
+        self.__rows: Optional[np.ndarray[Any, Any]] = None
+
+    @property
+    def meta_path(self) -> Path:
+        """The path of the JSON file with the class names and the frame count."""
+        return self.path.with_suffix(".json")
+
+    @classmethod
+    def create(
+        cls, path: Path, names: Dict[int, str] | Sequence[str]
+    ) -> "DetectionStore":
+        """Creates an empty store to append to, replacing any store at the path.
+
+        Args:
+            path: The file to write the rows to.
+            names: The class names of the model, by class id.
+        """
+        if not isinstance(names, dict):
+            names = dict(enumerate(names))
+        store = cls(path, {int(key): str(value) for key, value in names.items()})
+        store.file = open(path, "wb")  # pylint: disable=consider-using-with
+        store.write_meta()
+        return store
+
+    @classmethod
+    def load(cls, path: Path) -> "DetectionStore":
+        """Opens a store written before, its rows are only read when looked up."""
+        store = cls(path)
+        with open(store.meta_path, "r", encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+        store.names = {int(key): value for key, value in meta["names"].items()}
+        store.frame_count = int(meta["frame_count"])
+        return store
+
+    @classmethod
+    def resume(cls, path: Path, start_frame: int) -> "DetectionStore":
+        """Opens a store written before to append to from a frame on.
+
+        The rows of the frames at or after start_frame, written after the last
+        checkpoint, are dropped.
+
+        Args:
+            path: The file with the rows.
+            start_frame: The first frame that will be appended.
+        """
+        store = cls.load(path)
+        rows = np.memmap(path, dtype=STORE_DTYPE, mode="r")
+        keep = int(np.searchsorted(rows["frame"], start_frame, side="left"))
+        # Let go of the memory map before the file shrinks
+        del rows
+
+        store.file = open(path, "r+b")  # pylint: disable=consider-using-with
+        store.file.truncate(keep * STORE_DTYPE.itemsize)
+        store.file.seek(0, os.SEEK_END)
+        store.frame_count = start_frame
+        return store
+
+    def __enter__(self) -> "DetectionStore":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def write_meta(self) -> None:
+        """Writes the class names and the frame count."""
+        with open(self.meta_path, "w", encoding="utf-8") as meta_file:
+            json.dump({"names": self.names, "frame_count": self.frame_count}, meta_file)
+
+    def append(
+        self, frame_indices: List[int], records: List[np.ndarray[Any, Any]]
+    ) -> None:
+        """Appends the detections of frames the model ran on, in frame order.
+
+        Args:
+            frame_indices: The index of every frame.
+            records: The detections of every frame, as structured arrays with
+                     DETECTION_DTYPE from BatchYolov8.predict_batch_records.
+        """
+        if self.file is None:
+            raise ValueError("The store was not created for writing")
+        if len(frame_indices) == 0:
+            return
+
+        counts = [max(1, len(frame_records)) for frame_records in records]
+        rows = np.zeros(sum(counts), dtype=STORE_DTYPE)
+        rows["frame"] = np.repeat(frame_indices, counts)
+        rows["class_id"] = NO_DETECTIONS
+
+        boxes: np.ndarray[Any, Any] = np.concatenate(records)
+        has_boxes = np.repeat(
+            [len(frame_records) > 0 for frame_records in records], counts
+        )
+        for column in ("class_id", "conf", "xmin", "ymin", "xmax", "ymax"):
+            rows[column][has_boxes] = boxes[column]
+
+        rows.tofile(self.file)
+        self.frame_count = max(self.frame_count, frame_indices[-1] + 1)
+        self.__rows = None
+
+    def flush(self) -> None:
+        """Writes the appended rows through to the disk, so they survive a crash."""
+        if self.file is None:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self, frame_count: Optional[int] = None) -> None:
+        """Finishes writing the store.
+
+        Args:
+            frame_count: The number of frames in the video, if more than the model
+                         ran on.
+        """
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        if frame_count is not None:
+            self.frame_count = max(self.frame_count, frame_count)
+        self.write_meta()
+
+    @property
+    def rows(self) -> np.ndarray[Any, Any]:
+        """All the rows of the store, memory mapped."""
+        if self.__rows is None:
+            if self.file is not None:
+                self.file.flush()
+            if not self.path.exists() or self.path.stat().st_size == 0:
+                self.__rows = np.zeros(0, dtype=STORE_DTYPE)
+            else:
+                self.__rows = np.memmap(self.path, dtype=STORE_DTYPE, mode="r")
+        return self.__rows
+
+    def __first_frame(self) -> int:
+        """The first frame the model ran on, or the frame count if none."""
+        rows = self.rows
+        return int(rows["frame"][0]) if len(rows) > 0 else self.frame_count
+
+    def __getitem__(self, frame: int) -> List[Detection]:
+        frames = self.rows["frame"]
+        end = int(np.searchsorted(frames, frame, side="right"))
+        if end == 0 or frame >= self.frame_count or frame < 0:
+            raise KeyError(frame)
+
+        # The last frame the model ran on at or before this frame
+        start = int(np.searchsorted(frames, frames[end - 1], side="left"))
+        return [
+            Detection(
+                label=self.names.get(int(row["class_id"]), str(row["class_id"])),
+                confidence=float(row["conf"]),
+                xmin=int(row["xmin"]),
+                ymin=int(row["ymin"]),
+                xmax=int(row["xmax"]),
+                ymax=int(row["ymax"]),
+            )
+            for row in self.rows[start:end]
+            if row["class_id"] != NO_DETECTIONS and row["conf"] > self.conf_thres
+        ]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.__first_frame(), self.frame_count))
+
+    def __len__(self) -> int:
+        return max(0, self.frame_count - self.__first_frame())
+
+    def __is_fish(self, rows: np.ndarray[Any, Any]) -> np.ndarray[Any, Any]:
+        """Whether every row is a box above the confidence threshold."""
+        is_fish: np.ndarray[Any, Any] = (rows["class_id"] != NO_DETECTIONS) & (
+            rows["conf"] > self.conf_thres
+        )
+        return is_fish
+
+    def frames_with_detections(self) -> np.ndarray[Any, Any]:
+        """The frames the model found fish in."""
+        rows = self.rows
+        frames: np.ndarray[Any, Any] = np.unique(rows["frame"][self.__is_fish(rows)])
+        return frames
+
+    def __sampled_arrays(self) -> Tuple[np.ndarray[Any, Any], np.ndarray[Any, Any]]:
+        """The frames the model ran on, and whether it found fish in each of them."""
+        rows = self.rows
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+        # The rows are in frame order, so every frame starts where the frame changes
+        frames = rows["frame"]
+        first_rows = np.flatnonzero(np.diff(frames, prepend=frames[0] - 1))
+        has_fish = np.logical_or.reduceat(self.__is_fish(rows), first_rows)
+        return frames[first_rows], has_fish
+
+    def sampled_frames(self) -> Tuple[List[int], List[bool]]:
+        """The frames the model ran on, and whether it found fish in each of them."""
+        frames, has_fish = self.__sampled_arrays()
+        return frames.tolist(), has_fish.tolist()
+
+    def frames_with_fish(self) -> List[int]:
+        """The frames considered to contain fish, like process_video returns them.
+
+        Only reads the rows, so it is fast enough to redo for every threshold.
+        """
+        frames, has_fish = self.__sampled_arrays()
+        return sampled_frames_with_fish(frames, has_fish, self.frame_count)
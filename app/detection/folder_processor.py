@@ -0,0 +1,759 @@
+"""Processes a folder of videos: detection, cutting, the database and the report.
+
+This is the pipeline behind the detection window, without Qt, so it also runs
+headless from the command line.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+
+from app import settings
+from app.common import Common
+from app.data_manager.data_manager import DataManager
+from app.logger import get_logger
+from app.report_manager.report_manager import ReportManager
+from app.video_processor import Detection, video_processor
+from app.video_processor.streaming_cutter import StreamingCutter
+
+from . import detection
+from .autotune import Tuning, load_or_autotune
+from .batch_yolov8 import BatchYolov8
+from .detection_cache import DetectionCache
+from .detection_store import CANDIDATE_CONFIDENCE, DetectionStore
+from .motion_gate import MotionGate
+from .pipeline_metrics import PipelineMetrics
+
+logger = get_logger()
+
+# TODO: test all these file types
+ALLOWED_EXTENSIONS = (".mp4", ".m4a", ".avi", ".mkv", ".mov", ".wmv")
+
+
+@dataclass
+class VideoJob:  # pylint: disable=too-many-instance-attributes
+    """A video on its way through detection and cutting."""
+
+    video_num: int
+    num_videos: int
+    title: str
+    video_path: Path
+    out_path: Path
+    run_key: str = ""
+    start_frame: int = 0
+    frame_ranges: List[Tuple[int, int]] = field(default_factory=list)
+    detections: Mapping[int, List[Detection]] | None = None
+    needs_cut: bool = False
+    metrics: PipelineMetrics | None = None
+
+
+def _ignore(_: Any) -> None:
+    """The callback of progress nobody listens to."""
+
+
+@dataclass
+class FolderCallbacks:
+    """Where a FolderProcessor reports its progress, the log goes to the logger
+    unless it is listened to."""
+
+    log: Callable[[str], None] = logger.info
+    task_progress: Callable[[int], None] = _ignore
+    task_format: Callable[[str], None] = _ignore
+    overall_progress: Callable[[int], None] = _ignore
+    video_count: Callable[[int], None] = _ignore
+    time_left: Callable[[str], None] = _ignore
+    video_finished: Callable[[VideoJob], None] = _ignore
+
+
+def list_videos(folder_path: Path) -> List[str]:
+    """The names of the videos in a folder."""
+    return [
+        filename
+        for filename in os.listdir(folder_path)
+        if filename.lower().endswith(ALLOWED_EXTENSIONS)
+    ]
+
+
+class FolderProcessor:  # pylint: disable=too-many-instance-attributes
+    """Runs detection on the videos in a folder, cuts out the frames with fish,
+    and records the videos in the database and the report."""
+
+    def __init__(
+        self,
+        input_folder_path: Path,
+        output_folder_path: Path,
+        callbacks: FolderCallbacks | None = None,
+    ) -> None:
+        """
+        Args:
+            input_folder_path: The folder with the videos.
+            output_folder_path: The folder to save the cut videos and the report in.
+            callbacks: Where to report the progress.
+        """
+        self.input_folder_path = input_folder_path
+        self.output_folder_path = output_folder_path
+        self.callbacks = callbacks if callbacks is not None else FolderCallbacks()
+        self.model: BatchYolov8 | None = None
+        self.tuning: Tuning | None = None
+        self.stop_event = threading.Event()
+        self.start_time = time.time()
+        self.last_time_update = 0.0
+        self.progress_lock = threading.Lock()
+        self.video_progress: Dict[int, int] = {}
+        self.finished_videos = 0
+        self.detecting = False
+        self.detection_cache = DetectionCache(
+            Common.detection_cache_folder, settings.detection_cache_mb * 1024 * 1024
+        )
+
+    def stop(self) -> None:
+        """Stop processing more videos."""
+        self.log("Stopping...")
+        self.stop_event.set()
+
+    def log(self, text: str) -> None:
+        """Log text to the console."""
+        self.callbacks.log(text)
+
+    @property
+    def batch_size(self) -> int:
+        """The batch size of the tuning, or settings.batch_size without one."""
+        return (
+            self.tuning.batch_size if self.tuning is not None else settings.batch_size
+        )
+
+    def autotune(self, video_path: Path, cores: int = 0) -> None:
+        """Use the fastest batch size and threads for the model on this computer,
+        tuned on the first frames of a video unless tuned before.
+
+        Args:
+            video_path: A video of the folder.
+            cores: The number of cores the pipeline may use, all of them when 0.
+        """
+        assert self.model is not None
+        self.log("Finding the fastest batch size and threads for this computer...")
+        self.use_tuning(
+            load_or_autotune(
+                self.model, Common.weights_folder / settings.weights, video_path, cores
+            )
+        )
+
+    def use_tuning(self, tuning: Tuning) -> None:
+        """Detect with the batch size and threads of a tuning."""
+        self.tuning = tuning
+        torch.set_num_threads(tuning.torch_threads)
+        self.log(f"Using {tuning}")
+
+    def process_folder(self) -> None:
+        """Process a folder of videos.
+
+        The videos are detected one at a time, and cut in the background while the
+        next video is detected, with at most settings.pipeline_cuts cuts running.
+        """
+        with DataManager() as data_manager:
+            report_manager = ReportManager(
+                self.output_folder_path,
+                data_manager,
+            )
+
+            try:
+                report_manager.check_can_write_report()
+            except PermissionError:
+                self.log("Please close the report file.")
+                return
+
+            videos = list_videos(self.input_folder_path)
+
+            if len(videos) == 0:
+                self.log("No videos found in the input folder")
+                return
+
+            self.callbacks.video_count(len(videos))
+            self.callbacks.overall_progress(0)
+
+            if settings.autotune and self.tuning is None:
+                self.autotune(self.input_folder_path / videos[0])
+
+            jobs = self.pending_videos(videos, data_manager)
+            self.process_videos(jobs, data_manager)
+
+            if settings.get_report:
+                self.write_report(report_manager, videos)
+
+    def write_report(self, report_manager: ReportManager, videos: List[str]) -> None:
+        """Write the report of the processed videos."""
+        try:
+            report_manager.write_report(videos)
+        except PermissionError:
+            self.log("Could not write report. Please close the report file.")
+
+    def pending_videos(
+        self, videos: List[str], data_manager: DataManager
+    ) -> List[VideoJob]:
+        """Look up the checkpoints of the videos, and count the ones already done
+        as finished.
+
+        Returns the videos left to process, so the time left is only predicted from
+        the videos that are processed.
+        """
+        pending = []
+        for video in videos:
+            video_path = self.input_folder_path / video
+            run_key = self.__run_key(video_path)
+            start_frame, completed = data_manager.get_checkpoint(video_path, run_key)
+            if completed:
+                self.log(f"Skipping {video}, already done")
+            else:
+                pending.append((video, run_key, start_frame))
+
+        self.finished_videos = len(videos) - len(pending)
+        self.callbacks.overall_progress(self.finished_videos)
+        return [
+            VideoJob(
+                video_num=i,
+                num_videos=len(pending),
+                title=video,
+                video_path=self.input_folder_path / video,
+                out_path=self.output_folder_path / f"{Path(video).stem}_processed.mp4",
+                run_key=run_key,
+                start_frame=start_frame,
+            )
+            for i, (video, run_key, start_frame) in enumerate(pending)
+        ]
+
+    def process_videos(
+        self, jobs: Iterable[VideoJob], data_manager: DataManager
+    ) -> None:
+        """Detect and cut videos, the database is only written to from the calling
+        thread, once a cut is done.
+
+        Args:
+            jobs: The videos from pending_videos, they are taken one at a time.
+            data_manager: The database to record the finished videos in.
+        """
+        cuts: Deque[Tuple[VideoJob, Future[None]]] = deque()
+        with ThreadPoolExecutor(
+            max_workers=max(1, settings.pipeline_cuts)
+        ) as cut_executor:
+            for pending_job in jobs:
+                self.log(
+                    f"Processing {pending_job.video_num + 1}/{pending_job.num_videos} "
+                    + f"({pending_job.title})"
+                )
+                job = self.process_video(pending_job, data_manager)
+                if job is None:
+                    break
+
+                if settings.pipeline_cuts <= 0:
+                    self.cut_video(job)
+                    self.__finish_video(job, data_manager)
+                    continue
+
+                # Wait for a cut to finish before starting another one
+                self.__finish_cuts(cuts, data_manager, settings.pipeline_cuts - 1)
+                cuts.append((job, cut_executor.submit(self.cut_video, job)))
+                self.__finish_cuts(cuts, data_manager, len(cuts), block=False)
+
+            self.__finish_cuts(cuts, data_manager, 0)
+
+    def __finish_cuts(
+        self,
+        cuts: Deque[Tuple[VideoJob, Future[None]]],
+        data_manager: DataManager,
+        max_cuts: int,
+        block: bool = True,
+    ) -> None:
+        """Finish the cut videos in the order they were detected.
+
+        Args:
+            cuts: The videos being cut, oldest first.
+            data_manager: The database to record the finished videos in.
+            max_cuts: Wait until no more than this many videos are being cut.
+            block: Wait for the cuts, otherwise only finish the ones that are done.
+        """
+        while cuts and (len(cuts) > max_cuts or cuts[0][1].done()):
+            if not block and not cuts[0][1].done():
+                break
+            job, cut = cuts.popleft()
+            cut.result()
+            self.__finish_video(job, data_manager)
+
+    def __finish_video(self, job: VideoJob, data_manager: DataManager) -> None:
+        """Record a processed video in the database, and delete the original
+        if the user has selected to do so."""
+        if job.metrics is not None:
+            self.__write_metrics(job, job.metrics)
+        if job.frame_ranges:
+            data_manager.add_detection_data(job.video_path, job.frame_ranges)
+        data_manager.add_video_data(job.video_path, job.title, self.output_folder_path)
+        data_manager.save_checkpoint(
+            job.video_path, job.run_key, job.start_frame, completed=True
+        )
+
+        # Delete the original video if the user has selected to do so
+        if not settings.keep_original:
+            job.video_path.unlink()
+
+        self.finished_videos += 1
+        self.callbacks.overall_progress(self.finished_videos)
+        self.callbacks.video_finished(job)
+
+    def __write_metrics(self, job: VideoJob, metrics: PipelineMetrics) -> None:
+        """Write the time spent in every stage next to the cut video, and the trace
+        if it was recorded."""
+        stem = job.video_path.stem
+        metrics.write_summary(
+            self.output_folder_path / f"{stem}_metrics.json",
+            video=job.title,
+            batch_size=self.batch_size,
+            frame_grabber_backend=settings.frame_grabber_backend,
+            inference_backend=settings.inference_backend,
+        )
+        if metrics.trace:
+            metrics.write_trace(self.output_folder_path / f"{stem}_trace.json")
+        summary = metrics.summary()
+        self.log(
+            f"Detected at {summary['fps']:.1f} FPS, {summary['bound']}-bound, "
+            + f"see {stem}_metrics.json"
+        )
+
+    def __run_key(self, video_path: Path) -> str:
+        """Identify a video file and the settings it is processed with, a run is only
+        resumed or skipped when these are the same."""
+        stat = video_path.stat()
+        run: Dict[str, Any] = {
+            "video": [str(video_path), stat.st_size, stat.st_mtime_ns],
+            "output": str(self.output_folder_path),
+            "settings": {
+                name: getattr(settings, name)
+                for name in (
+                    "weights",
+                    "inference_backend",
+                    "prediction_threshold",
+                    "max_detections",
+                    "batch_size",
+                    "frame_grabber_backend",
+                    "video_decoders",
+                    "frame_stride",
+                    "adaptive_stride",
+                    "motion_gate",
+                    "motion_gate_threshold",
+                    "motion_gate_min_area",
+                    "motion_gate_max_gap_seconds",
+                    "frame_buffer_seconds",
+                    "buffer_before",
+                    "buffer_after",
+                    "box_around_fish",
+                    "video_crf",
+                    "stream_copy_cut",
+                    "streaming_cut",
+                )
+            },
+        }
+        # Resuming needs the same batch boundaries
+        run["settings"]["batch_size"] = self.batch_size
+        return hashlib.sha1(json.dumps(run).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def can_resume() -> bool:
+        """Whether detection can be resumed mid-video with the current settings.
+
+        The frames the model runs on after a checkpoint must not depend on the frames
+        before it, and the streaming cut has no checkpoints.
+        """
+        return (
+            settings.frame_grabber_backend == "thread"
+            and not settings.adaptive_stride
+            and not settings.motion_gate
+            and not settings.streaming_cut
+        )
+
+    @staticmethod
+    def tensor_to_detections(tensor: torch.Tensor) -> List[Detection]:
+        """Convert the predictions of a frame to detections."""
+        detections: List[Detection] = []
+        for pred in tensor:
+            bndbox = pred["bndbox"]
+            detections.append(
+                Detection(
+                    label=str(pred["name"]),
+                    confidence=float(pred["conf"]),
+                    xmin=int(bndbox["xmin"]),
+                    ymin=int(bndbox["ymin"]),
+                    xmax=int(bndbox["xmax"]),
+                    ymax=int(bndbox["ymax"]),
+                )
+            )
+        return detections
+
+    def __add_buffer_to_ranges(
+        self, frame_ranges: List[Tuple[int, int]], video_path: Path
+    ) -> List[Tuple[int, int]]:
+        """Add buffer time before and after each frame range and merge overlapping ranges"""
+
+        cap = cv2.VideoCapture(str(video_path))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        video_length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        # Add buffer time to each frame range
+        frame_ranges_with_buffer = [
+            (
+                max(0, start_frame - int(fps * settings.buffer_before)),
+                min(video_length, end_frame + int(fps * settings.buffer_after)),
+            )
+            for (start_frame, end_frame) in frame_ranges
+        ]
+
+        # Merge overlapping frame ranges
+        merged_ranges: List[Tuple[int, int]] = []
+        for start_frame, end_frame in frame_ranges_with_buffer:
+            if not merged_ranges or start_frame > merged_ranges[-1][1]:
+                merged_ranges.append((start_frame, end_frame))
+            else:
+                merged_ranges[-1] = (
+                    merged_ranges[-1][0],
+                    max(merged_ranges[-1][1], end_frame),
+                )
+
+        return merged_ranges
+
+    def get_fps(self, video_path: Path) -> float:
+        """Get the FPS of a video."""
+        cap = cv2.VideoCapture(str(video_path))
+        return float(cap.get(cv2.CAP_PROP_FPS))
+
+    def process_video(
+        self, job: VideoJob, data_manager: DataManager
+    ) -> Optional[VideoJob]:
+        """
+        Run detection on a video and find the frame ranges to cut from it.
+
+        Detection is checkpointed after every batch under the run key, and resumed at
+        start_frame from the detections of the stopped run, when the settings allow it.
+        The detections of a video detected before with the same model and detection
+        settings are taken from the detection cache instead.
+
+        Returns the job with the frame ranges filled in, or None if we should stop.
+        """
+        if self.model is None or self.output_folder_path is None:
+            self.log("Model or output folder path is None")
+            return None
+
+        # self.add_text.emit(f"Processing {video_path}")
+
+        # The model keeps the candidates below the threshold in the detection store,
+        # so the same detections serve every threshold above them
+        conf_thres = settings.prediction_threshold / 100
+        self.model.conf_thres = min(CANDIDATE_CONFIDENCE, conf_thres)
+
+        self.detecting = True
+        self.callbacks.task_progress(0)
+        self.callbacks.task_format("Performing detection: %p%")
+
+        video_path = job.video_path
+        store_path = self.output_folder_path / f"{video_path.stem}_detections.bin"
+
+        cache_key = self.__detection_cache_key(video_path)
+        detection_store = (
+            None
+            if cache_key is None
+            else self.detection_cache.get(cache_key, store_path)
+        )
+        if detection_store is not None:
+            self.log("Using the cached detections of this video")
+            detection_store.conf_thres = conf_thres
+            frames_with_fish = detection_store.frames_with_fish()
+        else:
+            if settings.pipeline_metrics:
+                job.metrics = PipelineMetrics(trace=settings.pipeline_trace)
+            frames_with_fish, detection_store, streaming_cutter = self.__detect(
+                job,
+                store_path,
+                lambda frames: data_manager.save_checkpoint(
+                    video_path, job.run_key, frames
+                ),
+                conf_thres,
+            )
+            if cache_key is not None and not self.stop_event.is_set():
+                self.detection_cache.put(cache_key, detection_store)
+
+            if streaming_cutter is not None:
+                return self.__finish_streaming_cut(streaming_cutter, job)
+
+            # If the stop event is set, stop processing and return
+            if self.stop_event.is_set():
+                return None
+        self.detecting = False
+
+        self.log(f"Found {len(frames_with_fish)} frames with fish")
+
+        # Convert the detected frames to frame ranges to cut the video
+        frame_ranges = detection.detected_frames_to_ranges(
+            frames_with_fish,
+            frame_buffer=int(self.get_fps(video_path) * settings.frame_buffer_seconds),
+        )
+        self.log(f"Found {len(frame_ranges)} frame ranges with fish")
+
+        job.frame_ranges = self.__add_buffer_to_ranges(frame_ranges, video_path)
+        job.needs_cut = len(job.frame_ranges) > 0
+
+        if not job.needs_cut:
+            self.log("No fish detected, skipping video")
+        elif settings.box_around_fish:
+            job.detections = detection_store
+
+        return job
+
+    def cut_video(self, job: VideoJob) -> None:
+        """Cut the frame ranges of a detected video, while the next one is detected.
+
+        The cut only shows its progress in the task progress bar while no video is
+        being detected.
+        """
+        if not job.needs_cut:
+            self.update_time_prediction(100, job.video_num, job.num_videos)
+            return
+
+        def cut_notify_progress(progress: int) -> None:
+            if not self.detecting:
+                self.callbacks.task_format("Cutting video: %p%")
+                self.callbacks.task_progress(progress)
+            self.update_time_prediction(
+                int(progress / 2) + 50, job.video_num, job.num_videos
+            )
+
+        # Cut the video to the detected frames
+        # TODO: implement the stop event for this function too
+        start = time.perf_counter()
+        video_processor.cut_video(
+            job.video_path,
+            job.out_path,
+            job.frame_ranges,
+            job.detections,
+            notify_progress=cut_notify_progress,
+            stream_copy=settings.stream_copy_cut,
+            workers=settings.video_encoders,
+        )
+        if job.metrics is not None:
+            job.metrics.add("cut", start, time.perf_counter())
+
+        self.log(f"Saved processed video to {job.out_path}")
+        self.update_time_prediction(100, job.video_num, job.num_videos)
+
+    def __detect(
+        self,
+        job: VideoJob,
+        store_path: Path,
+        save_checkpoint: Callable[[int], None],
+        conf_thres: float,
+    ) -> Tuple[List[int], DetectionStore, StreamingCutter | None]:
+        """Run detection on a video, cutting it at the same time if enabled.
+
+        Returns the frames with fish, the store with the detections, and the streaming
+        cutter if the video was cut while detecting.
+        """
+        assert self.model is not None
+
+        video_path = job.video_path
+
+        def detection_notify_progress(progress: int) -> None:
+            self.callbacks.task_progress(progress)
+            self.update_time_prediction(
+                int(progress / 2), job.video_num, job.num_videos
+            )
+
+        motion_gate = None
+        if settings.motion_gate:
+            motion_gate = MotionGate(
+                threshold=settings.motion_gate_threshold,
+                min_area=settings.motion_gate_min_area / 100,
+                max_gap=int(
+                    self.get_fps(video_path) * settings.motion_gate_max_gap_seconds
+                ),
+            )
+
+        streaming_cutter = self.__create_streaming_cutter(video_path, job.out_path)
+
+        def cut_frames(
+            frame_indices: List[int],
+            frames: List[np.ndarray[Any, Any]],
+            predictions: List[torch.Tensor],
+        ) -> None:
+            if streaming_cutter is None:
+                return
+            start = time.perf_counter()
+            for frame_index, frame, prediction in zip(
+                frame_indices, frames, predictions
+            ):
+                streaming_cutter.add_frame(
+                    frame_index, frame, self.tensor_to_detections(prediction)
+                )
+            if job.metrics is not None:
+                job.metrics.add("streaming_cut", start, time.perf_counter())
+
+        detection_store = self.__open_detection_store(
+            store_path, job.start_frame if self.can_resume() else 0
+        )
+        if detection_store.frame_count > 0:
+            self.log(f"Resuming detection at frame {detection_store.frame_count}")
+
+        frames_with_fish, _ = detection.process_video(
+            model=self.model,
+            video_path=video_path,
+            batch_size=self.batch_size,
+            max_batches_to_queue=4,
+            output_path=None,
+            stop_event=self.stop_event,
+            notify_progress=detection_notify_progress,
+            backend=settings.frame_grabber_backend,
+            decoders=settings.video_decoders,
+            stride=settings.frame_stride,
+            adaptive=settings.adaptive_stride,
+            motion_gate=motion_gate,
+            notify_frames=cut_frames if streaming_cutter is not None else None,
+            detection_store=detection_store,
+            start_frame=detection_store.frame_count,
+            notify_checkpoint=save_checkpoint if self.can_resume() else None,
+            conf_thres=conf_thres,
+            grabber_workers=(
+                self.tuning.grabber_workers if self.tuning is not None else 0
+            ),
+            metrics=job.metrics,
+        )
+        detection_store.conf_thres = conf_thres
+
+        if motion_gate is not None and not self.stop_event.is_set():
+            self.log(
+                f"Motion gate skipped {motion_gate.gated_frames} frames, "
+                + f"ran detection on {motion_gate.inferred_frames} frames"
+            )
+        return frames_with_fish, detection_store, streaming_cutter
+
+    def __detection_cache_key(self, video_path: Path) -> str | None:
+        """The key of the detections in a video in the detection cache,
+        or None if the cache is turned off."""
+        if settings.detection_cache_mb <= 0 or self.model is None:
+            return None
+        self.detection_cache.max_bytes = settings.detection_cache_mb * 1024 * 1024
+        return self.detection_cache.key(
+            video_path,
+            Common.weights_folder / settings.weights,
+            img_size=self.model.imgsz,
+            conf_thres=self.model.conf_thres,
+            iou_thres=self.model.iou_thres,
+            inference_backend=self.model.backend,
+            max_detections=settings.max_detections,
+            frame_grabber_backend=settings.frame_grabber_backend,
+            video_decoders=settings.video_decoders,
+            frame_stride=settings.frame_stride,
+            adaptive_stride=settings.adaptive_stride,
+            frame_buffer_seconds=(
+                settings.frame_buffer_seconds if settings.adaptive_stride else None
+            ),
+            motion_gate=(
+                [
+                    settings.motion_gate_threshold,
+                    settings.motion_gate_min_area,
+                    settings.motion_gate_max_gap_seconds,
+                ]
+                if settings.motion_gate
+                else None
+            ),
+        )
+
+    def __open_detection_store(self, path: Path, start_frame: int) -> DetectionStore:
+        """Open the detection store of a stopped run to resume it at start_frame,
+        or create a new one if there is nothing to resume."""
+        assert self.model is not None
+        if start_frame > 0:
+            try:
+                return DetectionStore.resume(path, start_frame)
+            except (OSError, ValueError, KeyError) as error:
+                self.log(f"Could not resume detection, starting over: {error}")
+        return DetectionStore.create(path, self.model.names)
+
+    def __create_streaming_cutter(
+        self, video_path: Path, out_path: Path
+    ) -> StreamingCutter | None:
+        """Create a cutter that cuts the video while it is detected, if enabled."""
+        if not settings.streaming_cut:
+            return None
+        if settings.frame_stride > 1 or settings.motion_gate:
+            self.log(
+                "Cutting while detecting needs detection on every frame, "
+                + "cutting after detection instead"
+            )
+            return None
+
+        fps = self.get_fps(video_path)
+        return StreamingCutter.for_video(
+            video_path,
+            out_path,
+            frame_buffer=int(fps * settings.frame_buffer_seconds),
+            buffer_before=int(fps * settings.buffer_before),
+            buffer_after=int(fps * settings.buffer_after),
+            crf=settings.video_crf,
+            annotate=settings.box_around_fish,
+        )
+
+    def __finish_streaming_cut(
+        self, streaming_cutter: StreamingCutter, job: VideoJob
+    ) -> Optional[VideoJob]:
+        """Close the cut video of a streaming cut and store the frame ranges.
+
+        Returns the job with the frame ranges filled in, or None if we should stop.
+        """
+        self.detecting = False
+        job.frame_ranges = streaming_cutter.close()
+
+        if self.stop_event.is_set():
+            # Don't leave a partly cut video behind
+            job.out_path.unlink(missing_ok=True)
+            return None
+
+        self.log(f"Found {len(job.frame_ranges)} frame ranges with fish")
+        if len(job.frame_ranges) == 0:
+            self.log("No fish detected, skipping video")
+        else:
+            self.log(f"Saved processed video to {job.out_path}")
+        return job
+
+    def update_time_prediction(
+        self, progress: int, video_num: int, num_videos: int
+    ) -> None:
+        """Update the time prediction label.
+
+        The time left is predicted from the progress of all the videos together, as
+        a video can be cut while the next one is detected.
+
+        Args:
+            progress: The progress of the video, detection is the first half.
+            video_num: The number of the video.
+            num_videos: The total number of videos.
+        """
+        with self.progress_lock:
+            self.video_progress[video_num] = progress
+            current_time = time.time()
+            # Don't update more than once per second
+            if current_time - self.last_time_update < 1.0:
+                return
+            self.last_time_update = current_time
+            total_progress = sum(self.video_progress.values()) / num_videos
+
+        if total_progress > 0:
+            total_elapsed_time = current_time - self.start_time
+            time_left = total_elapsed_time * (100 - total_progress) / total_progress
+
+            time_left_str = str(timedelta(seconds=int(time_left)))
+            self.callbacks.time_left(f"Total Time Left: {time_left_str}")
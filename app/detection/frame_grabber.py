@@ -1,15 +1,17 @@
 """This module contains the ThreadedFrameGrabber class. """
 
 import math
+import time
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from dataclasses import dataclass, field
 from enum import Enum
 from multiprocessing import cpu_count
 from pathlib import Path
-from queue import Empty, Full, PriorityQueue
-from threading import Event, Thread
+from queue import Empty, Full, PriorityQueue, Queue
+from threading import Event, Lock, Thread
 from types import TracebackType
-from typing import Any, List, Optional, Tuple, Type
+from typing import Any, ContextManager, Dict, List, Optional, Set, Tuple, Type
 
 import cv2
 import numpy as np
@@ -17,6 +19,17 @@ import torch
 from torch import Tensor
 
 from app.detection.batch_yolov8 import BatchYolov8
+from app.detection.frame_sampler import FrameSampler
+from app.detection.letterbox import BatchLetterbox, LetterboxParams
+from app.detection.motion_gate import MotionGate
+from app.detection.pipeline_metrics import PipelineMetrics
+from app.detection.tensor_pool import TensorPool
+from app.detection.video_segments import (
+    Segment,
+    SegmentDecoder,
+    VideoIndex,
+    plan_segments,
+)
 from app.logger import get_logger
 
 logger = get_logger()
@@ -27,7 +40,7 @@ class BatchWrapper:
     """Wrapper for a batch of images."""
 
     index: int
-    data: Tuple[Tensor, List[np.ndarray[Any, Any]]]
+    data: Tuple[Tensor, List[np.ndarray[Any, Any]], List[int]]
 
     def __lt__(self, other: "BatchWrapper") -> bool:
         """Less than operator for sorting batches."""
@@ -45,25 +58,57 @@ class PutState(Enum):
 @dataclass
 class ThreadedFrameGrabber:  # pylint: disable=too-many-instance-attributes
     """Class for grabbing frames from a video file in a separate thread, preprocessing them,
-    and returning them in batches for use in an object detection model"""
+    and returning them in batches for use in an object detection model.
+
+    With more than one decoder, the video is split into keyframe aligned segments
+    that are decoded in parallel with PyAV, and the batches are merged back into the
+    order a single sequential reader would return them in.
+
+    With a sampler, only the sampled frames are letterboxed and returned, along with
+    their frame indices. The frames in between are grabbed without being converted to
+    images, or seeked past when decoding segments, which is counted in grabbed_frames
+    and skip_seconds. A motion gate further drops the sampled frames where
+    nothing moved.
+
+    With a start frame, the batches before it are not returned, to resume a run that
+    was stopped at a batch boundary. The segments before it are not decoded, and a
+    single decoder grabs the frames before it without converting them.
+
+    The frames are letterboxed by num_workers threads, half the cores when 0, see
+    app.detection.autotune. With metrics, the time every thread spends decoding,
+    letterboxing and waiting on the queues is recorded."""
 
     batch_size: int
     model: BatchYolov8
     video_path: Path
+    decoders: int = 1
+    sampler: Optional[FrameSampler] = None
+    motion_gate: Optional[MotionGate] = None
+    start_frame: int = 0
     batch_counter: int = 0
-    num_workers: int = field(init=False)
+    num_workers: int = 0
+    metrics: Optional[PipelineMetrics] = None
     capture: cv2.VideoCapture = field(init=False)
     frame_count: int = field(init=False)
+    letterbox_params: Optional[LetterboxParams] = field(init=False)
+    tensor_pool: TensorPool = field(init=False)
     unprocessed_batch_queue: PriorityQueue[
-        Tuple[int, List[np.ndarray[Any, Any]]]
+        Tuple[int, List[np.ndarray[Any, Any]], List[int]]
     ] = field(init=False)
     processed_batch_queue: PriorityQueue[Optional[BatchWrapper]] = field(init=False)
     shutdown_flag: Event = field(init=False)
     batch_loader_thread: Thread = field(init=False)
     executor: ThreadPoolExecutor = field(init=False)
     workers: List[Any] = field(init=False)
+    video_index: Optional[VideoIndex] = field(default=None)
     frames_read: int = field(default=0)
     skipped_frames: int = field(default=0)
+    grabbed_frames: int = field(default=0)
+    skip_seconds: float = field(default=0.0)
+    loaded_batch_count: Optional[int] = field(default=None)
+    ready_batches: Dict[int, BatchWrapper] = field(default_factory=dict)
+    empty_batches: Set[int] = field(default_factory=set)
+    counter_lock: Lock = field(default_factory=Lock)
 
     def __enter__(self) -> "ThreadedFrameGrabber":
         return self
@@ -81,16 +126,54 @@ class ThreadedFrameGrabber:  # pylint: disable=too-many-instance-attributes
         if not self.capture.isOpened():
             raise RuntimeError(f"Could not open video file {self.video_path}")
 
-        self.num_workers = int(cpu_count() / 2)
+        if self.num_workers <= 0:
+            self.num_workers = max(1, int(cpu_count() / 2))
 
         self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
 
+        if self.decoders > 1 and not self.__selects_frames_in_advance():
+            logger.warning("Adaptive sampling and motion gating need a single decoder")
+        elif self.decoders > 1:
+            self.video_index = VideoIndex.from_video(self.video_path)
+            if self.video_index is None:
+                logger.warning(
+                    "Can't index the frames of %s, decoding it sequentially",
+                    self.video_path,
+                )
+            else:
+                self.frame_count = self.video_index.frame_count
+
+        if self.start_frame > 0:
+            self.__check_start_frame()
+            if self.video_index is not None:
+                self.batch_counter = self.start_frame // self.__frames_per_batch()
+                self.frames_read = self.start_frame
+
+        # The resize parameters are the same for every frame in the video
+        frame_shape = (
+            int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        )
+        self.letterbox_params = (
+            self.model.letterbox_params(frame_shape) if all(frame_shape) else None
+        )
+
+        # Every batch handed to the model holds one tensor until it is released,
+        # which bounds the number of prepared batches kept in memory
+        self.tensor_pool = self.model.create_tensor_pool(
+            self.num_workers + max(2, self.decoders), self.batch_size
+        )
+
         self.unprocessed_batch_queue = PriorityQueue(maxsize=self.num_workers * 2)
         self.processed_batch_queue = PriorityQueue(maxsize=self.num_workers * 2)
 
         self.shutdown_flag = Event()
 
-        self.batch_loader_thread = Thread(target=self.batch_loader)
+        self.batch_loader_thread = Thread(
+            target=self.batch_loader
+            if self.video_index is None
+            else self.segmented_batch_loader
+        )
         self.batch_loader_thread.start()
 
         self.executor = ThreadPoolExecutor(max_workers=self.num_workers)
@@ -100,98 +183,329 @@ class ThreadedFrameGrabber:  # pylint: disable=too-many-instance-attributes
             future = self.executor.submit(self.worker)
             self.workers.append(future)
 
+    def __check_start_frame(self) -> None:
+        """Checks that the batches after the start frame are the same as without it.
+
+        Raises:
+            ValueError: If the start frame is not at a batch boundary, or the frames
+                        passed to the model depend on the frames before it.
+        """
+        if not self.__selects_frames_in_advance():
+            raise ValueError(
+                "Can't start mid-video with adaptive sampling or motion gating"
+            )
+        if self.start_frame % self.__frames_per_batch() != 0:
+            raise ValueError(
+                f"Start frame {self.start_frame} is not at a batch boundary"
+            )
+
+    def __timed(self, stage: str) -> ContextManager[None]:
+        """Time a with block in a stage of the metrics, if there are any."""
+        return nullcontext() if self.metrics is None else self.metrics.time(stage)
+
+    def __record(self, stage: str, start: float) -> None:
+        """Record the time from start until now in a stage of the metrics."""
+        if self.metrics is not None:
+            self.metrics.add(stage, start, time.perf_counter())
+
     def read_next_frame(self) -> np.ndarray[Any, Any] | None:
         """Reads the next frame from the video file"""
-        ret: bool
-        frame: Optional[np.ndarray[Any, Any]]
-        ret, frame = self.capture.read()
+        ret, frame = self.__next_frame(retrieve=True)
+        return frame if ret else None
+
+    def skip_next_frame(self) -> bool:
+        """Moves past the next frame of the video file without converting it to an image.
+
+        Returns:
+            bool: False if there are no more frames.
+        """
+        start = time.perf_counter()
+        ret, _ = self.__next_frame(retrieve=False)
+        self.skip_seconds += time.perf_counter() - start
+        if ret:
+            self.grabbed_frames += 1
+        return ret
+
+    def __next_frame(
+        self, retrieve: bool
+    ) -> Tuple[bool, Optional[np.ndarray[Any, Any]]]:
+        """Reads or grabs the next frame, skipping frames that fail to decode."""
+
+        def advance() -> Tuple[bool, Optional[np.ndarray[Any, Any]]]:
+            if retrieve:
+                return self.capture.read()
+            return self.capture.grab(), None
+
+        ret, frame = advance()
         while (
             not ret
             and not self.shutdown_flag.is_set()
             and self.frames_read + self.skipped_frames < self.frame_count
         ):
             self.skipped_frames += 1
-            ret, frame = self.capture.read()
-        if ret and frame is not None:
+            ret, frame = advance()
+        if ret and (frame is not None or not retrieve):
             self.frames_read += 1
-            return frame
-        return None
+            return True, frame
+        return False, None
 
     def __put_unprocessed_batch(
-        self, batch_index: int, batch: List[np.ndarray[Any, Any]]
+        self,
+        batch_index: int,
+        batch: List[np.ndarray[Any, Any]],
+        frame_indices: List[int],
     ) -> bool:
         """Attempts to put a batch of frames into the unprocessed batch queue.
 
         Args:
             batch_index (int): The index of the batch.
             batch (List[np.ndarray[Any, Any]]): The batch of frames.
+            frame_indices (List[int]): The index of every frame in the video.
 
         Returns:
             bool: True if the batch was successfully put into the queue, False otherwise.
         """
 
         def try_put_unprocessed_batch(
-            batch_index: int, batch: List[np.ndarray[Any, Any]]
+            batch_index: int,
+            batch: List[np.ndarray[Any, Any]],
+            frame_indices: List[int],
         ) -> PutState:
             """Attempts to put a batch of frames into the unprocessed batch queue."""
             try:
-                self.unprocessed_batch_queue.put((batch_index, batch), timeout=1)
+                self.unprocessed_batch_queue.put(
+                    (batch_index, batch, frame_indices), timeout=1
+                )
             except Full:
                 if self.shutdown_flag.is_set():
                     return PutState.EXIT
                 return PutState.FULL
             return PutState.SUCCESS
 
-        while True:
-            put_state = try_put_unprocessed_batch(batch_index, batch)
-            match put_state:
-                case PutState.SUCCESS:
-                    break
-                case PutState.EXIT:
-                    return False
-                case PutState.FULL:
-                    continue
-                case _:
-                    raise RuntimeError("Invalid put state")
-        return True
+        start = time.perf_counter()
+        try:
+            while True:
+                put_state = try_put_unprocessed_batch(batch_index, batch, frame_indices)
+                match put_state:
+                    case PutState.SUCCESS:
+                        break
+                    case PutState.EXIT:
+                        return False
+                    case PutState.FULL:
+                        continue
+                    case _:
+                        raise RuntimeError("Invalid put state")
+            return True
+        finally:
+            self.__record("unprocessed_queue_put", start)
 
     def batch_loader(self) -> None:
         """Loadds batches of frames into the unprocessed batch queue"""
         batch: List[np.ndarray[Any, Any]] = []
+        frame_indices: List[int] = []
         batch_index = 0
+        batch_start = time.perf_counter()
+        while self.frames_read < self.start_frame and not self.shutdown_flag.is_set():
+            if not self.skip_next_frame():
+                break
         while not self.shutdown_flag.is_set():
-            frame: np.ndarray[Any, Any] | None = self.read_next_frame()
+            frame_index = self.frames_read
+            frame: np.ndarray[Any, Any] | None = None
+            if self.sampler is None or self.sampler.should_sample(frame_index):
+                frame = self.read_next_frame()
+            elif self.skip_next_frame():
+                continue
             frame_available = frame is not None
 
             if frame_available and frame is not None:
+                if self.motion_gate is not None and not self.motion_gate.should_infer(
+                    frame_index, frame
+                ):
+                    continue
+
                 batch.append(frame)
+                frame_indices.append(frame_index)
                 if len(batch) == self.batch_size:
-                    if not self.__put_unprocessed_batch(batch_index, batch):
+                    self.__record("decode", batch_start)
+                    if not self.__put_unprocessed_batch(
+                        batch_index, batch, frame_indices
+                    ):
                         break
 
                     batch_index += 1
                     batch = []
+                    frame_indices = []
+                    batch_start = time.perf_counter()
             else:
                 if len(batch) > 0:
-                    if not self.__put_unprocessed_batch(batch_index, batch):
+                    self.__record("decode", batch_start)
+                    if not self.__put_unprocessed_batch(
+                        batch_index, batch, frame_indices
+                    ):
                         break
+                    batch_index += 1
+                self.loaded_batch_count = batch_index
                 break
 
         logger.debug("Finished loading batches")
 
+    def segmented_batch_loader(self) -> None:
+        """Loads batches of frames into the unprocessed batch queue with several decoders"""
+        assert self.video_index is not None
+        segments: Queue[Segment] = Queue()
+        for segment in plan_segments(self.video_index, self.__frames_per_batch()):
+            if segment.end > self.start_frame:
+                segments.put(Segment(max(segment.start, self.start_frame), segment.end))
+
+        with ThreadPoolExecutor(max_workers=self.decoders) as executor:
+            futures = [
+                executor.submit(self.__decode_segments, segments)
+                for _ in range(self.decoders)
+            ]
+            for future in futures:
+                future.result()
+
+        logger.debug("Finished loading batches")
+
+    def __decode_segments(self, segments: "Queue[Segment]") -> None:
+        """Decodes segments in order until there are none left.
+
+        Args:
+            segments: The segments left to decode.
+        """
+        assert self.video_index is not None
+        with SegmentDecoder(self.video_path, self.video_index) as decoder:
+            while not self.shutdown_flag.is_set():
+                try:
+                    segment = segments.get_nowait()
+                except Empty:
+                    break
+                if not self.__load_segment(decoder, segment):
+                    break
+            with self.counter_lock:
+                self.skip_seconds += decoder.skip_seconds
+
+    def __frames_per_batch(self) -> int:
+        """The number of frames of the video a batch is sampled from, with a fixed stride."""
+        if self.sampler is None:
+            return self.batch_size
+        return self.batch_size * self.sampler.stride
+
+    def __load_segment(self, decoder: SegmentDecoder, segment: Segment) -> bool:
+        """Decodes a segment into batches and puts them into the unprocessed batch queue.
+
+        Returns:
+            bool: False if the frame grabber is shutting down.
+        """
+        frames_per_batch = self.__frames_per_batch()
+        batch_index = segment.start // frames_per_batch
+        batch: List[np.ndarray[Any, Any]] = []
+        frame_indices: List[int] = []
+        stride = 1 if self.sampler is None else self.sampler.stride
+        returned_frames = 0
+        batch_start = time.perf_counter()
+        for frame_index, frame in decoder.decode(segment, stride):
+            returned_frames += 1
+            while frame_index // frames_per_batch > batch_index:
+                self.__record("decode", batch_start)
+                if not self.__put_segment_batch(batch_index, batch, frame_indices):
+                    return False
+                batch_index += 1
+                batch = []
+                frame_indices = []
+                batch_start = time.perf_counter()
+            batch.append(frame)
+            frame_indices.append(frame_index)
+
+        # Frames that were not requested are skipped on purpose,
+        # requested frames that were not returned failed to decode
+        requested_frames = len(
+            range(math.ceil(segment.start / stride) * stride, segment.end, stride)
+        )
+        with self.counter_lock:
+            self.frames_read += (
+                segment.end - segment.start - (requested_frames - returned_frames)
+            )
+            self.skipped_frames += requested_frames - returned_frames
+            self.grabbed_frames += segment.end - segment.start - requested_frames
+
+        while batch_index < math.ceil(segment.end / frames_per_batch):
+            self.__record("decode", batch_start)
+            if not self.__put_segment_batch(batch_index, batch, frame_indices):
+                return False
+            batch_index += 1
+            batch = []
+            frame_indices = []
+        return True
+
+    def __put_segment_batch(
+        self,
+        batch_index: int,
+        batch: List[np.ndarray[Any, Any]],
+        frame_indices: List[int],
+    ) -> bool:
+        """Puts a batch of a segment into the unprocessed batch queue once it is near
+        the next batch to return.
+
+        Returns:
+            bool: False if the frame grabber is shutting down.
+        """
+        if len(batch) == 0:
+            logger.warning("Could not decode any frames of batch %s", batch_index)
+            self.empty_batches.add(batch_index)
+            return True
+
+        # Segments are handed out in order, so the decoder of the lowest segment
+        # never waits here, and the batches ahead can't take the whole tensor pool
+        with self.__timed("unprocessed_queue_put"):
+            while batch_index >= self.batch_counter + self.tensor_pool.size:
+                if self.shutdown_flag.wait(0.01):
+                    return False
+        return self.__put_unprocessed_batch(batch_index, batch, frame_indices)
+
     def worker(self) -> None:
         """Processes batches of frames and puts them into the processed batch queue"""
+        letterbox: BatchLetterbox | None = None
         while not self.shutdown_flag.is_set():
+            # Take a tensor before the batch, so the lowest batch index always gets one
+            with self.__timed("tensor_pool_acquire"):
+                slot = self.tensor_pool.acquire(timeout=1)
+            if slot is None:
+                continue
+
             try:
-                batch_index, batch = self.unprocessed_batch_queue.get(timeout=1)
+                with self.__timed("unprocessed_queue_get"):
+                    (
+                        batch_index,
+                        batch,
+                        frame_indices,
+                    ) = self.unprocessed_batch_queue.get(timeout=1)
             except Empty:
+                self.tensor_pool.release_slot(slot)
                 if not self.batch_loader_thread.is_alive():
                     break
                 continue
 
-            self.processed_batch_queue.put(
-                BatchWrapper(batch_index, (self.model.prepare_images(batch), batch))
-            )
+            if letterbox is None:
+                params = self.letterbox_params or self.model.letterbox_params(
+                    (batch[0].shape[0], batch[0].shape[1])
+                )
+                letterbox = BatchLetterbox(params, self.batch_size)
+
+            with self.__timed("letterbox"):
+                letterbox(batch, out=self.tensor_pool.host_array(slot))
+                batch_wrapper = BatchWrapper(
+                    batch_index,
+                    (self.tensor_pool.load(slot, len(batch)), batch, frame_indices),
+                )
+            # The batches are no longer taken once the grabber is closed early
+            with self.__timed("processed_queue_put"):
+                while not self.shutdown_flag.is_set():
+                    try:
+                        self.processed_batch_queue.put(batch_wrapper, timeout=1)
+                        break
+                    except Full:
+                        continue
 
     def close(self) -> None:
         """Closes the video capture and shuts down the batch loader thread and workers"""
@@ -202,27 +516,83 @@ class ThreadedFrameGrabber:  # pylint: disable=too-many-instance-attributes
         self.executor.shutdown(wait=False)
         logger.debug("Shutdown executor")
         self.capture.release()
-        torch.cuda.empty_cache()
-        torch.cuda.reset_peak_memory_stats()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats()
 
     def total_batch_count(self) -> int:
         """Returns the total number of batches that will be returned by this object."""
-        return int(
-            math.ceil((self.frame_count - self.skipped_frames) / self.batch_size)
+        if self.loaded_batch_count is not None:
+            return self.loaded_batch_count
+        if self.video_index is not None:
+            # Frames that fail to decode shorten their batch, but don't remove it
+            return int(math.ceil(self.frame_count / self.__frames_per_batch()))
+
+        frames = self.frame_count - self.skipped_frames - self.start_frame
+        if self.sampler is not None and self.__selects_frames_in_advance():
+            frames = int(math.ceil(frames / self.sampler.stride))
+        # Otherwise this is an upper bound until all frames are read
+        return int(math.ceil(frames / self.batch_size))
+
+    def __selects_frames_in_advance(self) -> bool:
+        """Whether the frames passed to the model are known before reading the video."""
+        return self.motion_gate is None and (
+            self.sampler is None or self.sampler.is_fixed
         )
 
-    def get_batch(self) -> Tuple[Tensor, List[np.ndarray[Any, Any]]] | None:
-        """Returns the next batch of frames from the video file"""
-        try:
-            batch_wrapper = self.processed_batch_queue.get(timeout=5)
-        except Empty:
-            return None
-        if batch_wrapper is None:
-            return None
+    def get_batch(
+        self,
+    ) -> Tuple[Tensor, List[np.ndarray[Any, Any]], List[int]] | None:
+        """Returns the next batch of frames from the video file, in the order they were read,
+        along with the index of every frame in the video"""
+        # Workers can finish out of order, so hold on to batches until it is their turn
+        while self.batch_counter not in self.ready_batches:
+            if self.batch_counter in self.empty_batches:
+                self.batch_counter += 1
+                if self.is_done():
+                    return None
+                continue
+            ready_batch = self.__get_processed_batch(timeout=5)
+            if ready_batch is None:
+                return None
+            self.ready_batches[ready_batch.index] = ready_batch
 
+        batch_wrapper = self.ready_batches.pop(self.batch_counter)
         self.batch_counter += 1
+        if self.metrics is not None:
+            self.metrics.sample_queue(
+                "unprocessed",
+                self.unprocessed_batch_queue.qsize(),
+                self.unprocessed_batch_queue.maxsize,
+            )
+            # Batches letterboxed out of order wait in ready_batches
+            self.metrics.sample_queue(
+                "processed",
+                self.processed_batch_queue.qsize() + len(self.ready_batches),
+                self.processed_batch_queue.maxsize,
+            )
         return batch_wrapper.data
 
+    def __get_processed_batch(self, timeout: float) -> BatchWrapper | None:
+        """Waits for the next processed batch, giving up early if all batches
+        turn out to be returned, as the batch count is not known up front when sampling.
+        """
+        deadline = time.monotonic() + timeout
+        while not self.is_done():
+            try:
+                return self.processed_batch_queue.get(
+                    timeout=min(1.0, max(0.0, deadline - time.monotonic()))
+                )
+            except Empty:
+                if time.monotonic() >= deadline:
+                    break
+        return None
+
+    def release_batch(self, processed_batch: Tensor) -> None:
+        """Returns the tensor of a batch from get_batch to the pool
+        once the model is done with it."""
+        self.tensor_pool.release(processed_batch)
+
     def is_done(self) -> bool:
         """Returns true if all batches have been returned"""
         return self.batch_counter >= self.total_batch_count()
@@ -0,0 +1,135 @@
+"""Temporal subsampling of the frames the model runs on."""
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass
+class FrameSampler:
+    """Decides which frames of a video are passed to the model.
+
+    With a fixed stride every stride-th frame is sampled. When adaptive, every frame
+    is sampled for dense_frames frames after fish are reported through
+    report_detection. Frames are sampled ahead of the model, so the dense window
+    starts at the last sampled frame when the detection is reported, not at the frame
+    with fish, otherwise it would already be passed when the model gets to it.
+    """
+
+    stride: int = 1
+    adaptive: bool = False
+    dense_frames: int = 0
+    last_sampled: Optional[int] = field(default=None)
+    dense_until: Optional[int] = field(default=None)
+
+    def __post_init__(self) -> None:
+        if self.stride < 1:
+            raise ValueError(f"Stride must be at least 1, got {self.stride}")
+
+    @property
+    def is_fixed(self) -> bool:
+        """Whether the sampled frames are known without the detections."""
+        return not self.adaptive or self.stride == 1
+
+    def current_stride(self, frame_index: int) -> int:
+        """Returns the stride to use at a frame."""
+        if (
+            self.adaptive
+            and self.dense_until is not None
+            and frame_index <= self.dense_until
+        ):
+            return 1
+        return self.stride
+
+    def should_sample(self, frame_index: int) -> bool:
+        """Returns whether a frame should be passed to the model.
+
+        Must be called for the frames in order when adaptive.
+        """
+        if self.is_fixed:
+            return frame_index % self.stride == 0
+        if (
+            self.last_sampled is None
+            or frame_index - self.last_sampled >= self.current_stride(frame_index)
+        ):
+            self.last_sampled = frame_index
+            return True
+        return False
+
+    def report_detection(self, frame_index: int) -> None:
+        """Reports that fish were detected in a sampled frame."""
+        dense_until = max(frame_index, self.last_sampled or 0) + self.dense_frames
+        if self.dense_until is None or dense_until > self.dense_until:
+            self.dense_until = dense_until
+
+
+def sampled_frames_with_fish(
+    sampled_frames: List[int] | np.ndarray[Any, Any],
+    sampled_fish: List[bool] | np.ndarray[Any, Any],
+    frame_count: int,
+) -> List[int]:
+    """Returns the frames considered to contain fish from the sampled frames.
+
+    The frames between a sampled frame with fish and its neighbouring sampled frames
+    are considered to contain fish too.
+
+    Args:
+        sampled_frames: The sampled frame indices, in order.
+        sampled_fish: Whether fish were found in every sampled frame.
+        frame_count: The number of frames in the video.
+    """
+    if len(sampled_frames) == 0:
+        return []
+
+    frames = np.asarray(sampled_frames, dtype=np.int64)
+    fish = np.asarray(sampled_fish, dtype=bool)
+    bounds = np.concatenate(([-1], frames, [max(frame_count, int(frames[-1]) + 1)]))
+
+    # Count the ranges of the sampled frames with fish covering every frame
+    length = int(bounds[-1]) + 1
+    coverage = np.cumsum(
+        np.bincount(bounds[:-2][fish] + 1, minlength=length)
+        - np.bincount(bounds[2:][fish], minlength=length)
+    )
+    frames_with_fish: List[int] = np.flatnonzero(coverage > 0).tolist()
+    return frames_with_fish
+
+
+def expand_sampled_frames(
+    sampled_frames: List[int],
+    sampled_predictions: List[Any],
+    frame_count: int,
+) -> Tuple[List[int], List[Any]]:
+    """Expands the predictions of sampled frames to every frame of the video.
+
+    Every frame holds the predictions of the last sampled frame before it, and the
+    frames between a sampled frame with fish and its neighbouring sampled frames
+    are considered to contain fish too.
+
+    Args:
+        sampled_frames: The sampled frame indices, in order.
+        sampled_predictions: The predictions of every sampled frame.
+        frame_count: The number of frames in the video.
+
+    Returns:
+        A tuple containing:
+        1. A list of frames containing fish.
+        2. A list of predictions for each frame.
+    """
+    if len(sampled_frames) == 0:
+        return [], [[] for _ in range(frame_count)]
+
+    # Frames before the first sampled frame have no predictions
+    predictions_per_frame: List[Any] = [[] for _ in range(sampled_frames[0])]
+
+    bounds = [*sampled_frames, max(frame_count, sampled_frames[-1] + 1)]
+    for position, predictions in enumerate(sampled_predictions):
+        frame, next_frame = bounds[position], bounds[position + 1]
+        predictions_per_frame.extend([predictions] * (next_frame - frame))
+
+    frames_with_fish = sampled_frames_with_fish(
+        sampled_frames,
+        [len(predictions) > 0 for predictions in sampled_predictions],
+        frame_count,
+    )
+    return frames_with_fish, predictions_per_frame
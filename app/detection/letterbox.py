@@ -0,0 +1,147 @@
+"""Batched letterboxing of video frames into a reused buffer."""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+PAD_VALUE = 114
+
+
+@dataclass(frozen=True)
+class LetterboxParams:
+    """Resize and padding parameters for letterboxing frames of one shape.
+
+    Mirrors ultralytics LetterBox(auto=False, scaleup=True, center=True), so every
+    frame ends up as a new_shape sized image.
+    """
+
+    frame_shape: Tuple[int, int]
+    new_shape: Tuple[int, int]
+    resized_shape: Tuple[int, int]
+    top: int
+    left: int
+
+    @classmethod
+    def from_shape(
+        cls, frame_shape: Tuple[int, int], new_shape: int | Tuple[int, int]
+    ) -> "LetterboxParams":
+        """Computes the letterbox parameters for frames of the given shape.
+
+        Args:
+            frame_shape: The (height, width) of the frames.
+            new_shape: The (height, width) of the letterboxed frames.
+
+        Returns:
+            The letterbox parameters.
+        """
+        if isinstance(new_shape, int):
+            new_shape = (new_shape, new_shape)
+        height, width = frame_shape[:2]
+
+        ratio = min(new_shape[0] / height, new_shape[1] / width)
+        resized_shape = (int(round(height * ratio)), int(round(width * ratio)))
+
+        pad_height = (new_shape[0] - resized_shape[0]) / 2
+        pad_width = (new_shape[1] - resized_shape[1]) / 2
+
+        return cls(
+            frame_shape=(height, width),
+            new_shape=(new_shape[0], new_shape[1]),
+            resized_shape=resized_shape,
+            top=int(round(pad_height - 0.1)),
+            left=int(round(pad_width - 0.1)),
+        )
+
+
+class BatchLetterbox:
+    """Letterboxes batches of BGR frames into a reused (B, 3, H, W) RGB uint8 buffer.
+
+    The resize parameters are computed once for the expected frame shape, and the
+    resized frame is written straight into the buffer, so no memory is allocated per frame.
+    An instance is not thread safe, every thread should use its own.
+    """
+
+    def __init__(self, params: LetterboxParams, batch_size: int) -> None:
+        self.params = params
+        self.batch_size = batch_size
+        self.__buffer: np.ndarray[Any, Any] | None = None
+        self.__resized: Dict[Tuple[int, int], np.ndarray[Any, Any]] = {}
+        self.__params: Dict[Tuple[int, int], LetterboxParams] = {
+            params.frame_shape: params
+        }
+
+    @property
+    def buffer(self) -> np.ndarray[Any, Any]:
+        """The internal buffer, allocated on first use."""
+        if self.__buffer is None:
+            self.__buffer = np.full(
+                (self.batch_size, 3, *self.params.new_shape), PAD_VALUE, dtype=np.uint8
+            )
+        return self.__buffer
+
+    def __call__(
+        self,
+        frames: List[np.ndarray[Any, Any]],
+        out: np.ndarray[Any, Any] | None = None,
+    ) -> np.ndarray[Any, Any]:
+        """Letterboxes a batch of frames.
+
+        Args:
+            frames: The frames to letterbox.
+            out: The (B, 3, H, W) buffer to write to. Defaults to the internal buffer.
+
+        Returns:
+            A view of the first len(frames) images in the buffer.
+        """
+        out = self.buffer if out is None else out
+        if len(frames) > len(out):
+            raise ValueError(
+                f"Batch of {len(frames)} frames does not fit in buffer of {len(out)}"
+            )
+
+        for frame, image in zip(frames, out):
+            self.letterbox_into(frame, image)
+        return out[: len(frames)]
+
+    def letterbox_into(
+        self, frame: np.ndarray[Any, Any], image: np.ndarray[Any, Any]
+    ) -> None:
+        """Letterboxes a single frame into a (3, H, W) image.
+
+        Args:
+            frame: The BGR frame.
+            image: The RGB image to write to.
+        """
+        frame_shape = (frame.shape[0], frame.shape[1])
+        params = self.__params.get(frame_shape)
+        if params is None:
+            # Should not happen within one video, but don't fail on odd frames
+            params = LetterboxParams.from_shape(frame_shape, self.params.new_shape)
+            self.__params[frame_shape] = params
+
+        if frame_shape != params.resized_shape:
+            resized = self.__resized.get(params.resized_shape)
+            if resized is None:
+                resized = np.empty((*params.resized_shape, 3), dtype=np.uint8)
+                self.__resized[params.resized_shape] = resized
+            cv2.resize(
+                frame,
+                (params.resized_shape[1], params.resized_shape[0]),
+                dst=resized,
+                interpolation=cv2.INTER_LINEAR,
+            )
+            frame = resized
+
+        top, left = params.top, params.left
+        bottom = top + params.resized_shape[0]
+        right = left + params.resized_shape[1]
+
+        # Only the border is filled, the rest is overwritten below
+        image[:, :top] = PAD_VALUE
+        image[:, bottom:] = PAD_VALUE
+        image[:, top:bottom, :left] = PAD_VALUE
+        image[:, top:bottom, right:] = PAD_VALUE
+
+        # BGR to RGB and HWC to CHW
+        image[:, top:bottom, left:right] = frame.transpose(2, 0, 1)[::-1]
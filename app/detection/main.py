@@ -1,18 +1,374 @@
-"""Main module for detection."""
+"""Main module for detection.
+
+Runs detection on a single video, or processes a folder of videos headless like the
+detection window does, with the videos spread over worker processes.
+"""
 import argparse
+import multiprocessing as mp
+import os
+import signal
+import socket
 import sys
 import threading
 from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import torch
 
+from app import settings
+from app.data_manager.data_manager import DataManager
 from app.logger import get_logger
+from app.report_manager.report_manager import ReportManager
 
+from .autotune import Tuning, load_or_autotune
 from .batch_yolov8 import BatchYolov8
 from .detection import process_video
+from .folder_processor import FolderCallbacks, FolderProcessor, VideoJob, list_videos
+from .motion_gate import MotionGate
+from .pipeline_metrics import PipelineMetrics
+from .work_queue import WorkQueue
 
 logger = get_logger()
 
+# The batch size of a single video, folders default to that of the app
+VIDEO_BATCH_SIZE = 32
+
+
+def __folder_settings(args: argparse.Namespace) -> Dict[str, Any]:
+    """The settings the detection window would use, taken from the arguments."""
+    return {
+        "weights": str(Path(args.weights_path).resolve()),
+        "batch_size": (
+            args.batch_size if args.batch_size is not None else settings.batch_size
+        ),
+        "autotune": args.autotune,
+        "frame_grabber_backend": args.backend,
+        "inference_backend": args.inference_backend,
+        "inference_threads": args.threads,
+        "video_decoders": args.decoders,
+        "frame_stride": args.stride,
+        "adaptive_stride": args.adaptive,
+        "motion_gate": args.motion_gate,
+        "motion_gate_threshold": args.motion_threshold,
+        "motion_gate_min_area": args.motion_area,
+        "motion_gate_max_gap_seconds": args.motion_max_gap_seconds,
+        "prediction_threshold": args.threshold,
+        "buffer_before": args.buffer_before,
+        "buffer_after": args.buffer_after,
+        "box_around_fish": args.box_around_fish,
+        "keep_original": not args.delete_original,
+        "get_report": args.report is not None,
+        "report_format": args.report if args.report is not None else "CSV",
+        "video_crf": args.crf,
+        "video_encoders": args.encoders,
+        "pipeline_cuts": args.pipeline_cuts,
+        "stream_copy_cut": args.stream_copy,
+        "streaming_cut": args.streaming_cut,
+        "pipeline_metrics": args.metrics or args.trace,
+        "pipeline_trace": args.trace,
+    }
+
+
+def __apply_settings(folder_settings: Dict[str, Any]) -> None:
+    """Set the settings for this process.
+
+    The settings are not set up from the ini file, so nothing is written back to the
+    settings of the detection window.
+    """
+    for name, value in folder_settings.items():
+        setattr(settings, name, value)
+
+
+def __get_fps(video_path: Path) -> float:
+    """Get the FPS of a video."""
+    cap = cv2.VideoCapture(str(video_path))
+    fps = float(cap.get(cv2.CAP_PROP_FPS))
+    cap.release()
+    return fps
+
+
+def __limit_threads(threads: int) -> None:
+    """Limit the threads torch and OpenCV use in this process, 0 keeps the defaults."""
+    if threads > 0:
+        torch.set_num_threads(threads)
+        cv2.setNumThreads(threads)
+
+
+def __worker_processor(  # pylint: disable=too-many-arguments
+    worker: str,
+    folder_settings: Dict[str, Any],
+    device: str,
+    threads: int,
+    input_folder: Path,
+    output_folder: Path,
+    tuning: Optional[Tuning],
+) -> FolderProcessor:
+    """Set up a worker process with its own model."""
+    __apply_settings(folder_settings)
+    __limit_threads(threads)
+
+    processor = FolderProcessor(
+        input_folder,
+        output_folder,
+        FolderCallbacks(
+            log=lambda text: print(f"[worker {worker}] {text}", flush=True)
+        ),
+    )
+    # Stop after the current batch, so the video can be resumed
+    signal.signal(signal.SIGINT, lambda *_: processor.stop())
+    processor.model = BatchYolov8(
+        Path(settings.weights),
+        device,
+        backend=settings.inference_backend,
+        threads=settings.inference_threads,
+    )
+    if tuning is not None:
+        processor.use_tuning(tuning)
+    return processor
+
+
+def __process_videos(
+    worker: int,
+    worker_args: Tuple[Any, ...],
+    jobs: "mp.Queue[VideoJob | None]",
+) -> None:
+    """Process the videos from the queue until it is empty, in a worker process."""
+    processor = __worker_processor(str(worker), *worker_args)
+    with DataManager() as data_manager:
+        processor.process_videos(iter(jobs.get, None), data_manager)
+
+
+def __process_queued_videos(
+    worker: int,
+    worker_args: Tuple[Any, ...],
+    queue_path: Path,
+    lease_seconds: float,
+) -> None:
+    """Claim videos from a work queue and process them until the queue is empty,
+    in a worker process."""
+    name = f"{socket.gethostname()}-{os.getpid()}"
+    processor = __worker_processor(f"{worker} {name}", *worker_args)
+    queue = WorkQueue(queue_path, lease_seconds)
+    num_videos = sum(queue.counts().values())
+
+    def video_finished(job: VideoJob) -> None:
+        queue.complete(
+            job.title,
+            name,
+            {
+                "worker": name,
+                "output": job.out_path.name if job.frame_ranges else None,
+                "frame_ranges": job.frame_ranges,
+            },
+        )
+
+    processor.callbacks.video_finished = video_finished
+
+    def claimed_jobs(data_manager: DataManager) -> Iterator[VideoJob]:
+        while not processor.stop_event.is_set():
+            claimed = queue.claim(name)
+            if claimed is None:
+                return
+            video_id, video = claimed
+            jobs = processor.pending_videos([video], data_manager)
+            if not jobs:
+                queue.complete(video, name, {"worker": name, "already_done": True})
+                continue
+            jobs[0].video_num = video_id - 1
+            jobs[0].num_videos = num_videos
+            yield jobs[0]
+
+    # Keep the leases while the videos take longer than a lease
+    stopped = threading.Event()
+
+    def renew_leases() -> None:
+        with WorkQueue(queue_path, lease_seconds) as heartbeat:
+            while not stopped.wait(lease_seconds / 3):
+                heartbeat.renew(name)
+
+    heartbeat_thread = threading.Thread(target=renew_leases, daemon=True)
+    heartbeat_thread.start()
+    try:
+        with DataManager() as data_manager:
+            processor.process_videos(claimed_jobs(data_manager), data_manager)
+    except Exception as error:
+        queue.release(name, repr(error))
+        raise
+    finally:
+        stopped.set()
+        heartbeat_thread.join()
+
+    # Give back the video that was stopped
+    queue.release(name)
+    queue.close()
+
+
+def __run_workers(
+    target: Callable[..., None], args: Tuple[Any, ...], workers: int, threads: int
+) -> bool:
+    """Run worker processes until they are done.
+
+    Args:
+        target: The function of the workers, called with the number of the worker
+                followed by args.
+        args: The arguments of the workers.
+        workers: The number of worker processes.
+        threads: The max number of threads of every worker, 0 for no limit.
+
+    Returns:
+        bool: True if all the workers succeeded
+    """
+    if threads > 0:
+        # Read by the thread pools of the workers when they start
+        for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ[variable] = str(threads)
+
+    context = mp.get_context("spawn")
+    processes = [
+        context.Process(target=target, args=(worker, *args))
+        for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    # The workers get the interrupt too, and stop after their current batch
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for process in processes:
+        process.join()
+
+    failed = [process.name for process in processes if process.exitcode != 0]
+    if failed:
+        logger.error("Workers %s failed", ", ".join(failed))
+    return not failed
+
 
-def main() -> int:
+def __autotune(args: argparse.Namespace, input_folder: Path) -> Optional[Tuning]:
+    """Tune the batch size and threads of a worker on the first video of a folder,
+    with the share of the cores of a worker, unless tuned before on this host."""
+    videos = list_videos(input_folder)
+    if not videos:
+        return None
+    cores = args.threads or max(1, (os.cpu_count() or 1) // max(1, args.workers))
+    __limit_threads(cores)
+    model = BatchYolov8(
+        Path(settings.weights),
+        args.device,
+        backend=settings.inference_backend,
+        threads=settings.inference_threads,
+    )
+    tuning = load_or_autotune(
+        model, Path(settings.weights), input_folder / videos[0], cores
+    )
+    print(f"Using {tuning}")
+    return tuning
+
+
+def __process_queue(
+    args: argparse.Namespace, worker_args: Tuple[Any, ...], input_folder: Path
+) -> int:
+    """Add the videos of a folder to a work queue, or process the videos in it.
+
+    Returns:
+        int: The exit code
+    """
+    queue_path = Path(args.queue)
+    if args.enqueue:
+        with WorkQueue(queue_path) as queue:
+            added = queue.add(list_videos(input_folder))
+            print(f"Added {added} videos to the queue: {queue.counts()}")
+        return 0
+
+    succeeded = __run_workers(
+        __process_queued_videos,
+        (worker_args, queue_path, args.lease_seconds),
+        max(1, args.workers),
+        worker_args[2],  # The threads of a worker
+    )
+    with WorkQueue(queue_path) as queue:
+        print(f"Videos in the queue: {queue.counts()}")
+    return 0 if succeeded else 1
+
+
+def __process_folder(  # pylint: disable=too-many-locals,too-many-return-statements
+    args: argparse.Namespace,
+) -> int:
+    """Process a folder of videos, in args.workers processes.
+
+    Returns:
+        int: The exit code
+    """
+    folder_settings = __folder_settings(args)
+    __apply_settings(folder_settings)
+    input_folder = Path(args.input_folder).resolve()
+    output_folder = Path(args.output_folder or args.input_folder).resolve()
+
+    tuning = None
+    if args.autotune and not args.enqueue:
+        try:
+            tuning = __autotune(args, input_folder)
+        except RuntimeError as err:
+            logger.error("Failed to tune the batch size and threads", exc_info=err)
+            return 1
+    threads = tuning.torch_threads if tuning is not None else args.threads
+    worker_args = (
+        folder_settings,
+        args.device,
+        threads,
+        input_folder,
+        output_folder,
+        tuning,
+    )
+
+    if args.queue is not None:
+        if not args.enqueue:
+            output_folder.mkdir(parents=True, exist_ok=True)
+        return __process_queue(args, worker_args, input_folder)
+
+    output_folder.mkdir(parents=True, exist_ok=True)
+    processor = FolderProcessor(input_folder, output_folder, FolderCallbacks(log=print))
+    if tuning is not None:
+        processor.use_tuning(tuning)
+    if args.workers <= 1:
+        __limit_threads(threads)
+        try:
+            processor.model = BatchYolov8(
+                Path(settings.weights),
+                args.device,
+                backend=settings.inference_backend,
+                threads=settings.inference_threads,
+            )
+        except RuntimeError as err:
+            logger.error("Failed to initialize model", exc_info=err)
+            return 1
+        signal.signal(signal.SIGINT, lambda *_: processor.stop())
+        processor.process_folder()
+        return 0
+
+    videos: List[str] = list_videos(input_folder)
+    with DataManager() as data_manager:
+        report_manager = ReportManager(output_folder, data_manager)
+        try:
+            report_manager.check_can_write_report()
+        except PermissionError:
+            print("Please close the report file.")
+            return 1
+        jobs = processor.pending_videos(videos, data_manager)
+
+    workers = min(args.workers, len(jobs))
+    job_queue: "mp.Queue[VideoJob | None]" = mp.get_context("spawn").Queue()
+    for job in jobs + [None] * workers:
+        job_queue.put(job)
+    if not __run_workers(__process_videos, (worker_args, job_queue), workers, threads):
+        return 1
+
+    if settings.get_report:
+        with DataManager() as data_manager:
+            processor.write_report(ReportManager(output_folder, data_manager), videos)
+    return 0
+
+
+def main() -> int:  # pylint: disable=too-many-statements
     """The main function.
 
     Returns:
@@ -21,12 +377,18 @@ def main() -> int:
 
     parser = argparse.ArgumentParser()
 
-    parser.add_argument(
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
         "--video_path",
         type=str,
-        required=True,
         help="The path to the video to process",
     )
+    source.add_argument(
+        "--input_folder",
+        type=str,
+        help="Process the videos in a folder like the detection window does: "
+        + "detection, cutting, the database and the report",
+    )
     parser.add_argument(
         "--weights_path",
         type=str,
@@ -46,8 +408,10 @@ def main() -> int:
         "--batch_size",
         type=int,
         required=False,
-        default=32,
-        help="The batch size to use. Defaults to 32",
+        default=None,
+        help="The batch size to use. Defaults to "
+        + f"{VIDEO_BATCH_SIZE} for --video_path, and to {settings.batch_size} "
+        + "like the app for --input_folder",
     )
 
     parser.add_argument(
@@ -58,6 +422,95 @@ def main() -> int:
         help="Max number of batches to queue. Defaults to 4",
     )
 
+    parser.add_argument(
+        "--backend",
+        type=str,
+        required=False,
+        default="thread",
+        choices=["thread", "process"],
+        help="Decode and preprocess frames in threads or in processes. Defaults to thread",
+    )
+
+    parser.add_argument(
+        "--inference_backend",
+        type=str,
+        required=False,
+        default="torch",
+        choices=["torch", "onnx"],
+        help="Run the model in PyTorch, or export it once and run it with ONNX Runtime "
+        + "on the CPU. Defaults to torch",
+    )
+
+    parser.add_argument(
+        "--decoders",
+        type=int,
+        required=False,
+        default=1,
+        help="Number of keyframe aligned segments of the video to decode in parallel "
+        + "with the thread backend. Defaults to 1",
+    )
+
+    parser.add_argument(
+        "--stride",
+        type=int,
+        required=False,
+        default=1,
+        help="Only run the model on every n-th frame. Defaults to 1",
+    )
+
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Run the model on every frame shortly after fish were detected, "
+        + "and on every n-th frame otherwise",
+    )
+
+    parser.add_argument(
+        "--motion_gate",
+        action="store_true",
+        help="Skip the model on frames where nothing moved",
+    )
+
+    parser.add_argument(
+        "--motion_threshold",
+        type=int,
+        required=False,
+        default=15,
+        help="Gray level difference from the background that counts as motion. "
+        + "Defaults to 15",
+    )
+
+    parser.add_argument(
+        "--motion_area",
+        type=float,
+        required=False,
+        default=0.1,
+        help="Percentage of the frame that has to move. Defaults to 0.1",
+    )
+
+    parser.add_argument(
+        "--motion_max_gap_seconds",
+        type=int,
+        required=False,
+        default=settings.motion_gate_max_gap_seconds,
+        help="Max number of seconds in a row skipped by the motion gate. "
+        + f"Defaults to {settings.motion_gate_max_gap_seconds}",
+    )
+
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Write the time spent in every stage of the pipeline to "
+        + "<video>_metrics.json",
+    )
+
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Also write a timeline of the pipeline to <video>_trace.json, "
+        + "open it in https://ui.perfetto.dev",
+    )
+
     parser.add_argument(
         "--output_path",
         type=str,
@@ -66,25 +519,184 @@ def main() -> int:
         help="Output video path.",
     )
 
+    folder = parser.add_argument_group(
+        "folder", "Options for --input_folder, the defaults are those of the app"
+    )
+    folder.add_argument(
+        "--output_folder",
+        type=str,
+        default=None,
+        help="Where to save the cut videos and the report. "
+        + "Defaults to the input folder",
+    )
+    folder.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes that process videos, each with its own model. "
+        + "Defaults to 1",
+    )
+    folder.add_argument(
+        "--threads",
+        type=int,
+        default=0,
+        help="Max number of threads torch, ONNX Runtime and OpenCV use in each worker. "
+        + "Defaults to 0, no limit",
+    )
+    folder.add_argument(
+        "--autotune",
+        action="store_true",
+        help="Use the batch size, letterbox workers and torch threads that are "
+        + "fastest on this machine instead of --batch_size and --threads. They are "
+        + "measured on the first video with the share of the cores of a worker, "
+        + "and cached per host and model",
+    )
+    folder.add_argument(
+        "--threshold",
+        type=int,
+        default=settings.prediction_threshold,
+        help="Confidence in percent a detection needs. "
+        + f"Defaults to {settings.prediction_threshold}",
+    )
+    folder.add_argument(
+        "--buffer_before",
+        type=int,
+        default=settings.buffer_before,
+        help="Seconds to keep before the fish are seen. "
+        + f"Defaults to {settings.buffer_before}",
+    )
+    folder.add_argument(
+        "--buffer_after",
+        type=int,
+        default=settings.buffer_after,
+        help="Seconds to keep after the fish are seen. "
+        + f"Defaults to {settings.buffer_after}",
+    )
+    folder.add_argument(
+        "--box_around_fish",
+        action="store_true",
+        help="Draw the detections on the cut videos",
+    )
+    folder.add_argument(
+        "--delete_original",
+        action="store_true",
+        help="Delete the videos once they are processed",
+    )
+    folder.add_argument(
+        "--report",
+        type=str,
+        default=None,
+        choices=["CSV", "XLSX", "PDF", "XML"],
+        help="Write a report in this format",
+    )
+    folder.add_argument(
+        "--crf",
+        type=int,
+        default=settings.video_crf,
+        help=f"Quality of the cut videos, lower is better. Defaults to {settings.video_crf}",
+    )
+    folder.add_argument(
+        "--encoders",
+        type=int,
+        default=settings.video_encoders,
+        help="Number of processes encoding the frame ranges of a video. "
+        + f"Defaults to {settings.video_encoders}",
+    )
+    folder.add_argument(
+        "--pipeline_cuts",
+        type=int,
+        default=settings.pipeline_cuts,
+        help="Number of videos a worker cuts while detecting the next. "
+        + f"Defaults to {settings.pipeline_cuts}",
+    )
+    folder.add_argument(
+        "--stream_copy",
+        action="store_true",
+        help="Copy the compressed video instead of re-encoding it when there is "
+        + "nothing to annotate, the cuts are widened to keyframes",
+    )
+    folder.add_argument(
+        "--streaming_cut",
+        action="store_true",
+        help="Cut the videos while detecting",
+    )
+
+    queue = parser.add_argument_group(
+        "queue", "Share the videos of a folder between machines through a work queue"
+    )
+    queue.add_argument(
+        "--queue",
+        type=str,
+        default=None,
+        help="SQLite file of the work queue, on storage every machine can reach. "
+        + "The videos of --input_folder are taken from it",
+    )
+    queue.add_argument(
+        "--enqueue",
+        action="store_true",
+        help="Add the videos of --input_folder to the queue and exit",
+    )
+    queue.add_argument(
+        "--lease_seconds",
+        type=float,
+        default=600.0,
+        help="How long a worker that stopped responding keeps its videos. "
+        + "Defaults to 600",
+    )
+
     args = parser.parse_args()
 
+    if args.input_folder is not None:
+        return __process_folder(args)
+
     try:
-        model = BatchYolov8(Path(args.weights_path), args.device)
+        model = BatchYolov8(
+            Path(args.weights_path),
+            args.device,
+            backend=args.inference_backend,
+            threads=args.threads,
+        )
     except RuntimeError as err:
         logger.error("Failed to initialize model", exc_info=err)
         # print("Failed to initialize detector", err)
         return 1
 
+    motion_gate = None
+    if args.motion_gate:
+        motion_gate = MotionGate(
+            threshold=args.motion_threshold,
+            min_area=args.motion_area / 100,
+            max_gap=int(__get_fps(Path(args.video_path)) * args.motion_max_gap_seconds),
+        )
+
+    metrics = PipelineMetrics(trace=args.trace) if args.metrics or args.trace else None
     stop_event = threading.Event()
     frames_with_fish = process_video(
         model,
         Path(args.video_path),
-        args.batch_size,
+        args.batch_size if args.batch_size is not None else VIDEO_BATCH_SIZE,
         args.max_batches_to_queue,
         Path(args.output_path) if args.output_path is not None else None,
         stop_event,
+        backend=args.backend,
+        decoders=args.decoders,
+        stride=args.stride,
+        adaptive=args.adaptive,
+        motion_gate=motion_gate,
+        metrics=metrics,
     )
 
+    if metrics is not None:
+        video_path = Path(args.video_path)
+        metrics_folder = (
+            Path(args.output_path).parent
+            if args.output_path is not None
+            else video_path.parent
+        )
+        metrics.write_summary(metrics_folder / f"{video_path.stem}_metrics.json")
+        if metrics.trace:
+            metrics.write_trace(metrics_folder / f"{video_path.stem}_trace.json")
+
     # print(f"Found {len(frames_with_fish)} frames with fish")
     logger.info("Found {%s} frames with fish", len(frames_with_fish))
 
@@ -0,0 +1,66 @@
+"""Cheap motion pre-filter that skips the model on frames where nothing changed."""
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import cv2
+import numpy as np
+
+
+@dataclass
+class MotionGate:  # pylint: disable=too-many-instance-attributes
+    """Compares downscaled gray frames to a running background of the video.
+
+    A frame is passed to the model if enough pixels differ from the background, or if
+    no frame was passed for max_gap frames, so fish that stopped moving and blended
+    into the background are still seen every now and then.
+    Frames must be passed in order.
+    """
+
+    threshold: int = 15
+    min_area: float = 0.001
+    max_gap: int = 50
+    width: int = 64
+    learning_rate: float = 0.05
+    background: Optional[np.ndarray[Any, Any]] = field(default=None)
+    last_inferred: Optional[int] = field(default=None)
+    gated_frames: int = field(default=0)
+    inferred_frames: int = field(default=0)
+
+    def __downscale(self, frame: np.ndarray[Any, Any]) -> np.ndarray[Any, Any]:
+        """Returns the frame as a small float32 gray image."""
+        height = max(1, round(frame.shape[0] * self.width / frame.shape[1]))
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        gray: np.ndarray[Any, Any] = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(
+            np.float32
+        )
+        return gray
+
+    def has_motion(self, frame: np.ndarray[Any, Any]) -> bool:
+        """Returns whether a BGR frame differs from the background, and updates it."""
+        gray = self.__downscale(frame)
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray
+            return True
+
+        changed = np.count_nonzero(cv2.absdiff(gray, self.background) > self.threshold)
+        cv2.accumulateWeighted(gray, self.background, self.learning_rate)
+        return bool(changed >= self.min_area * gray.size)
+
+    def should_infer(self, frame_index: int, frame: np.ndarray[Any, Any]) -> bool:
+        """Returns whether a frame should be passed to the model.
+
+        Args:
+            frame_index: The index of the frame in the video.
+            frame: The BGR frame.
+        """
+        motion = self.has_motion(frame)
+        if (
+            motion
+            or self.last_inferred is None
+            or frame_index - self.last_inferred >= self.max_gap
+        ):
+            self.last_inferred = frame_index
+            self.inferred_frames += 1
+            return True
+        self.gated_frames += 1
+        return False
@@ -0,0 +1,154 @@
+"""Runs the model of BatchYolov8 with ONNX Runtime, for computers without a GPU."""
+import copy
+import inspect
+import os
+import warnings
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+import torch
+from torch import Tensor
+from ultralytics.nn.modules.head import Detect
+
+from app.common import Common
+from app.logger import get_logger
+
+from .detection_cache import file_hash
+
+logger = get_logger()
+
+ONNX_OPSET = 17
+
+
+def exported_model_path(weights_path: Path, input_shape: Tuple[int, int]) -> Path:
+    """The path of the model exported from a version of the weights, for an input size.
+
+    Args:
+        weights_path: The weights of the model.
+        input_shape: The (height, width) of the images passed to the model.
+
+    Returns:
+        The path in the exported models folder.
+    """
+    height, width = input_shape
+    weights_hash = file_hash(weights_path)[:16]
+    return (
+        Common.exported_models_folder
+        / f"{weights_path.stem}-{weights_hash}-{height}x{width}.onnx"
+    )
+
+
+def export_onnx(
+    model: torch.nn.Module, input_shape: Tuple[int, int], path: Path
+) -> None:
+    """Export a model to ONNX, with any number of images in a batch.
+
+    The anchors of the detection head are traced for the input size, so the exported
+    model only takes images of that size.
+
+    Args:
+        model: The model loaded from the weights.
+        input_shape: The (height, width) of the images passed to the model.
+        path: Where to save the exported model.
+    """
+    model = copy.deepcopy(model).float().eval()
+    for module in model.modules():
+        if isinstance(module, Detect):
+            # Only return the predictions, not the feature maps
+            module.export = True
+            module.format = "onnx"
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+    export_kwargs: Dict[str, Any] = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # Newer torch versions default to the dynamo exporter, keep the tracer
+        export_kwargs["dynamo"] = False
+    with warnings.catch_warnings():
+        # The tracer warns about the shape checks of the detection head
+        warnings.simplefilter("ignore")
+        torch.onnx.export(
+            model,
+            (torch.zeros(1, 3, *input_shape),),
+            str(temporary_path),
+            input_names=["images"],
+            output_names=["output0"],
+            dynamic_axes={"images": {0: "batch"}, "output0": {0: "batch"}},
+            opset_version=ONNX_OPSET,
+            **export_kwargs,
+        )
+    os.replace(temporary_path, path)
+
+
+class OnnxModel:  # pylint: disable=too-few-public-methods
+    """An exported model run by ONNX Runtime on the CPU, called like the model of
+    BatchYolov8."""
+
+    def __init__(self, onnx_path: Path, threads: int = 0) -> None:
+        """
+        Args:
+            onnx_path: The exported model.
+            threads: The number of threads used by an operator, 0 lets ONNX Runtime
+                     choose.
+
+        Raises:
+            RuntimeError: If ONNX Runtime is not installed.
+        """
+        try:
+            import onnxruntime  # pylint: disable=import-outside-toplevel
+        except ImportError as err:
+            raise RuntimeError(
+                "The onnx backend needs onnxruntime, install it with "
+                + "`poetry install --with onnx`"
+            ) from err
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        self.session = onnxruntime.InferenceSession(
+            str(onnx_path), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+        # The names, the stride and the input size of quantized models
+        self.metadata: Dict[str, str] = dict(
+            self.session.get_modelmeta().custom_metadata_map
+        )
+
+    @classmethod
+    def from_weights(
+        cls,
+        model: torch.nn.Module,
+        weights_path: Path,
+        input_shape: Tuple[int, int],
+        threads: int = 0,
+    ) -> "OnnxModel":
+        """Run a model with ONNX Runtime, exporting it the first time.
+
+        Args:
+            model: The model loaded from the weights.
+            weights_path: The weights, the export is reused while they are unchanged.
+            input_shape: The (height, width) of the images passed to the model.
+            threads: The number of threads used by an operator.
+
+        Returns:
+            The exported model.
+        """
+        onnx_path = exported_model_path(weights_path, input_shape)
+        if not onnx_path.exists():
+            logger.info("Exporting %s to %s", weights_path.name, onnx_path)
+            export_onnx(model, input_shape, onnx_path)
+        return cls(onnx_path, threads)
+
+    def __call__(self, imgs: Tensor, **_: Any) -> Tuple[Tensor, None]:
+        """Run the model on prepared images.
+
+        Returns:
+            The predictions, and None in place of the feature maps of the PyTorch
+            model.
+        """
+        (predictions,) = self.session.run(
+            None, {self.input_name: imgs.detach().cpu().numpy()}
+        )
+        return torch.from_numpy(predictions), None
@@ -0,0 +1,205 @@
+"""Timing of the stages of the detection pipeline, to tell where a run spends its
+time.
+
+Every stage records spans of (start, end) on the thread that ran it, and the sizes of
+the queues between the stages are sampled every time a batch is taken by the model.
+The summary adds up the spans per stage, and the trace holds every span, in the
+Chrome trace event format that chrome://tracing and https://ui.perfetto.dev show as
+a timeline with a row per thread.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+# The stages in pipeline order, see ThreadedFrameGrabber and process_video
+STAGES = (
+    "decode",  # Reading, sampling and motion gating the frames of a batch
+    "unprocessed_queue_put",  # The decoder waiting for room in the queue
+    "unprocessed_queue_get",  # A letterbox worker waiting for a batch
+    "tensor_pool_acquire",  # A letterbox worker waiting for a free tensor
+    "letterbox",
+    "processed_queue_put",  # A letterbox worker waiting for room in the queue
+    "processed_queue_get",  # The model waiting for a letterboxed batch
+    "inference",
+    "nms",
+    "postprocess",  # Scaling the boxes and copying them to the host
+    "store",  # Appending the detections to the detection store
+    "annotate",  # Drawing the detections and encoding the frames
+    "streaming_cut",
+    "cut",
+)
+
+# The model waiting for batches more than this share of the time is decode-bound
+DECODE_BOUND_WAIT = 0.1
+
+
+class PipelineMetrics:  # pylint: disable=too-many-instance-attributes
+    """The spans of the stages and the queue sizes of a detection run, safe to record
+    from every thread of the pipeline."""
+
+    def __init__(self, trace: bool = False) -> None:
+        """
+        Args:
+            trace: Keep every span for write_trace, not just the totals per stage.
+        """
+        self.trace = trace
+        self.start = time.perf_counter()
+        self.detection_end: float | None = None
+        self.end = self.start
+        self.frames = 0
+        self.__lock = threading.Lock()
+        self.__totals: Dict[str, List[float]] = {}  # count, seconds, max seconds
+        self.__spans: List[Tuple[str, int, float, float]] = []
+        self.__queue_samples: Dict[str, List[Tuple[float, int]]] = {}
+        self.__queue_capacity: Dict[str, int] = {}
+        self.__thread_names: Dict[int, str] = {}
+
+    def add(self, stage: str, start: float, end: float) -> None:
+        """Record that the current thread spent start to end, from
+        time.perf_counter, in a stage."""
+        with self.__lock:
+            total = self.__totals.setdefault(stage, [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += end - start
+            total[2] = max(total[2], end - start)
+            self.end = max(self.end, end)
+            if self.trace:
+                thread = threading.current_thread()
+                self.__thread_names[thread.ident or 0] = thread.name
+                self.__spans.append((stage, thread.ident or 0, start, end))
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """Record the time spent in the with block in a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, start, time.perf_counter())
+
+    def sample_queue(self, queue: str, size: int, capacity: int = 0) -> None:
+        """Record the number of batches in a queue now."""
+        with self.__lock:
+            self.__queue_samples.setdefault(queue, []).append(
+                (time.perf_counter(), size)
+            )
+            if capacity > 0:
+                self.__queue_capacity[queue] = capacity
+
+    def finish_detection(self, frames: int) -> None:
+        """Mark the end of detection, after the frames of the video were processed."""
+        self.frames = frames
+        self.detection_end = time.perf_counter()
+        self.end = max(self.end, self.detection_end)
+
+    def summary(self) -> Dict[str, Any]:
+        """The time spent in every stage, and the sizes of the queues.
+
+        The stages run in parallel on several threads, so their shares of the
+        detection time add up to more than 1. The run is decode-bound when the model
+        waits for letterboxed batches more than a tenth of the time, and model-bound
+        otherwise.
+
+        Returns:
+            The summary, as written by write_summary.
+        """
+        detection_end = self.detection_end or self.end
+        detection_seconds = max(detection_end - self.start, 1e-9)
+        with self.__lock:
+            stages = {
+                stage: {
+                    "count": int(count),
+                    "seconds": seconds,
+                    "mean_ms": seconds / count * 1000,
+                    "max_ms": max_seconds * 1000,
+                    "share": seconds / detection_seconds,
+                }
+                for stage, (count, seconds, max_seconds) in sorted(
+                    self.__totals.items(), key=lambda item: self.__stage_order(item[0])
+                )
+            }
+            queues = {
+                queue: {
+                    "samples": len(samples),
+                    "mean": sum(size for _, size in samples) / len(samples),
+                    "max": max(size for _, size in samples),
+                    "capacity": self.__queue_capacity.get(queue),
+                }
+                for queue, samples in self.__queue_samples.items()
+            }
+
+        model_wait = stages.get("processed_queue_get", {}).get("share", 0.0)
+        return {
+            "frames": self.frames,
+            "detection_seconds": detection_seconds,
+            "fps": self.frames / detection_seconds,
+            "seconds": self.end - self.start,
+            "bound": "decode" if model_wait > DECODE_BOUND_WAIT else "model",
+            "stages": stages,
+            "queues": queues,
+        }
+
+    @staticmethod
+    def __stage_order(stage: str) -> int:
+        return STAGES.index(stage) if stage in STAGES else len(STAGES)
+
+    def write_summary(self, path: Path, **extra: Any) -> None:
+        """Write the summary as JSON, with extra fields like the name of the video."""
+        path.write_text(
+            json.dumps({**extra, **self.summary()}, indent=4), encoding="utf-8"
+        )
+
+    def write_trace(self, path: Path) -> None:
+        """Write the spans and queue sizes in the Chrome trace event format.
+
+        Raises:
+            ValueError: If the metrics were not created with trace.
+        """
+        if not self.trace:
+            raise ValueError("The spans are only kept with trace=True")
+
+        def microseconds(seconds: float) -> float:
+            return (seconds - self.start) * 1e6
+
+        pid = os.getpid()
+        with self.__lock:
+            events: List[Dict[str, Any]] = [
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+                for tid, name in self.__thread_names.items()
+            ]
+            events += [
+                {
+                    "name": stage,
+                    "ph": "X",
+                    "pid": pid,
+                    "tid": tid,
+                    "ts": microseconds(start),
+                    "dur": (end - start) * 1e6,
+                }
+                for stage, tid, start, end in self.__spans
+            ]
+            events += [
+                {
+                    "name": f"{queue} queue",
+                    "ph": "C",
+                    "pid": pid,
+                    "ts": microseconds(sampled),
+                    "args": {"batches": size},
+                }
+                for queue, samples in self.__queue_samples.items()
+                for sampled, size in samples
+            ]
+        path.write_text(
+            json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}),
+            encoding="utf-8",
+        )
@@ -0,0 +1,242 @@
+"""This module contains the ProcessFrameGrabber class. """
+
+import math
+import multiprocessing as mp
+from dataclasses import dataclass, field
+from multiprocessing import cpu_count
+from multiprocessing.process import BaseProcess
+from multiprocessing.synchronize import Event
+from pathlib import Path
+from queue import Empty
+from types import TracebackType
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+import cv2
+import numpy as np
+import torch
+from torch import Tensor
+
+from app.detection.batch_yolov8 import BatchYolov8
+from app.detection.shared_ring import (
+    DONE_MESSAGE,
+    ERROR_MESSAGE,
+    STOP_MESSAGE,
+    RingSpec,
+    SharedBatchRing,
+    decode_worker,
+    letterbox_worker,
+)
+from app.detection.tensor_pool import TensorPool
+from app.logger import get_logger
+
+logger = get_logger()
+
+PROCESS_JOIN_TIMEOUT = 5.0
+
+
+@dataclass
+class ProcessFrameGrabber:  # pylint: disable=too-many-instance-attributes
+    """Class for grabbing frames from a video file like ThreadedFrameGrabber,
+    but decoding and letterboxing in separate processes.
+
+    The processes pass batches through a ring of slots in shared memory, so no frames
+    are pickled. Batches are returned in the same index order as they were decoded.
+    There are num_workers letterboxing processes, half the cores when 0."""
+
+    batch_size: int
+    model: BatchYolov8
+    video_path: Path
+    batch_counter: int = 0
+    num_workers: int = 0
+    capture: cv2.VideoCapture = field(init=False)
+    frame_count: int = field(init=False)
+    ring: SharedBatchRing = field(init=False)
+    tensor_pool: TensorPool = field(init=False)
+    free_slots: Any = field(init=False)
+    decoded_batches: Any = field(init=False)
+    prepared_batches: Any = field(init=False)
+    shutdown_flag: Event = field(init=False)
+    processes: List[BaseProcess] = field(init=False)
+    frames_read: int = field(default=0)
+    skipped_frames: int = field(default=0)
+    # Every frame is decoded and letterboxed, these are for parity with the thread backend
+    grabbed_frames: int = field(default=0)
+    skip_seconds: float = field(default=0.0)
+    decoded_batch_count: Optional[int] = field(default=None)
+    frames_returned: int = field(default=0)
+    ready_batches: Dict[int, Tuple[int, int]] = field(default_factory=dict)
+    ring_slots: Dict[int, int] = field(default_factory=dict)
+
+    def __enter__(self) -> "ProcessFrameGrabber":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],  # pylint: disable=unused-argument
+        exc_value: Optional[BaseException],  # pylint: disable=unused-argument
+        traceback: Optional[TracebackType],  # pylint: disable=unused-argument
+    ) -> None:
+        self.close()
+
+    def __post_init__(self) -> None:
+        # Only used for the video properties, the frames are decoded in another process
+        self.capture = cv2.VideoCapture(str(self.video_path))
+        if not self.capture.isOpened():
+            raise RuntimeError(f"Could not open video file {self.video_path}")
+
+        if self.num_workers <= 0:
+            self.num_workers = max(1, int(cpu_count() / 2))
+
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        frame_shape = (
+            int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        )
+        if not all(frame_shape):
+            raise RuntimeError(f"Could not read frame size of {self.video_path}")
+
+        self.ring = SharedBatchRing(
+            RingSpec(
+                "",
+                self.num_workers + 2,
+                self.batch_size,
+                frame_shape,
+                self.model.input_shape,
+            ),
+            create=True,
+        )
+        self.tensor_pool = self.model.create_tensor_pool(2, self.batch_size)
+
+        # Spawn, as forking a process that has initialized torch or CUDA is unsafe
+        context = mp.get_context("spawn")
+        self.free_slots = context.Queue()
+        self.decoded_batches = context.Queue()
+        self.prepared_batches = context.Queue()
+        self.shutdown_flag = context.Event()
+        for slot in range(self.ring.spec.slots):
+            self.free_slots.put(slot)
+
+        self.processes = [
+            context.Process(
+                target=decode_worker,
+                args=(
+                    self.video_path,
+                    self.ring.spec,
+                    self.frame_count,
+                    self.free_slots,
+                    self.decoded_batches,
+                    self.prepared_batches,
+                    self.shutdown_flag,
+                ),
+                daemon=True,
+            )
+        ]
+        params = self.model.letterbox_params(frame_shape)
+        for _ in range(self.num_workers):
+            self.processes.append(
+                context.Process(
+                    target=letterbox_worker,
+                    args=(
+                        self.ring.spec,
+                        params,
+                        self.decoded_batches,
+                        self.prepared_batches,
+                        self.shutdown_flag,
+                    ),
+                    daemon=True,
+                )
+            )
+        for process in self.processes:
+            process.start()
+
+    def __receive(self, timeout: float) -> bool:
+        """Receives one message from the worker processes.
+
+        Returns:
+            False if no message was received in time.
+        """
+        try:
+            message = self.prepared_batches.get(timeout=timeout)
+        except Empty:
+            return False
+
+        if message[0] == DONE_MESSAGE:
+            (
+                _,
+                self.decoded_batch_count,
+                self.frames_read,
+                self.skipped_frames,
+            ) = message
+        elif message[0] == ERROR_MESSAGE:
+            raise RuntimeError(f"Failed to decode {self.video_path}: {message[1]}")
+        else:
+            batch_index, slot, count = message
+            self.ready_batches[batch_index] = (slot, count)
+        return True
+
+    def close(self) -> None:
+        """Stops the worker processes and frees the shared memory"""
+        self.shutdown_flag.set()
+        self.free_slots.put(STOP_MESSAGE)
+        for _ in range(self.num_workers):
+            self.decoded_batches.put(STOP_MESSAGE)
+        logger.debug("Set shutdown flag")
+        for process in self.processes:
+            process.join(PROCESS_JOIN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        logger.debug("Joined worker processes")
+        for queue in (self.free_slots, self.decoded_batches, self.prepared_batches):
+            queue.cancel_join_thread()
+        self.ring.close()
+        self.capture.release()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def total_batch_count(self) -> int:
+        """Returns the total number of batches that will be returned by this object."""
+        if self.decoded_batch_count is not None:
+            return self.decoded_batch_count
+        return int(
+            math.ceil((self.frame_count - self.skipped_frames) / self.batch_size)
+        )
+
+    def get_batch(
+        self,
+    ) -> Tuple[Tensor, List[np.ndarray[Any, Any]], List[int]] | None:
+        """Returns the next batch of frames from the video file,
+        along with the index of every frame in the video.
+
+        The frames are views of the shared memory, valid until the batch is released.
+        """
+        while self.batch_counter not in self.ready_batches:
+            if self.is_done() or not self.__receive(timeout=5):
+                return None
+
+        pool_slot = self.tensor_pool.acquire(timeout=5)
+        if pool_slot is None:
+            logger.warning("No free tensors, release the batches when done with them")
+            return None
+
+        ring_slot, count = self.ready_batches.pop(self.batch_counter)
+        processed_batch = self.tensor_pool.load(
+            pool_slot, count, source=self.ring.images[ring_slot]
+        )
+        self.ring_slots[processed_batch.untyped_storage().data_ptr()] = ring_slot
+
+        frame_indices = list(range(self.frames_returned, self.frames_returned + count))
+        self.frames_returned += count
+
+        self.batch_counter += 1
+        return processed_batch, list(self.ring.frames[ring_slot, :count]), frame_indices
+
+    def release_batch(self, processed_batch: Tensor) -> None:
+        """Returns the tensor and the shared memory of a batch from get_batch
+        once the model and the caller are done with its frames."""
+        self.tensor_pool.release(processed_batch)
+        ring_slot = self.ring_slots.pop(processed_batch.untyped_storage().data_ptr())
+        self.free_slots.put(ring_slot)
+
+    def is_done(self) -> bool:
+        """Returns true if all batches have been returned"""
+        return self.batch_counter >= self.total_batch_count()
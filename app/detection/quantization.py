@@ -0,0 +1,333 @@
+"""Post-training int8 quantization of the weights of BatchYolov8, and the accuracy
+of the quantized model.
+
+The model is exported to ONNX and quantized statically with ONNX Runtime, with the
+ranges of the activations calibrated on frames of our own videos. The quantized
+model is saved next to the weights as <name>-int8.onnx, and is selected like any
+other weights.
+"""
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import torch
+from ultralytics.nn.modules.head import Detect
+from ultralytics.utils.metrics import ap_per_class, box_iou
+
+from app.logger import get_logger
+
+try:
+    import onnx
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        CalibrationMethod,
+        QuantFormat,
+        QuantType,
+        quantize_static,
+    )
+except ImportError as err:
+    raise ImportError(
+        "Quantization needs onnx and onnxruntime, install them with "
+        + "`poetry install --with onnx`"
+    ) from err
+
+from .batch_yolov8 import BatchYolov8
+from .detection_cache import file_hash
+from .onnx_model import export_onnx
+
+logger = get_logger()
+
+QUANTIZED_SUFFIX = "-int8"
+
+# The IoU thresholds of mAP50-95
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+
+def quantized_weights_path(weights_path: Path) -> Path:
+    """The path of the quantized model of some weights, next to the weights."""
+    return weights_path.with_name(f"{weights_path.stem}{QUANTIZED_SUFFIX}.onnx")
+
+
+def is_up_to_date(weights_path: Path, quantized_path: Path) -> bool:
+    """Whether a quantized model was made from the current version of the weights."""
+    if not quantized_path.exists():
+        return False
+    metadata = {
+        prop.key: prop.value
+        for prop in onnx.load(
+            str(quantized_path), load_external_data=False
+        ).metadata_props
+    }
+    return metadata.get("source_hash") == file_hash(weights_path)
+
+
+def read_images(paths: Sequence[Path]) -> Tuple[List[Path], List[Any]]:
+    """Read images, skipping the ones that are missing or can't be read.
+
+    Returns:
+        The paths of the images that were read, and the images.
+    """
+    read_paths: List[Path] = []
+    images: List[Any] = []
+    for path in paths:
+        image = cv2.imread(str(path))
+        if image is None:
+            logger.warning("Skipping %s, it could not be read", path)
+            continue
+        read_paths.append(path)
+        images.append(image)
+    return read_paths, images
+
+
+class FrameCalibrationReader(  # pylint: disable=abstract-method
+    CalibrationDataReader  # type: ignore[misc]
+):
+    """Feeds frames to the calibration, prepared like the frames BatchYolov8 runs on."""
+
+    def __init__(
+        self, model: BatchYolov8, images: Sequence[Path], batch_size: int
+    ) -> None:
+        self.model = model
+        self.images = images
+        self.batch_size = batch_size
+        self.batches: Optional[Iterator[Dict[str, np.ndarray[Any, Any]]]] = None
+
+    def __read_batches(self) -> Iterator[Dict[str, np.ndarray[Any, Any]]]:
+        for start in range(0, len(self.images), self.batch_size):
+            _, frames = read_images(self.images[start : start + self.batch_size])
+            if frames:
+                yield {"images": self.model.prepare_images(frames).numpy()}
+
+    def get_next(self) -> Optional[Dict[str, np.ndarray[Any, Any]]]:
+        """The next batch of frames, or None when all of them have been read."""
+        if self.batches is None:
+            self.batches = self.__read_batches()
+        return next(self.batches, None)
+
+    def rewind(self) -> None:
+        """Start over from the first frame."""
+        self.batches = None
+
+
+def __head_nodes_to_exclude(model: Any, onnx_path: Path) -> List[str]:
+    """The nodes that decode the boxes in the detection head.
+
+    Their inputs span the whole image, so they lose too much precision in int8. The
+    convolutions of the head are still quantized.
+    """
+    head = next(
+        index for index, module in enumerate(model.model) if isinstance(module, Detect)
+    )
+    prefix = f"/model.{head}/"
+    return [
+        node.name
+        for node in onnx.load(str(onnx_path)).graph.node
+        if node.name.startswith(prefix)
+        and "/cv2" not in node.name
+        and "/cv3" not in node.name
+    ]
+
+
+def quantize_weights(
+    weights_path: Path,
+    calibration_images: Sequence[Path],
+    img_size: int = 640,
+    batch_size: int = 8,
+) -> Path:
+    """Quantize weights to int8, unless they are already quantized.
+
+    Args:
+        weights_path: The weights in data/models.
+        calibration_images: Frames from our videos to calibrate the activations with.
+        img_size: The size of the images passed to the model.
+        batch_size: The number of frames in a calibration batch.
+
+    Returns:
+        The path of the quantized model, next to the weights.
+    """
+    quantized_path = quantized_weights_path(weights_path)
+    if is_up_to_date(weights_path, quantized_path):
+        logger.info("%s is up to date", quantized_path.name)
+        return quantized_path
+    if len(calibration_images) == 0:
+        raise ValueError("Quantization needs frames to calibrate with")
+
+    model = BatchYolov8(weights_path, "cpu", img_size=img_size)
+    torch_model: Any = model.model
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        float_path = Path(tmp_dir) / "float.onnx"
+        int8_path = Path(tmp_dir) / "int8.onnx"
+        export_onnx(torch_model, model.input_shape, float_path)
+
+        quantize_static(
+            str(float_path),
+            str(int8_path),
+            FrameCalibrationReader(model, calibration_images, batch_size),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=CalibrationMethod.MinMax,
+            nodes_to_exclude=__head_nodes_to_exclude(torch_model, float_path),
+        )
+
+        # What BatchYolov8 needs to run the model without the weights
+        quantized = onnx.load(str(int8_path))
+        for key, value in {
+            "names": json.dumps({int(key): name for key, name in model.names.items()}),
+            "stride": str(int(torch_model.stride.max())),
+            "imgsz": str(model.imgsz),
+            "source_hash": file_hash(weights_path),
+            "calibration_images": str(len(calibration_images)),
+        }.items():
+            prop = quantized.metadata_props.add()
+            prop.key, prop.value = key, value
+
+        temporary_path = quantized_path.with_name(
+            f"{quantized_path.stem}.{os.getpid()}.tmp"
+        )
+        onnx.save(quantized, str(temporary_path))
+        os.replace(temporary_path, quantized_path)
+
+    logger.info("Saved the quantized model to %s", quantized_path)
+    return quantized_path
+
+
+def read_yolo_labels(image_path: Path, width: int, height: int) -> np.ndarray[Any, Any]:
+    """Read the labels of an image in a YOLO dataset.
+
+    Args:
+        image_path: The image, the labels are in the .txt file next to it.
+        width: The width of the image.
+        height: The height of the image.
+
+    Returns:
+        An (n, 5) array of the class and the xyxy box of every label in pixels.
+    """
+    label_path = image_path.with_suffix(".txt")
+    if not label_path.exists() or label_path.stat().st_size == 0:
+        return np.zeros((0, 5), dtype=np.float32)
+
+    labels = np.loadtxt(label_path, dtype=np.float32, ndmin=2)
+    class_id, x_center, y_center, box_width, box_height = labels.T
+    return np.stack(
+        [
+            class_id,
+            (x_center - box_width / 2) * width,
+            (y_center - box_height / 2) * height,
+            (x_center + box_width / 2) * width,
+            (y_center + box_height / 2) * height,
+        ],
+        axis=1,
+    )
+
+
+def match_predictions(
+    records: np.ndarray[Any, Any], labels: np.ndarray[Any, Any]
+) -> np.ndarray[Any, Any]:
+    """Match the detections in an image to its labels, like the YOLO validator.
+
+    Args:
+        records: The detections with DETECTION_DTYPE.
+        labels: The labels from read_yolo_labels.
+
+    Returns:
+        A (detections, 10) array of whether each detection is a true positive at the
+        IoU thresholds of mAP50-95.
+    """
+    correct = np.zeros((len(records), len(IOU_THRESHOLDS)), dtype=bool)
+    if len(records) == 0 or len(labels) == 0:
+        return correct
+
+    boxes = np.stack(
+        [records["xmin"], records["ymin"], records["xmax"], records["ymax"]], axis=1
+    )
+    iou = box_iou(
+        torch.from_numpy(labels[:, 1:]).float(), torch.from_numpy(boxes).float()
+    ).numpy()
+    # Zero out the detections of the wrong class
+    iou *= labels[:, :1] == records["class_id"][None, :]
+    for index, threshold in enumerate(IOU_THRESHOLDS):
+        matches = np.array(np.nonzero(iou >= threshold)).T
+        if len(matches) > 1:
+            # The best match of every detection, then of every label
+            matches = matches[iou[matches[:, 0], matches[:, 1]].argsort()[::-1]]
+            matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+            matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+        correct[matches[:, 1].astype(int), index] = True
+    return correct
+
+
+def box_metrics(
+    predictions: Sequence[np.ndarray[Any, Any]], labels: Sequence[np.ndarray[Any, Any]]
+) -> Dict[str, float]:
+    """The precision, recall and mAP of the detections in a set of images.
+
+    Args:
+        predictions: The detections of every image, with DETECTION_DTYPE.
+        labels: The labels of every image, from read_yolo_labels.
+
+    Returns:
+        The mean precision, recall, mAP50 and mAP50-95 over the classes.
+    """
+    correct = np.concatenate(
+        [
+            match_predictions(records, label)
+            for records, label in zip(predictions, labels)
+        ]
+    )
+    records = np.concatenate(predictions)
+    target_classes = np.concatenate([label[:, 0] for label in labels])
+    if len(target_classes) == 0:
+        raise ValueError("There are no labels to compare the detections with")
+
+    (_, _, precision, recall, _, average_precision, *_) = ap_per_class(
+        correct, records["conf"], records["class_id"], target_classes
+    )
+    return {
+        "precision": float(precision.mean()) if len(precision) else 0.0,
+        "recall": float(recall.mean()) if len(recall) else 0.0,
+        "map50": float(average_precision[:, 0].mean()) if len(recall) else 0.0,
+        "map50_95": float(average_precision.mean()) if len(recall) else 0.0,
+    }
+
+
+def evaluate(
+    model: BatchYolov8, val_list: Path, batch_size: int = 8
+) -> Dict[str, float]:
+    """Run a model on the images of a validation list and compare with their labels.
+
+    Args:
+        model: The model, with a low conf_thres like the YOLO validator uses.
+        val_list: A file with the path of an image on every line, like the val.txt
+                  written by split_train_val.
+        batch_size: The number of images in a batch.
+
+    Returns:
+        The metrics from box_metrics, and the number of images, without the ones
+        that could not be read.
+    """
+    images = [
+        Path(line.strip())
+        for line in val_list.read_text(encoding="utf-8").splitlines()
+        if line.strip()
+    ]
+    predictions: List[np.ndarray[Any, Any]] = []
+    labels: List[np.ndarray[Any, Any]] = []
+    for start in range(0, len(images), batch_size):
+        batch, frames = read_images(images[start : start + batch_size])
+        if not frames:
+            continue
+        predictions += model.predict_batch_records(frames, model.prepare_images(frames))
+        labels += [
+            read_yolo_labels(image, frame.shape[1], frame.shape[0])
+            for image, frame in zip(batch, frames)
+        ]
+
+    metrics = box_metrics(predictions, labels)
+    metrics["images"] = len(labels)
+    return metrics
@@ -0,0 +1,248 @@
+"""Shared memory ring of frame batches and the processes that fill it.
+
+This module is imported by the spawned decode and letterbox processes,
+so it should not import torch or ultralytics.
+"""
+import math
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing.synchronize import Event
+from pathlib import Path
+from queue import Empty, Full
+from typing import Any, List, Tuple
+
+import cv2
+import numpy as np
+
+from app.detection.letterbox import PAD_VALUE, BatchLetterbox, LetterboxParams
+from app.logger import get_logger
+
+logger = get_logger()
+
+# Messages put on the prepared queue besides (batch_index, slot, count)
+DONE_MESSAGE = -1
+ERROR_MESSAGE = -2
+
+# Put on the free and decoded queues to wake up waiting workers when stopping
+STOP_MESSAGE = None
+
+QUEUE_TIMEOUT = 1.0
+
+
+@dataclass(frozen=True)
+class RingSpec:
+    """Describes the shared memory of a ring, so other processes can attach to it."""
+
+    name: str
+    slots: int
+    batch_size: int
+    frame_shape: Tuple[int, int]
+    image_shape: Tuple[int, int]
+
+    @property
+    def frames_shape(self) -> Tuple[int, ...]:
+        """The shape of the original frames of all slots."""
+        return (self.slots, self.batch_size, *self.frame_shape, 3)
+
+    @property
+    def images_shape(self) -> Tuple[int, ...]:
+        """The shape of the letterboxed images of all slots."""
+        return (self.slots, self.batch_size, 3, *self.image_shape)
+
+    @property
+    def nbytes(self) -> int:
+        """The size of the shared memory."""
+        return math.prod(self.frames_shape) + math.prod(self.images_shape)
+
+
+class SharedBatchRing:
+    """A ring of batch slots in shared memory.
+
+    Every slot holds the original frames of a batch and the letterboxed images,
+    so batches are passed between processes as slot indices without pickling.
+    """
+
+    def __init__(self, spec: RingSpec, create: bool = False) -> None:
+        """Creates the shared memory, or attaches to existing shared memory.
+
+        Args:
+            spec: The spec of the ring. The name is ignored when creating.
+            create: Whether to create the shared memory.
+        """
+        if create:
+            self.memory = SharedMemory(create=True, size=spec.nbytes)
+            spec = RingSpec(
+                self.memory.name,
+                spec.slots,
+                spec.batch_size,
+                spec.frame_shape,
+                spec.image_shape,
+            )
+        else:
+            self.memory = SharedMemory(name=spec.name)
+        self.spec = spec
+        self.owner = create
+
+        frames_size = math.prod(spec.frames_shape)
+        self.frames: np.ndarray[Any, Any] = np.ndarray(
+            spec.frames_shape, dtype=np.uint8, buffer=self.memory.buf
+        )
+        self.images: np.ndarray[Any, Any] = np.ndarray(
+            spec.images_shape,
+            dtype=np.uint8,
+            buffer=self.memory.buf,
+            offset=frames_size,
+        )
+        if create:
+            self.images.fill(PAD_VALUE)
+
+    def close(self) -> None:
+        """Detaches from the shared memory, and frees it if this process created it."""
+        # The views must be gone before the memory can be closed
+        del self.frames
+        del self.images
+        try:
+            self.memory.close()
+        except BufferError:
+            # Frames handed out are still referenced, the memory is unmapped with them
+            logger.debug("Shared memory %s is still in use", self.memory.name)
+        if self.owner:
+            self.memory.unlink()
+
+
+def put_until_stopped(queue: Any, item: Any, stop_event: Event) -> bool:
+    """Puts an item on a queue, giving up if the stop event is set.
+
+    Returns:
+        True if the item was put on the queue.
+    """
+    while not stop_event.is_set():
+        try:
+            queue.put(item, timeout=QUEUE_TIMEOUT)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def read_frame_into(
+    capture: cv2.VideoCapture, destination: np.ndarray[Any, Any]
+) -> bool:
+    """Reads the next frame of a capture into destination.
+
+    Returns:
+        False if no frame could be read.
+    """
+    ret, frame = capture.read(destination)
+    if not ret or frame is None:
+        return False
+    if frame.shape != destination.shape:
+        # Should not happen within one video, but don't fail on odd frames
+        cv2.resize(
+            frame,
+            (destination.shape[1], destination.shape[0]),
+            dst=destination,
+        )
+    elif not np.shares_memory(frame, destination):
+        np.copyto(destination, frame)
+    return True
+
+
+# pylint: disable=too-many-arguments
+def decode_worker(
+    video_path: Path,
+    spec: RingSpec,
+    frame_count: int,
+    free_slots: Any,
+    decoded_batches: Any,
+    prepared_batches: Any,
+    stop_event: Event,
+) -> None:
+    """Decodes the video into free slots of the ring, one batch at a time.
+
+    Sends (batch_index, slot, count) for every batch on decoded_batches, and
+    (DONE_MESSAGE, batch_count, frames_read, skipped_frames) on prepared_batches when done.
+    """
+    ring = SharedBatchRing(spec)
+    capture = cv2.VideoCapture(str(video_path))
+    frames_read = 0
+    skipped_frames = 0
+    batch_index = 0
+    try:
+        end_of_video = False
+        while not end_of_video and not stop_event.is_set():
+            try:
+                slot = free_slots.get(timeout=QUEUE_TIMEOUT)
+            except Empty:
+                continue
+            if slot is STOP_MESSAGE:
+                break
+
+            count = 0
+            while count < spec.batch_size:
+                if read_frame_into(capture, ring.frames[slot, count]):
+                    frames_read += 1
+                    count += 1
+                elif frames_read + skipped_frames < frame_count:
+                    skipped_frames += 1
+                else:
+                    end_of_video = True
+                    break
+
+            if count == 0:
+                break
+            if not put_until_stopped(
+                decoded_batches, (batch_index, slot, count), stop_event
+            ):
+                break
+            batch_index += 1
+
+        put_until_stopped(
+            prepared_batches,
+            (DONE_MESSAGE, batch_index, frames_read, skipped_frames),
+            stop_event,
+        )
+    except Exception as err:  # pylint: disable=broad-except
+        logger.error("Failed to decode %s", video_path, exc_info=err)
+        put_until_stopped(prepared_batches, (ERROR_MESSAGE, str(err)), stop_event)
+    finally:
+        capture.release()
+        ring.close()
+
+
+def __letterbox_slot(
+    ring: SharedBatchRing, letterbox: BatchLetterbox, slot: int, count: int
+) -> None:
+    """Letterboxes the frames of a slot into the images of the same slot."""
+    frames: List[np.ndarray[Any, Any]] = list(ring.frames[slot, :count])
+    letterbox(frames, out=ring.images[slot])
+
+
+def letterbox_worker(
+    spec: RingSpec,
+    params: LetterboxParams,
+    decoded_batches: Any,
+    prepared_batches: Any,
+    stop_event: Event,
+) -> None:
+    """Letterboxes decoded batches into the images of their slot."""
+    ring = SharedBatchRing(spec)
+    letterbox = BatchLetterbox(params, spec.batch_size)
+    try:
+        while not stop_event.is_set():
+            try:
+                message = decoded_batches.get(timeout=QUEUE_TIMEOUT)
+            except Empty:
+                continue
+            if message is STOP_MESSAGE:
+                break
+            batch_index, slot, count = message
+
+            # Unpacked in a function, so no views of the ring outlive it
+            __letterbox_slot(ring, letterbox, slot, count)
+            if not put_until_stopped(
+                prepared_batches, (batch_index, slot, count), stop_event
+            ):
+                break
+    finally:
+        ring.close()
@@ -0,0 +1,126 @@
+"""Bounded pool of recycled input tensors for the model."""
+from queue import Empty, Queue
+from threading import Lock
+from typing import Any, Dict, List, Set, Tuple
+
+import numpy as np
+import torch
+from torch import Tensor
+
+from app.detection.letterbox import PAD_VALUE
+
+
+class TensorPool:
+    """A bounded pool of preallocated batch tensors.
+
+    Every slot has a uint8 host tensor the letterboxed frames are written to, pinned
+    when CUDA is available, and a tensor on the model device in the model dtype.
+    A batch holds its slot from acquire until release, so the number of prepared
+    batches in memory never exceeds the pool size.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        shape: Tuple[int, int, int, int],
+        dtype: torch.dtype,
+        device: torch.device,
+    ) -> None:
+        """Allocates the tensors of the pool.
+
+        Args:
+            size: The number of slots.
+            shape: The (B, 3, H, W) shape of a batch.
+            dtype: The dtype of the model input.
+            device: The device of the model.
+        """
+        self.size = size
+        self.pinned = device.type == "cuda" and torch.cuda.is_available()
+
+        self.__host: List[Tensor] = []
+        self.__device: List[Tensor] = []
+        self.__slot_by_pointer: Dict[int, int] = {}
+        self.__free: Queue[int] = Queue()
+        self.__acquired: Set[int] = set()
+        self.__lock = Lock()
+
+        for slot in range(size):
+            host = torch.full(shape, PAD_VALUE, dtype=torch.uint8)
+            if self.pinned:
+                host = host.pin_memory()
+            device_tensor = torch.empty(shape, dtype=dtype, device=device)
+
+            self.__host.append(host)
+            self.__device.append(device_tensor)
+            self.__slot_by_pointer[device_tensor.untyped_storage().data_ptr()] = slot
+            self.__free.put(slot)
+
+    def acquire(self, timeout: float | None = None) -> int | None:
+        """Takes a free slot from the pool, waiting until one is released.
+
+        Args:
+            timeout: Max seconds to wait. Defaults to waiting forever.
+
+        Returns:
+            The slot, or None if no slot was released in time.
+        """
+        try:
+            slot = self.__free.get(timeout=timeout)
+        except Empty:
+            return None
+        with self.__lock:
+            self.__acquired.add(slot)
+        return slot
+
+    def host_array(self, slot: int) -> np.ndarray[Any, Any]:
+        """Returns the uint8 host buffer of a slot as a numpy array."""
+        array: np.ndarray[Any, Any] = self.__host[slot].numpy()
+        return array
+
+    def load(
+        self, slot: int, count: int, source: np.ndarray[Any, Any] | None = None
+    ) -> Tensor:
+        """Copies the first count images of the host buffer to the device tensor.
+
+        Args:
+            slot: The slot to load.
+            count: The number of images in the batch.
+            source: Load the images from this uint8 array instead of the host buffer.
+
+        Returns:
+            A view of the normalized device tensor holding the batch.
+        """
+        device_tensor = self.__device[slot][:count]
+        if source is None:
+            device_tensor.copy_(self.__host[slot][:count], non_blocking=self.pinned)
+        else:
+            device_tensor.copy_(torch.from_numpy(source[:count]))
+        device_tensor /= 255.0  # 0 - 255 to 0.0 - 1.0
+        return device_tensor
+
+    def release(self, tensor: Tensor) -> None:
+        """Returns the slot of a tensor returned by load to the pool.
+
+        Raises:
+            ValueError: If the tensor does not belong to the pool.
+        """
+        slot = self.__slot_by_pointer.get(tensor.untyped_storage().data_ptr())
+        if slot is None:
+            raise ValueError("Tensor does not belong to the pool")
+        self.release_slot(slot)
+
+    def release_slot(self, slot: int) -> None:
+        """Returns a slot to the pool.
+
+        Raises:
+            ValueError: If the slot is not acquired.
+        """
+        with self.__lock:
+            if slot not in self.__acquired:
+                raise ValueError(f"Slot {slot} is not acquired")
+            self.__acquired.remove(slot)
+        self.__free.put(slot)
+
+    def free_count(self) -> int:
+        """Returns the number of free slots."""
+        return self.__free.qsize()
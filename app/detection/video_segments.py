@@ -0,0 +1,192 @@
+"""Keyframe aligned segments of a video that can be decoded independently."""
+import math
+import time
+from bisect import bisect_right
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Generator, Iterator, List, Optional, Tuple
+
+import av
+import numpy as np
+
+
+@dataclass(frozen=True)
+class VideoIndex:
+    """The presentation timestamps of every frame in a video, found without decoding.
+
+    A frame's index is its rank among the timestamps, which is the position it is
+    returned at when the video is read sequentially.
+    """
+
+    frame_pts: List[int]
+    keyframes: List[int]
+
+    @property
+    def frame_count(self) -> int:
+        """The number of frames in the video."""
+        return len(self.frame_pts)
+
+    @classmethod
+    def from_video(cls, video_path: Path) -> Optional["VideoIndex"]:
+        """Demuxes the packets of the first video stream to index the frames.
+
+        Args:
+            video_path: The video to index.
+
+        Returns:
+            The index, or None if the frames can't be told apart by their timestamps.
+        """
+        pts: List[int] = []
+        keyframe_pts: List[int] = []
+        with av.open(str(video_path)) as container:
+            stream = container.streams.video[0]
+            for packet in container.demux(stream):
+                if packet.size == 0 or packet.is_discard:
+                    # Flush packets and frames cut by an edit list are never shown
+                    continue
+                if packet.pts is None:
+                    return None
+                pts.append(packet.pts)
+                if packet.is_keyframe:
+                    keyframe_pts.append(packet.pts)
+
+        pts.sort()
+        rank = {frame_pts: index for index, frame_pts in enumerate(pts)}
+        if len(rank) != len(pts) or not keyframe_pts:
+            return None
+        return cls(pts, sorted(rank[frame_pts] for frame_pts in keyframe_pts))
+
+
+@dataclass(frozen=True)
+class Segment:
+    """The frames [start, end) of a video."""
+
+    start: int
+    end: int
+
+
+def plan_segments(index: VideoIndex, batch_size: int) -> List[Segment]:
+    """Splits a video into segments that start at keyframes and at batch boundaries.
+
+    Every keyframe starts a segment at the first batch boundary after it, so a
+    decoder seeking to the keyframe before a segment never decodes more than
+    batch_size frames it does not return, and a batch never spans two segments.
+
+    Args:
+        index: The index of the video.
+        batch_size: The number of frames per batch.
+
+    Returns:
+        The segments in frame order.
+    """
+    boundaries = sorted(
+        {0, index.frame_count}
+        | {
+            math.ceil(keyframe / batch_size) * batch_size
+            for keyframe in index.keyframes
+            if keyframe < index.frame_count
+        }
+    )
+    boundaries = [boundary for boundary in boundaries if boundary <= index.frame_count]
+
+    return [Segment(start, end) for start, end in zip(boundaries, boundaries[1:])]
+
+
+class SegmentDecoder:
+    """Decodes segments of a video with its own PyAV container.
+
+    Only the requested frames are converted to images. When the next requested frame
+    is past the next keyframe, the decoder seeks to it instead of decoding the frames
+    in between. Not thread safe, every decoder thread should use its own.
+    """
+
+    def __init__(self, video_path: Path, index: VideoIndex) -> None:
+        self.container = av.open(str(video_path))
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        self.index = index
+        self.index_of_pts: Dict[int, int] = {
+            pts: index for index, pts in enumerate(index.frame_pts)
+        }
+        self.skipped_frames = 0
+        self.skip_seconds = 0.0
+        self.seeks = 0
+
+    def __enter__(self) -> "SegmentDecoder":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Closes the container."""
+        self.container.close()
+
+    def keyframe_before(self, frame_index: int) -> Optional[int]:
+        """Returns the last keyframe at or before a frame, or None if there is none."""
+        position = bisect_right(self.index.keyframes, frame_index)
+        return self.index.keyframes[position - 1] if position > 0 else None
+
+    def __seek(self, frame_index: int) -> None:
+        """Seeks to the last keyframe at or before a frame."""
+        keyframe = self.keyframe_before(frame_index)
+        if keyframe is None:
+            self.container.seek(0)
+        else:
+            self.container.seek(
+                self.index.frame_pts[keyframe],
+                stream=self.stream,
+                backward=True,
+                any_frame=False,
+            )
+        self.seeks += 1
+
+    def decode(
+        self, segment: Segment, stride: int = 1
+    ) -> Iterator[Tuple[int, np.ndarray[Any, Any]]]:
+        """Decodes the frames of a segment.
+
+        Args:
+            segment: The segment to decode.
+            stride: Only return the frames with an index divisible by stride.
+
+        Yields:
+            The index and the BGR image of every requested frame in the segment, in order.
+        """
+        wanted = math.ceil(segment.start / stride) * stride
+        while wanted < segment.end:
+            self.__seek(wanted)
+            wanted = yield from self.__decode_until_seek(wanted, segment.end, stride)
+
+    def __decode_until_seek(
+        self, wanted: int, end: int, stride: int
+    ) -> Generator[Tuple[int, np.ndarray[Any, Any]], None, int]:
+        """Decodes from the current position until the end of the segment, or until
+        it is cheaper to seek to the next requested frame.
+
+        Returns:
+            The next requested frame, end or more if the segment is done.
+        """
+        started = time.perf_counter()
+        for frame in self.container.decode(self.stream):
+            frame_index = (
+                None if frame.pts is None else self.index_of_pts.get(frame.pts)
+            )
+            if frame_index is None or frame_index < wanted:
+                self.skipped_frames += 1
+                self.skip_seconds += time.perf_counter() - started
+                started = time.perf_counter()
+                continue
+            if frame_index >= end:
+                return end
+            if frame_index % stride == 0:
+                yield frame_index, frame.to_ndarray(format="bgr24")
+            else:
+                self.skipped_frames += 1
+
+            wanted = (frame_index // stride + 1) * stride
+            keyframe = self.keyframe_before(wanted)
+            if wanted < end and keyframe is not None and keyframe > frame_index + 1:
+                return wanted
+            started = time.perf_counter()
+        return end
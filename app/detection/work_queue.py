@@ -0,0 +1,202 @@
+"""A queue of videos in a SQLite file, shared by workers on several machines.
+
+A coordinator adds the videos of a folder, and workers claim them one at a time with
+a lease. A worker renews its leases while it processes the videos, so the lease of a
+worker that crashed runs out and the video is claimed again by another worker.
+"""
+import json
+import sqlite3
+import time
+from pathlib import Path
+from types import TracebackType
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+
+from app.logger import get_logger
+
+logger = get_logger()
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS video (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    state TEXT NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result TEXT
+)
+"""
+
+
+class WorkQueue:
+    """The videos to process and who is processing them.
+
+    The paths are relative to the folder the videos were added from, so workers can
+    mount the shared storage anywhere. Every change is its own transaction, and
+    claims take the write lock first so two workers never claim the same video. The
+    default rollback journal is kept, as WAL does not work on network file systems.
+    """
+
+    def __init__(
+        self, path: Path, lease_seconds: float = 600.0, max_attempts: int = 3
+    ) -> None:
+        """
+        Args:
+            path: The SQLite file, created if it does not exist.
+            lease_seconds: How long a claim lasts without being renewed.
+            max_attempts: How many times a video is claimed before it has failed.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Autocommit, every statement is a transaction unless one is begun
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute(QUEUE_SCHEMA)
+
+    def __enter__(self) -> "WorkQueue":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Type[BaseException] | None,  # pylint: disable=unused-argument
+        exc_value: BaseException | None,  # pylint: disable=unused-argument
+        trace_back: TracebackType | None,  # pylint: disable=unused-argument
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the connection to the queue."""
+        self.connection.close()
+
+    def add(self, videos: Iterable[str]) -> int:
+        """Add videos to the queue, the ones already in it are left as they are.
+
+        Returns:
+            The number of videos added.
+        """
+        # One transaction, instead of one per video
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = self.connection.executemany(
+                "INSERT OR IGNORE INTO video (path, state) VALUES (?, ?)",
+                [(video, PENDING) for video in videos],
+            )
+            self.connection.execute("COMMIT")
+        except sqlite3.Error:
+            self.connection.execute("ROLLBACK")
+            raise
+        return cursor.rowcount
+
+    def claim(self, worker: str) -> Optional[Tuple[int, str]]:
+        """Lease the next pending video, or one whose lease ran out.
+
+        Args:
+            worker: The name of the worker, unique across all machines.
+
+        Returns:
+            The id and the path of the video, or None if there is nothing left to do.
+        """
+        now = time.time()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Leases that ran out too many times will not be finished
+            self.connection.execute(
+                "UPDATE video SET state = ?, error = ? "
+                + "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, "Lease expired", LEASED, now, self.max_attempts),
+            )
+            row = self.connection.execute(
+                "SELECT id, path FROM video "
+                + "WHERE state = ? OR (state = ? AND lease_expires < ?) "
+                + "ORDER BY id LIMIT 1",
+                (PENDING, LEASED, now),
+            ).fetchone()
+            if row is not None:
+                self.connection.execute(
+                    "UPDATE video SET state = ?, worker = ?, lease_expires = ?, "
+                    + "attempts = attempts + 1 WHERE id = ?",
+                    (LEASED, worker, now + self.lease_seconds, row[0]),
+                )
+            self.connection.execute("COMMIT")
+        except sqlite3.Error:
+            self.connection.execute("ROLLBACK")
+            raise
+
+        if row is None:
+            return None
+        logger.debug("%s claimed %s", worker, row[1])
+        return int(row[0]), str(row[1])
+
+    def renew(self, worker: str) -> int:
+        """Extend the leases of a worker.
+
+        Returns:
+            The number of leases the worker still holds.
+        """
+        cursor = self.connection.execute(
+            "UPDATE video SET lease_expires = ? WHERE worker = ? AND state = ?",
+            (time.time() + self.lease_seconds, worker, LEASED),
+        )
+        return cursor.rowcount
+
+    def complete(self, video: str, worker: str, result: Dict[str, object]) -> bool:
+        """Mark a video as done and store the result of processing it.
+
+        Returns:
+            False if the worker no longer held the lease, the video was then given to
+            another worker and is not marked as done.
+        """
+        cursor = self.connection.execute(
+            "UPDATE video SET state = ?, result = ?, error = NULL "
+            + "WHERE path = ? AND worker = ? AND state = ?",
+            (DONE, json.dumps(result), video, worker, LEASED),
+        )
+        if cursor.rowcount == 0:
+            logger.warning("%s lost the lease of %s", worker, video)
+        return cursor.rowcount > 0
+
+    def release(self, worker: str, error: str | None = None) -> None:
+        """Give back the leases of a worker that stopped.
+
+        Args:
+            worker: The name of the worker.
+            error: Why the worker stopped. The claims count as attempts only if set,
+                   and the videos that used up their attempts have failed.
+        """
+        if error is None:
+            self.connection.execute(
+                "UPDATE video SET state = ?, worker = NULL, "
+                + "attempts = attempts - 1 WHERE worker = ? AND state = ?",
+                (PENDING, worker, LEASED),
+            )
+        else:
+            self.connection.execute(
+                "UPDATE video SET state = CASE WHEN attempts >= ? "
+                + "THEN ? ELSE ? END, worker = NULL, error = ? "
+                + "WHERE worker = ? AND state = ?",
+                (self.max_attempts, FAILED, PENDING, error, worker, LEASED),
+            )
+
+    def counts(self) -> Dict[str, int]:
+        """The number of videos in every state."""
+        counts = {state: 0 for state in (PENDING, LEASED, DONE, FAILED)}
+        for state, count in self.connection.execute(
+            "SELECT state, COUNT(*) FROM video GROUP BY state"
+        ):
+            counts[state] = count
+        return counts
+
+    def results(self) -> List[Tuple[str, Dict[str, object]]]:
+        """The paths and the results of the videos that are done."""
+        return [
+            (path, json.loads(result))
+            for path, result in self.connection.execute(
+                "SELECT path, result FROM video WHERE state = ? ORDER BY id", (DONE,)
+            )
+        ]
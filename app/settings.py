@@ -28,18 +28,54 @@ report_format: str = "CSV"
 
 batch_size: int = 8
 
+autotune: bool = False  # Tune the batch size and threads instead, per host and model
+
 prediction_threshold: int = 50
 
 box_around_fish: bool = False
 
 video_crf: int = 23
 
+stream_copy_cut: bool = False
+
+video_encoders: int = 1
+
+pipeline_cuts: int = 1  # Videos cut while the next is detected, 0 cuts in turn
+
+streaming_cut: bool = False
+
 max_detections: int = 100
 
+detection_cache_mb: int = 1024  # 0 turns the detection cache off
+
+pipeline_metrics: bool = False  # Write the time of every stage to <video>_metrics.json
+
+pipeline_trace: bool = False  # And a timeline to <video>_trace.json, with the metrics
+
 frame_buffer_seconds: int = 1
 
 weights: str = "v8s-640-classes-augmented-backgrounds.pt"
 
+frame_grabber_backend: str = "thread"
+
+inference_backend: str = "torch"
+
+inference_threads: int = 0  # Threads of the onnx backend, 0 lets it choose
+
+video_decoders: int = 1
+
+frame_stride: int = 1
+
+adaptive_stride: bool = False
+
+motion_gate: bool = False
+
+motion_gate_threshold: int = 15
+
+motion_gate_min_area: float = 0.1  # Percentage of the frame
+
+motion_gate_max_gap_seconds: int = 2
+
 # endregion
 
 # ----------------------------------------------------------------------------- #
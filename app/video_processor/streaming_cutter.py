@@ -0,0 +1,212 @@
+"""Cuts a video from the frames decoded for detection, while the detection runs."""
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, List, Tuple
+
+import av
+import numpy as np
+
+from app.logger import get_logger
+from app.video_processor import Detection
+from app.video_processor.video_processor import Annotator, add_x264_stream
+
+logger = get_logger()
+
+
+class StreamingCutter:  # pylint: disable=too-many-instance-attributes
+    """
+    Encodes the frames with fish, and the frames around them, as they are detected.
+
+    The frames must be added in order, every frame of the video. The same frames are
+    written as when cutting the ranges from detected_frames_to_ranges with the buffer
+    before and after added. Frames that may still end up in a range are kept until
+    the next frame with fish decides it, so at most max(frame_buffer, buffer_before)
+    frames are held in memory. A range is done once frame_buffer and buffer_after
+    frames have passed without fish.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        output_path: Path,
+        fps: float,
+        frame_buffer: int,
+        buffer_before: int = 0,
+        buffer_after: int = 0,
+        crf: int = 23,
+        pix_fmt: str = "yuv420p",
+        annotate: bool = False,
+    ) -> None:
+        """
+        Args:
+            output_path (Path): The path to the cut video, only created once a frame
+                is written.
+            fps (float): The frame rate of the video.
+            frame_buffer (int): The number of frames without fish allowed within a range.
+            buffer_before (int): The number of frames to add before every range.
+            buffer_after (int): The number of frames to add after every range.
+            crf (int): The constant rate factor of the encoder.
+            pix_fmt (str): The pixel format of the encoded frames.
+            annotate (bool): Draw the detections on the frames.
+        """
+        self.output_path = output_path
+        self.fps = fps
+        self.frame_buffer = frame_buffer
+        self.buffer_before = buffer_before
+        self.buffer_after = buffer_after
+        self.crf = crf
+        self.pix_fmt = pix_fmt
+        self.annotate = annotate
+
+        self.frame_ranges: List[Tuple[int, int]] = []
+        self.last_fish: int | None = None
+        self.last_written = -1
+        self.pending: Deque[Tuple[int, np.ndarray[Any, Any], List[Detection]]] = deque()
+
+        self.output_container: Any = None
+        self.output_stream: Any = None
+        self.annotator: Annotator | None = None
+
+    def __enter__(self) -> "StreamingCutter":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    @classmethod
+    def for_video(  # pylint: disable=too-many-arguments
+        cls,
+        video_path: Path,
+        output_path: Path,
+        frame_buffer: int,
+        buffer_before: int = 0,
+        buffer_after: int = 0,
+        crf: int = 23,
+        annotate: bool = False,
+    ) -> "StreamingCutter":
+        """Creates a cutter with the frame rate and pixel format of a video."""
+        with av.open(str(video_path)) as container:
+            video_stream = container.streams.video[0]
+            rate = video_stream.average_rate
+            fps = float(rate) if rate is not None else 25.0
+            pix_fmt = video_stream.codec_context.pix_fmt or "yuv420p"
+        return cls(
+            output_path,
+            fps,
+            frame_buffer,
+            buffer_before,
+            buffer_after,
+            crf,
+            pix_fmt,
+            annotate,
+        )
+
+    def add_frame(
+        self,
+        frame_index: int,
+        frame: np.ndarray[Any, Any],
+        detections: List[Detection],
+    ) -> None:
+        """
+        Adds the next frame of the video.
+
+        Args:
+            frame_index (int): The index of the frame in the video.
+            frame (np.ndarray): The BGR frame, copied if it is kept.
+            detections (List[Detection]): The detections in the frame.
+        """
+        if len(detections) > 0:
+            self.__add_fish_frame(frame_index, frame, detections)
+        elif self.last_fish is not None and (
+            frame_index <= self.last_fish + self.buffer_after
+        ):
+            self.__write(frame_index, frame, detections)
+        else:
+            self.pending.append((frame_index, frame.copy(), detections))
+            self.__drop_pending(frame_index + 1)
+
+    def __add_fish_frame(
+        self,
+        frame_index: int,
+        frame: np.ndarray[Any, Any],
+        detections: List[Detection],
+    ) -> None:
+        """Writes a frame with fish and the kept frames that are part of its range."""
+        if self.last_fish is not None and frame_index <= (
+            self.last_fish + self.frame_buffer
+        ):
+            # Still in the same range, including the frames without fish in between
+            start = self.frame_ranges[-1][0]
+        else:
+            start = max(0, frame_index - self.buffer_before)
+            if self.frame_ranges and start <= self.frame_ranges[-1][1]:
+                # The buffers of the ranges overlap
+                start = self.frame_ranges[-1][0]
+            else:
+                self.frame_ranges.append((start, frame_index))
+            self.__drop_pending(start)
+
+        while self.pending:
+            self.__write(*self.pending.popleft())
+        self.__write(frame_index, frame, detections)
+        self.frame_ranges[-1] = (start, frame_index)
+        self.last_fish = frame_index
+
+    def __drop_pending(self, next_frame: int) -> None:
+        """Drops the kept frames that can't be part of a range any more."""
+        if self.last_fish is not None and next_frame <= (
+            self.last_fish + self.frame_buffer
+        ):
+            # The next frame with fish may extend the range over all of them
+            return
+        while self.pending and self.pending[0][0] < next_frame - self.buffer_before:
+            self.pending.popleft()
+
+    def __write(
+        self,
+        frame_index: int,
+        frame: np.ndarray[Any, Any],
+        detections: List[Detection],
+    ) -> None:
+        """Encodes a frame of a range."""
+        if frame_index <= self.last_written:
+            return
+        if self.output_container is None:
+            self.__open(frame.shape[1], frame.shape[0])
+        assert self.output_container is not None
+
+        if self.annotate and self.annotator is not None:
+            frame = self.annotator.annotate(frame, detections)
+        output_frame = av.VideoFrame.from_ndarray(frame, format="bgr24")
+        for packet in self.output_stream.encode(output_frame):
+            self.output_container.mux(packet)
+
+        self.last_written = frame_index
+        start, end = self.frame_ranges[-1]
+        self.frame_ranges[-1] = (start, max(end, frame_index))
+
+    def __open(self, width: int, height: int) -> None:
+        """Opens the output once the first frame is written."""
+        self.output_container = av.open(str(self.output_path), mode="w")
+        self.output_stream = add_x264_stream(
+            self.output_container, self.fps, width, height, self.pix_fmt, self.crf
+        )
+        if self.annotate:
+            self.annotator = Annotator((width, height))
+
+    def close(self) -> List[Tuple[int, int]]:
+        """
+        Finishes the cut video.
+
+        Returns:
+            List[Tuple[int, int]]: The (start, end) frame ranges that were written.
+        """
+        self.pending.clear()
+        if self.output_container is not None:
+            for packet in self.output_stream.encode(None):
+                self.output_container.mux(packet)
+            self.output_container.close()
+            self.output_container = None
+            logger.info(
+                "Wrote %d frame ranges to %s", len(self.frame_ranges), self.output_path
+            )
+        return self.frame_ranges
@@ -1,12 +1,19 @@
 """Video processor module. Contains functions for processing videos."""
+import multiprocessing as mp
+import queue
+import tempfile
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
 from fractions import Fraction
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Tuple
 
 import av
 import av.datasets
 import av.packet
 import av.video
+import av.video.frame
+import cv2
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 from PIL import __version__ as pil_version
@@ -14,6 +21,7 @@ from tqdm import tqdm
 from ultralytics.utils.checks import check_font, check_version
 
 from app import settings
+from app.detection.video_segments import VideoIndex
 from app.logger import get_logger
 from app.video_processor import Detection
 
@@ -25,12 +33,17 @@ def color_to_hex(color: Tuple[int, int, int]) -> str:
     return f"0x{color[0]:02x}{color[1]:02x}{color[2]:02x}"
 
 
-class Annotator:  # pylint: disable=too-few-public-methods
+class Annotator:
     """
     A more performant and specialized version of the
     Annotator class from ultralytics.utils.plotting
+
+    Draws straight into the frame with OpenCV. Every label is rendered with PIL once,
+    and copied into the frames it is drawn on after that.
     """
 
+    max_cached_labels = 4096
+
     def __init__(
         self,
         frame_size: Tuple[int, int],
@@ -48,6 +61,182 @@ class Annotator:  # pylint: disable=too-few-public-methods
         self.color = color
         self.pil_9_2_0_check = check_version(pil_version, "9.2.0")  # deprecation check
         self.text_color = (255, 255, 255)
+        self.labels: Dict[Tuple[str, Tuple[int, int, int]], np.ndarray[Any, Any]] = {}
+        self.yuv_labels: Dict[
+            Tuple[str, Tuple[int, int, int]],
+            Tuple[np.ndarray[Any, Any], np.ndarray[Any, Any], np.ndarray[Any, Any]],
+        ] = {}
+
+    def label_image(
+        self, label: str, color: Tuple[int, int, int]
+    ) -> np.ndarray[Any, Any]:
+        """
+        Returns the image of a label, text on a filled box, rendered once per label.
+
+        Args:
+            label: The text of the label.
+            color: The color of the box, in the channel order of the frames.
+
+        Returns:
+            The label image, in the channel order of the frames.
+        """
+        key = (label, color)
+        image = self.labels.get(key)
+        if image is not None:
+            return image
+
+        if self.pil_9_2_0_check:
+            _, _, width, height = self.font.getbbox(label)  # text width, height (New)
+        else:
+            width, height = self.font.getsize(
+                label
+            )  # text width, height (Old, deprecated in 9.2.0)
+        label_image = Image.new("RGB", (int(width) + 2, int(height) + 2), color)
+        ImageDraw.Draw(label_image).text(
+            (0, 0), label, fill=self.text_color, font=self.font
+        )
+        image = np.asarray(label_image)
+
+        if len(self.labels) >= self.max_cached_labels:
+            self.labels.clear()
+        self.labels[key] = image
+        return image
+
+    def yuv_label_planes(
+        self, label: str, color: Tuple[int, int, int]
+    ) -> Tuple[np.ndarray[Any, Any], np.ndarray[Any, Any], np.ndarray[Any, Any]]:
+        """Returns the Y, U and V planes of a label image, converted once per label."""
+        key = (label, color)
+        planes = self.yuv_labels.get(key)
+        if planes is not None:
+            return planes
+
+        image = self.label_image(label, color)
+        # I420 needs even sizes
+        image = np.pad(
+            image,
+            ((0, image.shape[0] % 2), (0, image.shape[1] % 2), (0, 0)),
+            mode="edge",
+        )
+        planes = split_yuv420p(cv2.cvtColor(image, cv2.COLOR_BGR2YUV_I420))
+
+        if len(self.yuv_labels) >= self.max_cached_labels:
+            self.yuv_labels.clear()
+        self.yuv_labels[key] = planes
+        return planes
+
+    def __box_lines(
+        self, box: Tuple[int, int, int, int]
+    ) -> List[Tuple[int, int, int, int]]:
+        """Returns the (top, bottom, left, right) bounds of the lines of a box.
+
+        The lines are drawn inside the box, like PIL does.
+        """
+        xmin, ymin, xmax, ymax = box
+        xmin, ymin = max(0, xmin), max(0, ymin)
+        xmax, ymax = max(xmin, xmax) + 1, max(ymin, ymax) + 1
+        line = self.line_width
+        return [
+            (ymin, ymin + line, xmin, xmax),
+            (max(ymin, ymax - line), ymax, xmin, xmax),
+            (ymin, ymax, xmin, xmin + line),
+            (ymin, ymax, max(xmin, xmax - line), xmax),
+        ]
+
+    @staticmethod
+    def __label_origin(
+        box: Tuple[int, int, int, int], label_height: int
+    ) -> Tuple[int, int]:
+        """Returns the top left corner of the label of a box."""
+        xmin, ymin = max(0, box[0]), max(0, box[1])
+        # Above the box if the label fits outside, the text is 2 pixels lower
+        top = ymin - label_height + 2 if ymin - label_height + 2 >= 0 else ymin
+        return top, xmin
+
+    @staticmethod
+    def __fill(
+        plane: np.ndarray[Any, Any],
+        lines: List[Tuple[int, int, int, int]],
+        value: Any,
+        scale: int = 1,
+    ) -> None:
+        """Fills the lines of a box in a plane with a resolution of 1/scale."""
+        for top, bottom, left, right in lines:
+            plane[
+                top // scale : -(-bottom // scale), left // scale : -(-right // scale)
+            ] = value
+
+    @staticmethod
+    def __blit(
+        plane: np.ndarray[Any, Any], image: np.ndarray[Any, Any], top: int, left: int
+    ) -> None:
+        """Copies an image into a plane, clipped at the edges of the plane."""
+        height, width = image.shape[:2]
+        plane_height, plane_width = plane.shape[:2]
+        y_start, x_start = max(0, top), max(0, left)
+        y_end, x_end = min(plane_height, top + height), min(plane_width, left + width)
+        if y_end > y_start and x_end > x_start:
+            plane[y_start:y_end, x_start:x_end] = image[
+                y_start - top : y_end - top, x_start - left : x_end - left
+            ]
+
+    def draw(
+        self,
+        frame: np.ndarray[Any, Any],
+        box: Tuple[int, int, int, int],
+        label: str,
+        color: Tuple[int, int, int] | None = None,
+    ) -> None:
+        """
+        Draws a box and its label into a frame, in place.
+
+        Args:
+            frame: The frame to draw on.
+            box: The (xmin, ymin, xmax, ymax) corners of the box.
+            label: The text of the label.
+            color: The color of the box, defaults to the color of the annotator.
+        """
+        color = color or self.color
+        self.__fill(frame, self.__box_lines(box), color)
+
+        label_image = self.label_image(label, color)
+        top, left = self.__label_origin(box, label_image.shape[0])
+        self.__blit(frame, label_image, top, left)
+
+    def draw_yuv420p(
+        self,
+        planes: Tuple[np.ndarray[Any, Any], np.ndarray[Any, Any], np.ndarray[Any, Any]],
+        box: Tuple[int, int, int, int],
+        label: str,
+        color: Tuple[int, int, int] | None = None,
+    ) -> None:
+        """
+        Draws a box and its label into the Y, U and V planes of a yuv420p frame, in place.
+
+        The label is moved to even coordinates, so its colors line up in the
+        subsampled U and V planes.
+
+        Args:
+            planes: The Y, U and V planes of the frame, see split_yuv420p.
+            box: The (xmin, ymin, xmax, ymax) corners of the box.
+            label: The text of the label.
+            color: The color of the box, in BGR, defaults to the color of the annotator.
+        """
+        color = color or self.color
+        luma, chroma_u, chroma_v = planes
+        label_y, label_u, label_v = self.yuv_label_planes(label, color)
+
+        # The top left pixel of the label is the color of its box
+        lines = self.__box_lines(box)
+        self.__fill(luma, lines, label_y[0, 0])
+        self.__fill(chroma_u, lines, label_u[0, 0], scale=2)
+        self.__fill(chroma_v, lines, label_v[0, 0], scale=2)
+
+        top, left = self.__label_origin(box, self.label_image(label, color).shape[0])
+        top, left = top - top % 2, left - left % 2
+        self.__blit(luma, label_y, top, left)
+        self.__blit(chroma_u, label_u, top // 2, left // 2)
+        self.__blit(chroma_v, label_v, top // 2, left // 2)
 
     def annotate(
         self, frame: np.ndarray[Any, Any], detections: List[Detection]
@@ -56,50 +245,110 @@ class Annotator:  # pylint: disable=too-few-public-methods
         Draws bounding boxes and labels on a frame for the specified detections.
 
         Args:
-            frame: The frame to draw on.
+            frame: The frame to draw on, it is drawn on in place.
             detections: A list of detections to draw.
 
         Returns:
             The frame with bounding boxes and labels drawn on it.
         """
-        image = frame if isinstance(frame, Image.Image) else Image.fromarray(frame)
-        draw = ImageDraw.Draw(image)
         for detection in detections:
-            label = f"{detection.confidence:.2f} {detection.label}"
-
             box = (
                 int(detection.xmin),
                 int(detection.ymin),
                 int(detection.xmax),
                 int(detection.ymax),
             )
+            self.draw(frame, box, f"{detection.confidence:.2f} {detection.label}")
+        return frame
 
-            draw.rectangle(box, width=self.line_width, outline=self.color)  # box
-            if self.pil_9_2_0_check:
-                _, _, width, height = self.font.getbbox(
-                    label
-                )  # text width, height (New)
-            else:
-                width, height = self.font.getsize(
-                    label
-                )  # text width, height (Old, deprecated in 9.2.0)
-            outside = box[1] - height >= 0  # label fits outside box
-            draw.rectangle(
-                (
-                    box[0],
-                    box[1] - height if outside else box[1],
-                    box[0] + width + 1,
-                    box[1] + 1 if outside else box[1] + height + 1,
-                ),
-                fill=self.color,
+    def annotate_yuv420p(
+        self, image: np.ndarray[Any, Any], detections: List[Detection]
+    ) -> np.ndarray[Any, Any]:
+        """
+        Draws bounding boxes and labels on a yuv420p frame, without converting it to BGR.
+
+        Args:
+            image: The frame as returned by VideoFrame.to_ndarray(), drawn on in place.
+            detections: A list of detections to draw.
+
+        Returns:
+            The frame with bounding boxes and labels drawn on it.
+        """
+        planes = split_yuv420p(image)
+        for detection in detections:
+            box = (
+                int(detection.xmin),
+                int(detection.ymin),
+                int(detection.xmax),
+                int(detection.ymax),
             )
-            draw.text(
-                (box[0], box[1] - height if outside else box[1]),
-                label,
-                fill=self.text_color,
-                font=self.font,
+            self.draw_yuv420p(
+                planes, box, f"{detection.confidence:.2f} {detection.label}"
             )
-        return np.asarray(image)
+        return image
+
+
+def split_yuv420p(
+    image: np.ndarray[Any, Any]
+) -> Tuple[np.ndarray[Any, Any], np.ndarray[Any, Any], np.ndarray[Any, Any]]:
+    """
+    Split a contiguous I420 image of shape (height * 3 / 2, width) into views of its
+    Y, U and V planes.
+
+    Args:
+        image: The I420 image, with an even height and width.
+
+    Returns:
+        The Y plane and the U and V planes at half the resolution.
+    """
+    height, width = image.shape[0] * 2 // 3, image.shape[1]
+    flat = image.reshape(-1)
+    luma_size, chroma_size = height * width, height * width // 4
+    return (
+        flat[:luma_size].reshape(height, width),
+        flat[luma_size : luma_size + chroma_size].reshape(height // 2, width // 2),
+        flat[luma_size + chroma_size :].reshape(height // 2, width // 2),
+    )
+
+
+def prepare_output_frame(
+    frame: av.VideoFrame,
+    detections: List[Detection] | None,
+    annotator: Annotator,
+    output_stream: av.video.stream,
+) -> av.VideoFrame:
+    """
+    Prepare a decoded frame for the encoder, annotated with its detections.
+
+    Frames without detections are passed on in their own pixel format. yuv420p frames
+    are annotated on their planes, other formats are annotated in BGR.
+
+    Args:
+        frame (av.VideoFrame): The decoded frame.
+        detections (List[Detection] | None): The detections to draw, if any.
+        annotator (Annotator): The annotator to draw with.
+        output_stream (av.video.stream): The stream the frame is encoded to.
+
+    Returns:
+        av.VideoFrame: The frame to encode.
+    """
+    if not detections:
+        # Let the encoder number the frame and pick its type, like a new frame
+        frame.pts = None
+        frame.time_base = 1 / output_stream.codec_context.framerate
+        frame.pict_type = av.video.frame.PictureType.NONE
+        return frame
+
+    if (
+        frame.format.name in ("yuv420p", "yuvj420p")
+        and frame.width % 2 == 0
+        and frame.height % 2 == 0
+    ):
+        image = annotator.annotate_yuv420p(frame.to_ndarray(), detections)
+        return av.VideoFrame.from_ndarray(image, format=frame.format.name)
+
+    image = annotator.annotate(frame.to_ndarray(format="bgr24"), detections)
+    return av.VideoFrame.from_ndarray(image, format="bgr24")
 
 
 # Thanks to https://github.com/PyAV-Org/PyAV/blob/main/tests/test_seek.py
@@ -152,7 +401,7 @@ def process_packet(  # pylint: disable=too-many-arguments
     video_stream: av.video.stream,
     output_container: av.container.output,
     output_stream: av.video.stream,
-    predictions: Dict[int, List[Detection]] | None,
+    predictions: Mapping[int, List[Detection]] | None,
     annotator: Annotator,
     pbar: tqdm,
     notify_progress: Callable[[int], None] | None = None,
@@ -169,7 +418,7 @@ def process_packet(  # pylint: disable=too-many-arguments
         video_stream (av.video.stream): The input video stream.
         output_container (av.container.output): The output container.
         output_stream (av.video.stream): The output video stream.
-        predictions (Dict[int, List[Detection]] | None): Optional detections for each frame.
+        predictions (Mapping[int, List[Detection]] | None): Optional detections for each frame.
         pbar (tqdm): A progress bar to update.
 
     Returns:
@@ -189,13 +438,12 @@ def process_packet(  # pylint: disable=too-many-arguments
             return current_frame, False
 
         if current_frame >= start:
-            frame_image = frame.to_ndarray(format="bgr24")
-
-            if predictions is not None:
-                frame_detections = predictions.get(current_frame, [])
-                frame_image = annotator.annotate(frame_image, frame_detections)
-
-            output_frame = av.VideoFrame.from_ndarray(frame_image, format="bgr24")
+            output_frame = prepare_output_frame(
+                frame,
+                None if predictions is None else predictions.get(current_frame),
+                annotator,
+                output_stream,
+            )
 
             packet = output_stream.encode(output_frame)
             if packet is not None:
@@ -216,7 +464,7 @@ def process_frame_ranges(  # pylint: disable=too-many-arguments
     video_stream: av.video.stream,
     output_container: av.container.output,
     output_stream: av.video.stream,
-    predictions: Dict[int, List[Detection]] | None,
+    predictions: Mapping[int, List[Detection]] | None,
     annotator: Annotator,
     notify_progress: Callable[[int], None] | None = None,
 ) -> None:
@@ -230,7 +478,7 @@ def process_frame_ranges(  # pylint: disable=too-many-arguments
         video_stream (av.video.stream): The input video stream.
         output_container (av.container.output): The output container.
         output_stream (av.video.stream): The output video stream.
-        predictions (Dict[int, List[Detection]] | None): Optional detections for each frame.
+        predictions (Mapping[int, List[Detection]] | None): Optional detections for each frame.
     """
     with tqdm(
         total=sum(end - start + 1 for start, end in frame_ranges),
@@ -263,31 +511,280 @@ def process_frame_ranges(  # pylint: disable=too-many-arguments
                     break
 
 
-def cut_video(
+def snap_to_keyframes(
+    frame_ranges: List[Tuple[int, int]], index: VideoIndex
+) -> List[Tuple[int, int]]:
+    """
+    Widen frame ranges to whole GOPs, so they can be copied without re-encoding.
+
+    Every range starts at the last keyframe at or before its start and ends at the
+    frame before the first keyframe after its end. Ranges that overlap after
+    widening are merged.
+
+    Args:
+        frame_ranges (List[Tuple[int, int]]): A list of (start, end) frame ranges.
+        index (VideoIndex): The index of the video.
+
+    Returns:
+        List[Tuple[int, int]]: The widened (start, end) frame ranges, in order.
+    """
+    snapped: List[Tuple[int, int]] = []
+    for start, end in sorted(frame_ranges):
+        start = max(0, min(start, index.frame_count - 1))
+        end = max(start, min(end, index.frame_count - 1))
+        before = bisect_right(index.keyframes, start) - 1
+        after = bisect_right(index.keyframes, end)
+        gop_start = index.keyframes[before] if before >= 0 else 0
+        gop_end = (
+            index.keyframes[after] - 1
+            if after < len(index.keyframes)
+            else index.frame_count - 1
+        )
+        if snapped and gop_start <= snapped[-1][1] + 1:
+            snapped[-1] = (snapped[-1][0], max(snapped[-1][1], gop_end))
+        else:
+            snapped.append((gop_start, gop_end))
+    return snapped
+
+
+def frame_duration_of(video_stream: av.video.stream) -> int:
+    """Returns the duration of a frame in the time base of a video stream."""
+    return int(max(1, round(1 / (video_stream.average_rate * video_stream.time_base))))
+
+
+def mux_shifted(
+    packets: Iterable[Any],
+    next_dts: int,
+    frame_duration: int,
+    output_container: av.container.output,
+    output_stream: av.video.stream,
+) -> int:
+    """
+    Mux compressed packets with their timestamps shifted to start at next_dts.
+
+    Args:
+        packets (Iterable[av.packet.Packet]): The packets, in decoding order.
+        next_dts (int): The decoding timestamp of the first packet in the output.
+        frame_duration (int): The duration of a frame in the time base of the packets.
+        output_container (av.container.output): The output container.
+        output_stream (av.video.stream): The output video stream.
+
+    Returns:
+        int: The decoding timestamp of a packet following the muxed packets.
+    """
+    shift = None
+    last_dts = next_dts - frame_duration
+    for packet in packets:
+        if packet.pts is None:
+            continue
+        dts = packet.pts if packet.dts is None else packet.dts
+        if shift is None:
+            shift = next_dts - dts
+        packet.pts += shift
+        packet.dts = dts + shift
+        last_dts = max(last_dts, packet.dts)
+        packet.stream = output_stream
+        output_container.mux(packet)
+    return last_dts + frame_duration
+
+
+def __packets_in_range(
+    input_container: av.container.input,
+    video_stream: av.video.stream,
+    index: VideoIndex,
+    start: int,
+    end: int,
+) -> Iterator[Any]:
+    """Yields the packets of the keyframe aligned frames [start, end]."""
+    input_container.seek(
+        index.frame_pts[start],
+        any_frame=False,
+        backward=True,
+        stream=video_stream,
+    )
+    for packet in input_container.demux(video_stream):
+        if packet.size == 0 or packet.is_discard or packet.pts is None:
+            continue
+        position = bisect_left(index.frame_pts, packet.pts)
+        if packet.is_keyframe and position > end:
+            break
+        if start <= position <= end:
+            # Leading frames of an open GOP refer to the one before it, and are left out
+            yield packet
+
+
+def remux_frame_ranges(  # pylint: disable=too-many-arguments
+    frame_ranges: List[Tuple[int, int]],
+    index: VideoIndex,
+    input_container: av.container.input,
+    video_stream: av.video.stream,
+    output_container: av.container.output,
+    output_stream: av.video.stream,
+    notify_progress: Callable[[int], None] | None = None,
+) -> None:
+    """
+    Copy the packets of keyframe aligned frame ranges to the output without decoding.
+
+    The timestamps are shifted so the ranges follow each other in the output.
+
+    Args:
+        frame_ranges (List[Tuple[int, int]]): Ranges that start at keyframes and end
+            right before a keyframe or at the end of the video.
+        index (VideoIndex): The index of the video.
+        input_container (av.container.input): The input container.
+        video_stream (av.video.stream): The input video stream.
+        output_container (av.container.output): The output container.
+        output_stream (av.video.stream): The output video stream, copied from the input.
+    """
+    frame_duration = frame_duration_of(video_stream)
+    next_dts = 0
+    with tqdm(
+        total=sum(end - start + 1 for start, end in frame_ranges),
+        desc="Copying frames",
+    ) as pbar:
+
+        def counted(packets: Iterable[Any]) -> Iterator[Any]:
+            for packet in packets:
+                yield packet
+                pbar.update(1)
+                if notify_progress is not None:
+                    notify_progress(int((pbar.n / float(pbar.total)) * 100))
+
+        for start, end in frame_ranges:
+            packets = __packets_in_range(
+                input_container, video_stream, index, start, end
+            )
+            next_dts = mux_shifted(
+                counted(packets),
+                next_dts,
+                frame_duration,
+                output_container,
+                output_stream,
+            )
+
+
+def concat_videos(input_paths: List[Path], output_path: Path) -> None:
+    """
+    Join videos encoded with the same settings into one, without re-encoding.
+
+    Args:
+        input_paths (List[Path]): The videos to join, in order.
+        output_path (Path): The path to the joined video.
+    """
+    with av.open(str(output_path), mode="w") as output_container:
+        output_stream = None
+        next_dts = 0
+        for input_path in input_paths:
+            with av.open(str(input_path)) as input_container:
+                video_stream = input_container.streams.video[0]
+                if output_stream is None:
+                    output_stream = output_container.add_stream_from_template(
+                        video_stream
+                    )
+                packets = (
+                    packet
+                    for packet in input_container.demux(video_stream)
+                    if packet.size > 0
+                )
+                next_dts = mux_shifted(
+                    packets,
+                    next_dts,
+                    frame_duration_of(video_stream),
+                    output_container,
+                    output_stream,
+                )
+
+
+def __copy_video(
     input_path: Path,
     output_path: Path,
     frame_ranges: List[Tuple[int, int]],
-    predictions: Dict[int, List[Detection]] | None = None,
+    notify_progress: Callable[[int], None] | None = None,
+) -> bool:
+    """
+    Cut a video without re-encoding, with the ranges widened to whole GOPs.
+
+    Returns:
+        bool: False if the video can't be indexed, and nothing was written.
+    """
+    index = VideoIndex.from_video(input_path)
+    if index is None:
+        return False
+    snapped_ranges = snap_to_keyframes(frame_ranges, index)
+    logger.info(
+        "Copying %d frames in %d ranges, %d frames were requested",
+        sum(end - start + 1 for start, end in snapped_ranges),
+        len(snapped_ranges),
+        sum(end - start + 1 for start, end in frame_ranges),
+    )
+
+    with av.open(str(input_path)) as input_container, av.open(
+        str(output_path), mode="w"
+    ) as output_container:
+        video_stream = input_container.streams.video[0]
+        output_stream = output_container.add_stream_from_template(video_stream)
+        remux_frame_ranges(
+            snapped_ranges,
+            index,
+            input_container,
+            video_stream,
+            output_container,
+            output_stream,
+            notify_progress,
+        )
+    return True
+
+
+def add_x264_stream(  # pylint: disable=too-many-arguments
+    output_container: av.container.output,
+    fps: float,
+    width: int,
+    height: int,
+    pix_fmt: str,
+    crf: int,
+) -> av.video.stream:
+    """
+    Add the libx264 stream the cut videos are encoded with to an output container.
+
+    Args:
+        output_container (av.container.output): The output container.
+        fps (float): The frame rate of the video.
+        width (int): The width of the frames.
+        height (int): The height of the frames.
+        pix_fmt (str): The pixel format of the encoded frames.
+        crf (int): The constant rate factor of the encoder.
+
+    Returns:
+        av.video.stream: The output video stream.
+    """
+    output_stream = output_container.add_stream(
+        "libx264",
+        rate=Fraction(fps).limit_denominator(65535),
+        options={"crf": str(crf)},
+    )
+    output_stream.width = width
+    output_stream.height = height
+    output_stream.pix_fmt = pix_fmt
+    return output_stream
+
+
+def encode_frame_ranges(  # pylint: disable=too-many-arguments
+    input_path: Path,
+    output_path: Path,
+    frame_ranges: List[Tuple[int, int]],
+    predictions: Mapping[int, List[Detection]] | None,
+    crf: int,
     notify_progress: Callable[[int], None] | None = None,
 ) -> None:
     """
-    Cut a video into segments specified by a list of frame ranges,
-    and optionally annotate the frames with detections.
+    Encode frame ranges of a video into a new video with libx264.
 
     Args:
         input_path (Path): The path to the input video file.
         output_path (Path): The path to the output video file.
         frame_ranges (List[Tuple[int, int]]): A list of (start, end) frame ranges.
-        predictions (Dict[int, List[Detection]] | None, optional):
-            A dictionary mapping frame numbers to lists of Detection objects. Defaults to None.
-
-    Raises:
-        FileNotFoundError: If the input file does not exist.
-        av.AVError: If there is an error opening or processing the input file,
-                    or encoding/muxing the output file.
-
-    Returns:
-        None
+        predictions (Mapping[int, List[Detection]] | None): Optional detections for each frame.
+        crf (int): The constant rate factor of the encoder.
     """
     input_container = av.open(str(input_path))
     video_stream = input_container.streams.video[0]
@@ -295,14 +792,14 @@ def cut_video(
 
     output_container = av.open(str(output_path), mode="w")
     fps = video_stream.average_rate.numerator / video_stream.average_rate.denominator
-    output_stream = output_container.add_stream(
-        "libx264",
-        rate=Fraction(fps).limit_denominator(65535),
-        options={"crf": str(settings.video_crf)},
+    output_stream = add_x264_stream(
+        output_container,
+        fps,
+        video_stream.codec_context.width,
+        video_stream.codec_context.height,
+        video_stream.codec_context.pix_fmt or "yuv420p",
+        crf,
     )
-    output_stream.width = video_stream.codec_context.width
-    output_stream.height = video_stream.codec_context.height
-    output_stream.pix_fmt = video_stream.codec_context.pix_fmt
 
     annotator = Annotator((output_stream.width, output_stream.height))
 
@@ -323,3 +820,160 @@ def cut_video(
 
     output_container.close()
     input_container.close()
+
+
+def __encode_segment(  # pylint: disable=too-many-arguments
+    progress_queue: "queue.Queue[Tuple[int, int]]",
+    segment: int,
+    input_path: Path,
+    output_path: Path,
+    frame_ranges: List[Tuple[int, int]],
+    predictions: Mapping[int, List[Detection]] | None,
+    crf: int,
+) -> None:
+    """Encode a segment in a worker process, putting (segment, progress) in the
+    queue whenever its progress changes."""
+    last_progress = -1
+
+    def notify_progress(progress: int) -> None:
+        nonlocal last_progress
+        if progress != last_progress:
+            last_progress = progress
+            progress_queue.put((segment, progress))
+
+    encode_frame_ranges(
+        input_path, output_path, frame_ranges, predictions, crf, notify_progress
+    )
+
+
+def __encode_segments(  # pylint: disable=too-many-arguments,too-many-locals
+    input_path: Path,
+    segment_paths: List[Path],
+    frame_ranges: List[Tuple[int, int]],
+    predictions: Mapping[int, List[Detection]] | None,
+    workers: int,
+    notify_progress: Callable[[int], None] | None = None,
+) -> None:
+    """
+    Encode every frame range into its own segment in worker processes.
+
+    A segment only gets the predictions of its own frames, so less is sent to the
+    workers. The workers report their progress through a queue, which is added up
+    over the frames of all segments.
+    """
+    frame_counts = [end - start + 1 for start, end in frame_ranges]
+    total_frames = sum(frame_counts)
+    jobs = [
+        (
+            input_path,
+            segment_path,
+            [(start, end)],
+            None
+            if predictions is None
+            else {
+                frame: predictions[frame]
+                for frame in range(start, end + 1)
+                if frame in predictions
+            },
+            settings.video_crf,
+        )
+        for segment_path, (start, end) in zip(segment_paths, frame_ranges)
+    ]
+
+    context = mp.get_context("spawn")
+    with context.Manager() as manager, ProcessPoolExecutor(
+        max_workers=min(workers, len(jobs)), mp_context=context
+    ) as executor:
+        progress_queue = manager.Queue()
+        futures = [
+            executor.submit(__encode_segment, progress_queue, segment, *job)
+            for segment, job in enumerate(jobs)
+        ]
+        segment_progress = [0] * len(jobs)
+        while (
+            not all(future.done() for future in futures) or not progress_queue.empty()
+        ):
+            try:
+                segment, progress = progress_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            segment_progress[segment] = progress
+            if notify_progress is not None:
+                done_frames = sum(
+                    progress / 100 * frame_count
+                    for progress, frame_count in zip(segment_progress, frame_counts)
+                )
+                notify_progress(int(done_frames / total_frames * 100))
+
+        for future in futures:
+            future.result()
+
+
+def cut_video(  # pylint: disable=too-many-arguments
+    input_path: Path,
+    output_path: Path,
+    frame_ranges: List[Tuple[int, int]],
+    predictions: Mapping[int, List[Detection]] | None = None,
+    notify_progress: Callable[[int], None] | None = None,
+    stream_copy: bool = False,
+    workers: int = 1,
+) -> None:
+    """
+    Cut a video into segments specified by a list of frame ranges,
+    and optionally annotate the frames with detections.
+
+    Args:
+        input_path (Path): The path to the input video file.
+        output_path (Path): The path to the output video file.
+        frame_ranges (List[Tuple[int, int]]): A list of (start, end) frame ranges.
+        predictions (Mapping[int, List[Detection]] | None, optional):
+            A mapping of frame numbers to lists of Detection objects, like a dictionary
+            or a DetectionStore. Defaults to None.
+        stream_copy (bool, optional): Copy the compressed video instead of re-encoding
+            it when there is nothing to annotate. The ranges are widened to start and
+            end at keyframes. Defaults to False.
+        workers (int, optional): The number of processes encoding frame ranges at the
+            same time. With more than one, every range is encoded on its own and the
+            results are joined. Defaults to 1.
+
+    Raises:
+        FileNotFoundError: If the input file does not exist.
+        av.AVError: If there is an error opening or processing the input file,
+                    or encoding/muxing the output file.
+
+    Returns:
+        None
+    """
+    if stream_copy:
+        if predictions is not None:
+            logger.warning("Can't annotate a stream copied video, re-encoding instead")
+        elif __copy_video(input_path, output_path, frame_ranges, notify_progress):
+            return
+        else:
+            logger.warning("Can't index %s for stream copy, re-encoding", input_path)
+
+    if workers <= 1 or len(frame_ranges) <= 1:
+        encode_frame_ranges(
+            input_path,
+            output_path,
+            frame_ranges,
+            predictions,
+            settings.video_crf,
+            notify_progress,
+        )
+        return
+
+    with tempfile.TemporaryDirectory(dir=output_path.parent) as segment_dir:
+        segment_paths = [
+            Path(segment_dir) / f"{number:05d}.mp4"
+            for number in range(len(frame_ranges))
+        ]
+        __encode_segments(
+            input_path,
+            segment_paths,
+            frame_ranges,
+            predictions,
+            workers,
+            notify_progress,
+        )
+        concat_videos(segment_paths, output_path)
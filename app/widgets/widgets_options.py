@@ -338,13 +338,23 @@ class AdvancedOptions(QWidget):
 
         self.layout_r1.addWidget(self.__create_prediction_spinbox())
         self.layout_r1.addWidget(self.__create_batch_size_dropdown())
+        self.layout_r1.addWidget(self.__create_autotune_checkbox())
+        self.layout_r1.addWidget(self.__create_pipeline_metrics_checkbox())
 
         self.layout_r2.addWidget(self.__create_frame_buffer_spinbox())
         self.layout_r2.addWidget(self.__create_max_detections_spinbox())
+        self.layout_r2.addWidget(self.__create_stream_copy_checkbox())
+        self.layout_r2.addWidget(self.__create_streaming_cut_checkbox())
 
         self.layout_r3.addWidget(self.__create_crf_slider())
+        self.layout_r3.addWidget(self.__create_frame_stride_spinbox())
+        self.layout_r3.addWidget(self.__create_adaptive_stride_checkbox())
+        self.layout_r3.addWidget(self.__create_motion_gate_checkbox())
+        self.layout_r3.addWidget(self.__create_motion_threshold_spinbox())
 
         self.layout_r4.addWidget(self.__create_weights_dropdown())
+        self.layout_r4.addWidget(self.__create_frame_grabber_dropdown())
+        self.layout_r4.addWidget(self.__create_inference_backend_dropdown())
 
     def clear_layout(self, layout: QBoxLayout) -> None:
         """Removes all of the advanced options
@@ -379,6 +389,65 @@ class AdvancedOptions(QWidget):
         batch_size_dd.connect(on_batch_size_changed)
         return batch_size_dd
 
+    def __create_autotune_checkbox(self) -> Checkbox:
+        autotune_checkbox = Checkbox(
+            "Autotune",
+            "Use the batch size and threads that are fastest on this computer, "
+            + "instead of the batch size above. They are measured on the first video "
+            + "the first time a model is used, which takes a few minutes.",
+        )
+        autotune_checkbox.set_check_state(settings.autotune)
+
+        def on_autotune_changed(value: bool) -> None:
+            settings.autotune = value
+
+        autotune_checkbox.connect(on_autotune_changed)
+        return autotune_checkbox
+
+    def __create_frame_grabber_dropdown(self) -> DropDownWidget:
+        frame_grabber_dd = DropDownWidget(
+            "Frame Grabber",
+            Common.frame_grabber_backends,
+            "NB! Only for experienced users! \nWhether frames are decoded and "
+            + "preprocessed in threads or in separate processes.",
+            fit_content=True,
+        )
+
+        try:
+            frame_grabber_dd.set_index(
+                Common.frame_grabber_backends.index(settings.frame_grabber_backend)
+            )
+        except ValueError:
+            settings.frame_grabber_backend = Common.frame_grabber_backends[0]
+
+        def on_frame_grabber_changed(index: int) -> None:
+            settings.frame_grabber_backend = Common.frame_grabber_backends[index]
+
+        frame_grabber_dd.connect(on_frame_grabber_changed)
+        return frame_grabber_dd
+
+    def __create_inference_backend_dropdown(self) -> DropDownWidget:
+        inference_backend_dd = DropDownWidget(
+            "Inference",
+            Common.inference_backends,
+            "NB! Only for experienced users! \nWhether the model runs in PyTorch, "
+            + "or is exported once and run with ONNX Runtime, faster without a GPU.",
+            fit_content=True,
+        )
+
+        try:
+            inference_backend_dd.set_index(
+                Common.inference_backends.index(settings.inference_backend)
+            )
+        except ValueError:
+            settings.inference_backend = Common.inference_backends[0]
+
+        def on_inference_backend_changed(index: int) -> None:
+            settings.inference_backend = Common.inference_backends[index]
+
+        inference_backend_dd.connect(on_inference_backend_changed)
+        return inference_backend_dd
+
     def __create_prediction_spinbox(self) -> SpinBox:
         prediction_tooltip = (
             "The prediction thres"
@@ -438,6 +507,111 @@ The available range is 0–51 (0 is lossless, 51 is worst quality possible, defa
         crf_slider.connect(on_crf_slider_changed)
         return crf_slider
 
+    def __create_frame_stride_spinbox(self) -> SpinBox:
+        frame_stride_spinbox = SpinBox(
+            "Frame Stride",
+            1,
+            30,
+            settings.frame_stride,
+            """Only run detection on every n-th frame, 1 runs it on every frame.
+The frames in between get the detections of the frame before them.
+Higher values are faster, but may miss fish that are only briefly visible.""",
+        )
+
+        def on_frame_stride_changed(value: int) -> None:
+            settings.frame_stride = value
+
+        frame_stride_spinbox.connect(on_frame_stride_changed)
+        return frame_stride_spinbox
+
+    def __create_adaptive_stride_checkbox(self) -> Checkbox:
+        adaptive_stride_checkbox = Checkbox(
+            "Adaptive Stride",
+            "Run detection on every frame while fish were seen within the "
+            + "frame gap tolerance, and only use the frame stride otherwise.",
+        )
+        adaptive_stride_checkbox.set_check_state(settings.adaptive_stride)
+
+        def on_adaptive_stride_changed(value: bool) -> None:
+            settings.adaptive_stride = value
+
+        adaptive_stride_checkbox.connect(on_adaptive_stride_changed)
+        return adaptive_stride_checkbox
+
+    def __create_motion_gate_checkbox(self) -> Checkbox:
+        motion_gate_checkbox = Checkbox(
+            "Motion Gate",
+            "Skip detection on frames where nothing moved compared to the background. "
+            + "Skipped frames get the detections of the frame before them.",
+        )
+        motion_gate_checkbox.set_check_state(settings.motion_gate)
+
+        def on_motion_gate_changed(value: bool) -> None:
+            settings.motion_gate = value
+
+        motion_gate_checkbox.connect(on_motion_gate_changed)
+        return motion_gate_checkbox
+
+    def __create_motion_threshold_spinbox(self) -> SpinBox:
+        motion_threshold_spinbox = SpinBox(
+            "Motion Threshold",
+            1,
+            255,
+            settings.motion_gate_threshold,
+            """How much a pixel has to change from the background to count as motion.
+Lower values skip fewer frames.""",
+        )
+
+        def on_motion_threshold_changed(value: int) -> None:
+            settings.motion_gate_threshold = value
+
+        motion_threshold_spinbox.connect(on_motion_threshold_changed)
+        return motion_threshold_spinbox
+
+    def __create_stream_copy_checkbox(self) -> Checkbox:
+        stream_copy_checkbox = Checkbox(
+            "Fast Cut",
+            "Copy the video without re-encoding it when no boxes are drawn. "
+            + "The cuts are moved out to the nearest keyframes, "
+            + "so the clips can be a little longer.",
+        )
+        stream_copy_checkbox.set_check_state(settings.stream_copy_cut)
+
+        def on_stream_copy_changed(value: bool) -> None:
+            settings.stream_copy_cut = value
+
+        stream_copy_checkbox.connect(on_stream_copy_changed)
+        return stream_copy_checkbox
+
+    def __create_pipeline_metrics_checkbox(self) -> Checkbox:
+        pipeline_metrics_checkbox = Checkbox(
+            "Stage Timings",
+            "Write the time spent decoding, letterboxing, detecting and cutting "
+            + "every video to <video>_metrics.json in the output folder.",
+        )
+        pipeline_metrics_checkbox.set_check_state(settings.pipeline_metrics)
+
+        def on_pipeline_metrics_changed(value: bool) -> None:
+            settings.pipeline_metrics = value
+
+        pipeline_metrics_checkbox.connect(on_pipeline_metrics_changed)
+        return pipeline_metrics_checkbox
+
+    def __create_streaming_cut_checkbox(self) -> Checkbox:
+        streaming_cut_checkbox = Checkbox(
+            "Cut While Detecting",
+            "Write the cut video from the frames decoded for detection, "
+            + "instead of decoding the video a second time. "
+            + "Needs detection on every frame.",
+        )
+        streaming_cut_checkbox.set_check_state(settings.streaming_cut)
+
+        def on_streaming_cut_changed(value: bool) -> None:
+            settings.streaming_cut = value
+
+        streaming_cut_checkbox.connect(on_streaming_cut_changed)
+        return streaming_cut_checkbox
+
     def __create_max_detections_spinbox(self) -> SpinBox:
         max_detections_spinbox = SpinBox(
             "Max Detections",
@@ -474,7 +648,12 @@ Reducing this number will improve performance when there are a lot of fish frame
         def get_available_weights() -> List[str]:
             """Gets available weights from the weights folder"""
             weights_folder = Common.weights_folder
-            weights = [weight.name for weight in weights_folder.glob("*.pt")]
+            # The .onnx files are quantized models
+            weights = [
+                weight.name
+                for pattern in ("*.pt", "*.onnx")
+                for weight in weights_folder.glob(pattern)
+            ]
             return weights
 
         available_weights = get_available_weights()
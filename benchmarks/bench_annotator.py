@@ -0,0 +1,100 @@
+"""Micro-benchmark of annotated frames/s: PIL round trips vs drawing into the frame.
+
+The PIL column is ultralytics' Annotator, which detection annotated with before, and
+converts every frame to a PIL image and back.
+
+Usage:
+    python -m benchmarks.bench_annotator --width 1920 --height 1080
+"""
+import argparse
+import sys
+import time
+from typing import Any, Callable, List
+
+import numpy as np
+from ultralytics.utils.plotting import Annotator as PilAnnotator
+
+from app.video_processor import Detection
+from app.video_processor.video_processor import Annotator
+
+
+def random_detections(
+    rng: np.random.Generator, count: int, width: int, height: int
+) -> List[Detection]:
+    """Returns boxes spread over the frame, with the labels our models produce."""
+    detections = []
+    for _ in range(count):
+        xmin = int(rng.integers(0, width - 200))
+        ymin = int(rng.integers(0, height - 150))
+        detections.append(
+            Detection(
+                label=str(rng.choice(["Abbor", "Gjedde", "Mort"])),
+                confidence=float(rng.integers(50, 100)) / 100,
+                xmin=xmin,
+                ymin=ymin,
+                xmax=xmin + int(rng.integers(40, 200)),
+                ymax=ymin + int(rng.integers(30, 150)),
+            )
+        )
+    return detections
+
+
+def pil_annotate(
+    frame: np.ndarray[Any, Any], detections: List[Detection]
+) -> np.ndarray[Any, Any]:
+    """Annotates a frame like detection did through ultralytics' PIL annotator."""
+    annotator = PilAnnotator(frame, line_width=2, pil=True)
+    for detection in detections:
+        annotator.box_label(
+            (detection.xmin, detection.ymin, detection.xmax, detection.ymax),
+            f"{detection.confidence:.2f} {detection.label}",
+            color=(255, 0, 0),
+        )
+    result: np.ndarray[Any, Any] = annotator.result()
+    return result
+
+
+def frames_per_second(
+    annotate: Callable[[np.ndarray[Any, Any], List[Detection]], Any],
+    frame: np.ndarray[Any, Any],
+    detections: List[Detection],
+    frame_count: int,
+) -> float:
+    """Returns the number of frames annotated per second."""
+    frames = [frame.copy() for _ in range(frame_count)]
+    annotate(frame.copy(), detections)  # warm up, and fill the label cache
+    start = time.perf_counter()
+    for copy in frames:
+        annotate(copy, detections)
+    return frame_count / (time.perf_counter() - start)
+
+
+def main() -> int:
+    """Runs the benchmark and prints a table of frames/s per number of boxes."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--boxes", type=int, nargs="+", default=[1, 10, 100])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 255, (args.height, args.width, 3), dtype=np.uint8)
+    annotator = Annotator((args.width, args.height))
+
+    print(f"{'boxes':>6} {'PIL fps':>10} {'NumPy fps':>10} {'speedup':>8}")
+    for box_count in args.boxes:
+        detections = random_detections(rng, box_count, args.width, args.height)
+        pil_fps = frames_per_second(pil_annotate, frame, detections, args.frames)
+        numpy_fps = frames_per_second(
+            annotator.annotate, frame, detections, args.frames
+        )
+        print(
+            f"{box_count:>6} {pil_fps:>10.1f} {numpy_fps:>10.1f} "
+            f"{numpy_fps / pil_fps:>7.2f}x"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
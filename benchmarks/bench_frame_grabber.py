@@ -0,0 +1,82 @@
+"""Throughput of the thread and process frame grabber backends on a synthetic video.
+
+Only the frame grabbers are timed, the model is not run on the batches. The time until
+the first batch is reported separately, as the process backend has to spawn its workers.
+
+Usage:
+    python -m benchmarks.bench_frame_grabber --width 1920 --height 1080 --frames 300
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Tuple
+
+from app.detection.batch_yolov8 import BatchYolov8
+from app.detection.frame_grabber import ThreadedFrameGrabber
+from app.detection.process_frame_grabber import ProcessFrameGrabber
+from benchmarks.synthetic import write_random_weights, write_synthetic_video
+
+BACKENDS = {"thread": ThreadedFrameGrabber, "process": ProcessFrameGrabber}
+
+
+def grab_all(
+    backend: str, model: BatchYolov8, video_path: Path, batch_size: int
+) -> Tuple[float, float]:
+    """Grabs all frames of the video with a backend.
+
+    Returns:
+        The seconds until the first batch, and the frames/s after the first batch.
+    """
+    frames = 0
+    first_batch = None
+    start = time.perf_counter()
+    with BACKENDS[backend](
+        batch_size=batch_size, model=model, video_path=video_path
+    ) as frame_grabber:
+        while not frame_grabber.is_done():
+            batch = frame_grabber.get_batch()
+            if batch is None:
+                continue
+            processed_batch, original_batch, _ = batch
+            if first_batch is None:
+                first_batch = time.perf_counter()
+            else:
+                frames += len(original_batch)
+            frame_grabber.release_batch(processed_batch)
+        end = time.perf_counter()
+
+    if first_batch is None:
+        raise RuntimeError(f"The {backend} backend returned no batches")
+    return first_batch - start, frames / max(end - first_batch, 1e-9)
+
+
+def main() -> int:
+    """Runs the benchmark and prints the startup time and frames/s per backend."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--img_size", type=int, default=640)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--weights", type=str, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = write_synthetic_video(
+            Path(tmp_dir) / "synthetic.mp4", args.frames, (args.width, args.height)
+        )
+        weights = args.weights or write_random_weights(Path(tmp_dir) / "random.pt")
+        model = BatchYolov8(weights, args.device, img_size=args.img_size)
+
+        print(f"{'backend':>8} {'startup s':>10} {'fps':>10}")
+        for backend in BACKENDS:
+            startup, fps = grab_all(backend, model, video_path, args.batch_size)
+            print(f"{backend:>8} {startup:>10.2f} {fps:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
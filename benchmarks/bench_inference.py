@@ -0,0 +1,81 @@
+"""Frames/s of the model run in PyTorch and with ONNX Runtime on the CPU.
+
+Only the model and NMS are timed, on random frames that are prepared once. The time
+to load the model, which includes the export for the onnx backend, is reported apart.
+
+Usage:
+    python -m benchmarks.bench_inference --img_size 640 --batch_size 8 --threads 4
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from app.common import Common
+from app.detection.batch_yolov8 import BatchYolov8
+from benchmarks.synthetic import write_random_weights
+
+
+def frames_per_second(
+    model: BatchYolov8, batch_size: int, height: int, width: int, repeats: int
+) -> float:
+    """Returns the number of frames run through the model per second."""
+    rng = np.random.default_rng(0)
+    frames = [
+        rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+        for _ in range(batch_size)
+    ]
+    imgs = model.prepare_images(frames)
+    model.predict_batch_records(frames, imgs)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.predict_batch_records(frames, imgs)
+    return batch_size * repeats / (time.perf_counter() - start)
+
+
+def main() -> int:
+    """Runs the benchmark and prints the frames/s of every backend."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--img_size", type=int, default=640)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--weights", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Don't leave the exports of the benchmark in the exported models folder
+        Common.exported_models_folder = Path(tmp_dir)
+        weights = Path(
+            args.weights or write_random_weights(Path(tmp_dir) / "random.pt")
+        )
+
+        print(f"{'backend':>8} {'load s':>10} {'fps':>10}")
+        for backend in Common.inference_backends:
+            start = time.perf_counter()
+            model = BatchYolov8(
+                weights,
+                "cpu",
+                img_size=args.img_size,
+                backend=backend,
+                threads=args.threads,
+            )
+            load = time.perf_counter() - start
+            fps = frames_per_second(
+                model, args.batch_size, args.height, args.width, args.repeats
+            )
+            print(f"{backend:>8} {load:>10.2f} {fps:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
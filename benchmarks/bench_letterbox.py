@@ -0,0 +1,74 @@
+"""Micro-benchmark of batch preprocessing: per-frame LetterBox vs BatchLetterbox.
+
+Usage:
+    python -m benchmarks.bench_letterbox --width 1920 --height 1080
+"""
+import argparse
+import sys
+import time
+from typing import Any, Callable, List
+
+import numpy as np
+from ultralytics.data.augment import LetterBox
+
+from app.common import Common
+from app.detection.batch_yolov8 import BatchYolov8
+from app.detection.letterbox import BatchLetterbox, LetterboxParams
+
+
+def legacy_prepare(
+    frames: List[np.ndarray[Any, Any]], img_size: int
+) -> np.ndarray[Any, Any]:
+    """The preprocessing done by BatchYolov8.prepare_images before the tensor conversion."""
+    img_list = []
+    for frame in frames:
+        image = LetterBox(stride=32, new_shape=img_size)(image=frame)
+        img_list.append(np.ascontiguousarray(image[:, :, ::-1].transpose(2, 0, 1)))
+    return np.asarray(BatchYolov8.pad_batch_of_images(img_list))
+
+
+def frames_per_second(
+    prepare: Callable[[List[np.ndarray[Any, Any]]], Any],
+    frames: List[np.ndarray[Any, Any]],
+    repeats: int,
+) -> float:
+    """Returns the number of frames prepared per second."""
+    prepare(frames)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        prepare(frames)
+    return len(frames) * repeats / (time.perf_counter() - start)
+
+
+def main() -> int:
+    """Runs the benchmark and prints a table of frames/s per batch size."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--img_size", type=int, default=640)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 255, (args.height, args.width, 3), dtype=np.uint8)
+    params = LetterboxParams.from_shape((args.height, args.width), args.img_size)
+
+    print(f"{'batch':>6} {'legacy fps':>12} {'batched fps':>12} {'speedup':>8}")
+    for batch_size in (int(size) for size in Common.batch_size):
+        # Distinct frames so the copies are not served from cache
+        frames = [frame.copy() for _ in range(batch_size)]
+        letterbox = BatchLetterbox(params, batch_size)
+
+        legacy_fps = frames_per_second(
+            lambda batch: legacy_prepare(batch, args.img_size), frames, args.repeats
+        )
+        batched_fps = frames_per_second(letterbox, frames, args.repeats)
+        print(
+            f"{batch_size:>6} {legacy_fps:>12.1f} {batched_fps:>12.1f} "
+            f"{batched_fps / legacy_fps:>7.2f}x"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""Report of the recall lost by frame stride sampling compared to full-rate detection.
+
+Runs detection on a reference video at every frame, and then with each stride, and
+reports how many of the full-rate fish frames and frame ranges are still found.
+Point it at a real recording and our weights, the synthetic defaults only check that
+the modes run.
+
+Usage:
+    python -m benchmarks.stride_recall --video survey.mp4 --weights model.pt --strides 2 5 10
+"""
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List, Set, Tuple
+
+from app.detection.batch_yolov8 import BatchYolov8
+from app.detection.detection import detected_frames_to_ranges, process_video
+from benchmarks.synthetic import write_random_weights, write_synthetic_video
+
+
+def run(  # pylint: disable=too-many-arguments
+    model: BatchYolov8,
+    video_path: Path,
+    batch_size: int,
+    stride: int,
+    adaptive: bool,
+    repeats: int = 1,
+) -> Tuple[List[int], float]:
+    """Returns the frames with fish and the fewest seconds it took to find them in
+    the repeats, the others are slowed down by noise."""
+    frames_with_fish: List[int] = []
+    seconds = []
+    for _ in range(max(1, repeats)):
+        start = time.perf_counter()
+        frames_with_fish, _ = process_video(
+            model,
+            video_path,
+            batch_size,
+            4,
+            None,
+            threading.Event(),
+            stride=stride,
+            adaptive=adaptive,
+        )
+        seconds.append(time.perf_counter() - start)
+    return frames_with_fish, min(seconds)
+
+
+def range_recall(
+    reference: List[Tuple[int, int]], found: List[Tuple[int, int]]
+) -> float:
+    """Returns the share of reference ranges that overlap a found range."""
+    if not reference:
+        return 1.0
+    hits = sum(
+        any(
+            start <= found_end and found_start <= end
+            for found_start, found_end in found
+        )
+        for start, end in reference
+    )
+    return hits / len(reference)
+
+
+def frame_recall(reference: Set[int], found: Set[int]) -> float:
+    """Returns the share of reference frames that are found."""
+    return len(reference & found) / len(reference) if reference else 1.0
+
+
+def main() -> int:
+    """Runs the report and prints a table of recall and speedup per stride."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--video", type=str, default=None)
+    parser.add_argument("--weights", type=str, default=None)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--img_size", type=int, default=640)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--conf_thres", type=float, default=0.5)
+    parser.add_argument("--frame_buffer", type=int, default=25)
+    parser.add_argument("--strides", type=int, nargs="+", default=[2, 5, 10])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = (
+            Path(args.video)
+            if args.video
+            else write_synthetic_video(Path(tmp_dir) / "synthetic.mp4", size=(640, 360))
+        )
+        weights = args.weights or write_random_weights(Path(tmp_dir) / "random.pt")
+        model = BatchYolov8(
+            weights, args.device, img_size=args.img_size, conf_thres=args.conf_thres
+        )
+
+        # Warm up the model and the allocator, so the reference isn't timed cold
+        run(model, video_path, args.batch_size, 1, False)
+        reference, reference_time = run(
+            model, video_path, args.batch_size, 1, False, args.repeats
+        )
+        reference_ranges = detected_frames_to_ranges(reference, args.frame_buffer)
+        print(
+            f"full rate: {len(reference)} fish frames in {len(reference_ranges)} ranges, "
+            f"{reference_time:.1f}s"
+        )
+
+        print(
+            f"{'stride':>6} {'adaptive':>8} {'frame recall':>12} "
+            f"{'range recall':>12} {'speedup':>8}"
+        )
+        for stride in args.strides:
+            for adaptive in (False, True):
+                found, seconds = run(
+                    model, video_path, args.batch_size, stride, adaptive, args.repeats
+                )
+                ranges = detected_frames_to_ranges(found, args.frame_buffer)
+                print(
+                    f"{stride:>6} {str(adaptive):>8} "
+                    f"{frame_recall(set(reference), set(found)):>12.3f} "
+                    f"{range_recall(reference_ranges, ranges):>12.3f} "
+                    f"{reference_time / seconds:>7.2f}x"
+                )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,419 @@
+"""End-to-end benchmark of the detection pipeline on synthetic fish videos.
+
+Writes a video for every combination of --sizes, --lengths and --codecs, with blobs
+swimming like fish through some stretches and nothing in the others. Every stage is
+timed on its own on each video, the frame grabber, the model, turning the frames
+with fish into ranges, cutting, and the database and report writes, and then the
+whole folder processing is timed. Randomly initialized weights are used unless
+--weights is given, so it runs on a CPU without our models. They find fish in every
+frame at the default threshold of 0, so the whole video is cut end to end.
+
+The results are written as JSON with the commit and host they were measured on.
+--compare prints the change from an earlier result file, and fails when a stage got
+slower than --tolerance, to find regressions between commits.
+
+Usage:
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --output after.json --compare before.json
+    python -m benchmarks.suite --sizes 640x360 --lengths 100 --codecs mp4v --repeats 1
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import cv2
+import torch
+
+from app import settings
+from app.data_manager.data_manager import DataManager
+from app.detection.batch_yolov8 import BatchYolov8
+from app.detection.detection import detected_frames_to_ranges
+from app.detection.folder_processor import FolderCallbacks, FolderProcessor
+from app.detection.frame_grabber import ThreadedFrameGrabber
+from app.report_manager.report_manager import ReportManager
+from app.video_processor import video_processor
+from benchmarks.synthetic import (
+    CODEC_EXTENSIONS,
+    fish_frames,
+    write_fish_video,
+    write_random_weights,
+)
+
+RESULTS_FOLDER = Path("data/benchmarks")
+FPS = 25
+# detected_frames_to_ranges takes microseconds, so it is timed over many calls
+RANGES_CALLS = 1000
+
+
+@dataclass
+class VideoCase:
+    """A synthetic video of the benchmark."""
+
+    width: int
+    height: int
+    frames: int
+    codec: str
+
+    @property
+    def name(self) -> str:
+        """Identifies the case in the results."""
+        return f"{self.width}x{self.height}-{self.frames}-{self.codec}"
+
+
+def git_commit() -> Tuple[str, bool]:
+    """Returns the commit of the working tree, and if it has changes."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, status != ""
+
+
+def time_runs(repeats: int, run: Callable[[], Any]) -> List[float]:
+    """Returns the seconds of every run, the fastest is the least disturbed."""
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def stage_result(runs: List[float], count: int, unit: str) -> Dict[str, Any]:
+    """The result of a stage that handled count units in every run."""
+    seconds = min(runs)
+    return {
+        "seconds": seconds,
+        "count": count,
+        "unit": unit,
+        "per_second": count / max(seconds, 1e-9),
+        "runs": runs,
+    }
+
+
+def grab_frames(model: BatchYolov8, video_path: Path, batch_size: int) -> int:
+    """Decodes and letterboxes every frame of a video, and returns the frame count."""
+    frames = 0
+    with ThreadedFrameGrabber(
+        batch_size=batch_size, model=model, video_path=video_path
+    ) as frame_grabber:
+        while not frame_grabber.is_done():
+            batch = frame_grabber.get_batch()
+            if batch is None:
+                continue
+            processed_batch, original_batch, _ = batch
+            frames += len(original_batch)
+            frame_grabber.release_batch(processed_batch)
+    return frames
+
+
+def read_batch(video_path: Path, batch_size: int) -> List[Any]:
+    """Returns the first frames of a video."""
+    capture = cv2.VideoCapture(str(video_path))
+    frames: List[Any] = []
+    while len(frames) < batch_size:
+        success, frame = capture.read()
+        if not success:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+def run_folder(model: BatchYolov8, video_path: Path, work_folder: Path) -> Path:
+    """Processes a folder with only the video, like the detection window does.
+
+    Returns:
+        The output folder.
+    """
+    input_folder = work_folder / "in"
+    output_folder = work_folder / "out"
+    input_folder.mkdir(parents=True)
+    output_folder.mkdir()
+    shutil.copy(video_path, input_folder / video_path.name)
+    processor = FolderProcessor(
+        input_folder, output_folder, FolderCallbacks(log=lambda text: None)
+    )
+    processor.model = model
+    processor.process_folder()
+    return output_folder
+
+
+def run_case(  # pylint: disable=too-many-locals
+    case: VideoCase,
+    model: BatchYolov8,
+    work_folder: Path,
+    batch_size: int,
+    repeats: int,
+) -> Dict[str, Any]:
+    """Writes the video of a case, and times every stage on it.
+
+    Returns:
+        The results of the case.
+    """
+    video_path = write_fish_video(
+        work_folder / f"{case.name}{CODEC_EXTENSIONS[case.codec]}",
+        case.frames,
+        (case.width, case.height),
+        FPS,
+        case.codec,
+    )
+    frames_with_fish = fish_frames(case.frames, FPS)
+    frame_ranges = detected_frames_to_ranges(frames_with_fish, FPS)
+    stages: Dict[str, Dict[str, Any]] = {}
+
+    stages["frame_grabber"] = stage_result(
+        time_runs(repeats, lambda: grab_frames(model, video_path, batch_size)),
+        case.frames,
+        "frames",
+    )
+
+    batch = read_batch(video_path, batch_size)
+    imgs = model.prepare_images(batch)
+    model.predict_batch(batch, imgs)  # warm up
+    stages["predict_batch"] = stage_result(
+        time_runs(repeats, lambda: model.predict_batch(batch, imgs)),
+        len(batch),
+        "frames",
+    )
+
+    def to_ranges() -> None:
+        for _ in range(RANGES_CALLS):
+            detected_frames_to_ranges(frames_with_fish, FPS)
+
+    stages["detected_frames_to_ranges"] = stage_result(
+        time_runs(repeats, to_ranges), RANGES_CALLS, "calls"
+    )
+
+    cut_path = work_folder / f"{case.name}_processed.mp4"
+    stages["cut_video"] = stage_result(
+        time_runs(
+            repeats,
+            lambda: video_processor.cut_video(video_path, cut_path, frame_ranges),
+        ),
+        len(frames_with_fish),
+        "frames",
+    )
+
+    with DataManager() as data_manager:
+
+        def write_data() -> None:
+            data_manager.add_video_data(video_path, video_path.name, cut_path)
+            data_manager.add_detection_data(video_path, frame_ranges)
+
+        stages["data_manager"] = stage_result(
+            time_runs(repeats, write_data), len(frame_ranges), "ranges"
+        )
+
+        report_manager = ReportManager(work_folder, data_manager)
+        stages["report_manager"] = stage_result(
+            time_runs(repeats, lambda: report_manager.write_report([video_path.name])),
+            1,
+            "reports",
+        )
+
+    runs = []
+    for repeat in range(repeats):
+        folder = work_folder / f"{case.name}-{repeat}"
+        start = time.perf_counter()
+        output_folder = run_folder(model, video_path, folder)
+        runs.append(time.perf_counter() - start)
+    stages["end_to_end"] = stage_result(runs, case.frames, "frames")
+    # The time of every stage of the last run, see PipelineMetrics
+    pipeline = json.loads(
+        (output_folder / f"{video_path.stem}_metrics.json").read_text("utf-8")
+    )
+    stages["end_to_end"]["pipeline"] = {
+        "detection_fps": pipeline["fps"],
+        "bound": pipeline["bound"],
+        "stages": {
+            stage: values["seconds"] for stage, values in pipeline["stages"].items()
+        },
+    }
+
+    return {
+        "case": case.name,
+        "width": case.width,
+        "height": case.height,
+        "frames": case.frames,
+        "codec": case.codec,
+        "frames_with_fish": len(frames_with_fish),
+        "frame_ranges": len(frame_ranges),
+        "stages": stages,
+    }
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], tolerance: float) -> List[str]:
+    """Prints the change in speed of every stage from an earlier run.
+
+    Returns:
+        The stages that got slower than the tolerance, as "case/stage".
+    """
+    old_cases = {result["case"]: result for result in old["results"]}
+    print(f"\nCompared to {old['commit']} on {old['host']}")
+    print(f"{'case':<24} {'stage':<26} {'before':>10} {'after':>10} {'change':>8}")
+    regressions = []
+    for result in new["results"]:
+        if result["case"] not in old_cases:
+            continue
+        old_stages = old_cases[result["case"]]["stages"]
+        for stage, values in result["stages"].items():
+            if stage not in old_stages:
+                continue
+            before = old_stages[stage]["per_second"]
+            change = values["per_second"] / before - 1
+            flag = ""
+            if change < -tolerance:
+                regressions.append(f"{result['case']}/{stage}")
+                flag = " slower"
+            print(
+                f"{result['case']:<24} {stage:<26} {before:>10.1f} "
+                f"{values['per_second']:>10.1f} {change:>+8.1%}{flag}"
+            )
+    return regressions
+
+
+def parse_size(size: str) -> Tuple[int, int]:
+    """Parses WIDTHxHEIGHT."""
+    width, height = size.lower().split("x")
+    return int(width), int(height)
+
+
+def main() -> int:  # pylint: disable=too-many-locals,too-many-statements
+    """Runs the benchmark, writes the results and compares them with --compare."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes", type=str, nargs="+", default=["640x360", "1280x720", "1920x1080"]
+    )
+    parser.add_argument("--lengths", type=int, nargs="+", default=[250, 1000])
+    parser.add_argument(
+        "--codecs",
+        type=str,
+        nargs="+",
+        default=["mp4v", "MJPG"],
+        choices=list(CODEC_EXTENSIONS),
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--img_size", type=int, default=640)
+    parser.add_argument("--batch_size", type=int, default=settings.batch_size)
+    parser.add_argument(
+        "--threshold",
+        type=int,
+        default=None,
+        help="Prediction threshold in percent. Defaults to 0 with the random weights, "
+        + "which are never sure of anything, and to that of the app with --weights",
+    )
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--weights", type=str, default=None)
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--compare", type=Path, default=None)
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    commit, dirty = git_commit()
+    host = socket.gethostname()
+    output = (args.output or RESULTS_FOLDER / f"{commit}-{host}.json").resolve()
+    weights = Path(args.weights).resolve() if args.weights else None
+    cases = [
+        VideoCase(width, height, frames, codec)
+        for width, height in map(parse_size, args.sizes)
+        for frames in args.lengths
+        for codec in args.codecs
+    ]
+
+    # Settings of the folder processing, the same as in the detection window
+    settings.batch_size = args.batch_size
+    if args.threshold is None:
+        args.threshold = settings.prediction_threshold if weights else 0
+    settings.prediction_threshold = args.threshold
+    settings.keep_original = True
+    settings.get_report = True
+    settings.report_format = "CSV"
+    settings.detection_cache_mb = 0  # Detect the video again in every run
+    settings.pipeline_metrics = True
+
+    results = []
+    working_directory = Path.cwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # The database and the caches are made in the working directory
+        os.chdir(tmp_dir)
+        try:
+            weights = weights or write_random_weights(Path(tmp_dir) / "random.pt")
+            settings.weights = str(weights)
+            model = BatchYolov8(weights, args.device, img_size=args.img_size)
+            for case in cases:
+                print(f"Benchmarking {case.name}", flush=True)
+                case_folder = Path(tmp_dir) / case.name
+                case_folder.mkdir()
+                results.append(
+                    run_case(case, model, case_folder, args.batch_size, args.repeats)
+                )
+                for stage, values in results[-1]["stages"].items():
+                    print(
+                        f"  {stage:<26} {values['per_second']:>10.1f} "
+                        f"{values['unit']}/s"
+                    )
+        finally:
+            os.chdir(working_directory)
+
+    run = {
+        "commit": commit,
+        "dirty": dirty,
+        "host": host,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "device": args.device,
+            "img_size": args.img_size,
+            "batch_size": args.batch_size,
+            "threshold": args.threshold,
+            "weights": args.weights or "random",
+            "repeats": args.repeats,
+            "fps": FPS,
+        },
+        "results": results,
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(run, indent=4), encoding="utf-8")
+    print(f"Saved the results to {output}")
+
+    if args.compare is None:
+        return 0
+    regressions = compare(
+        json.loads(args.compare.read_text("utf-8")), run, args.tolerance
+    )
+    if regressions:
+        print(f"{len(regressions)} stages got slower: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
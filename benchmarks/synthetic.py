@@ -0,0 +1,142 @@
+"""Synthetic inputs for the benchmarks, so they run without our recordings and models."""
+from pathlib import Path
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+import torch
+from ultralytics.nn.tasks import DetectionModel
+
+# The container of the videos written with an OpenCV codec
+CODEC_EXTENSIONS = {"mp4v": ".mp4", "MJPG": ".avi", "XVID": ".avi", "FFV1": ".mkv"}
+
+
+def write_synthetic_video(
+    path: Path,
+    frame_count: int = 300,
+    size: Tuple[int, int] = (1920, 1080),
+    fps: int = 25,
+) -> Path:
+    """Writes a video of a bright fish-sized box moving over a noisy background.
+
+    Args:
+        path: Where to write the mp4 file.
+        frame_count: The number of frames.
+        size: The (width, height) of the frames.
+        fps: The frame rate.
+
+    Returns:
+        The path of the video.
+    """
+    width, height = size
+    rng = np.random.default_rng(0)
+    background = rng.integers(20, 60, (height, width, 3), dtype=np.uint8)
+    box_width, box_height = max(8, width // 10), max(4, height // 20)
+
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    for index in range(frame_count):
+        frame = background.copy()
+        x = (index * 7) % (width - box_width)
+        y = height // 2 - box_height // 2
+        frame[y : y + box_height, x : x + box_width] = (40, 200, 220)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def fish_frames(
+    frame_count: int, fps: int, fish_seconds: float = 4.0, empty_seconds: float = 2.0
+) -> List[int]:
+    """The frames of write_fish_video with fish in them.
+
+    Args:
+        frame_count: The number of frames.
+        fps: The frame rate.
+        fish_seconds: How long the fish are in view at a time.
+        empty_seconds: How long the view is empty between the fish.
+
+    Returns:
+        The frame numbers in increasing order.
+    """
+    fish_length = max(1, round(fish_seconds * fps))
+    period = fish_length + round(empty_seconds * fps)
+    return [index for index in range(frame_count) if index % period < fish_length]
+
+
+def write_fish_video(  # pylint: disable=too-many-arguments,too-many-locals
+    path: Path,
+    frame_count: int = 250,
+    size: Tuple[int, int] = (1280, 720),
+    fps: int = 25,
+    codec: str = "mp4v",
+    fish: int = 3,
+    fish_seconds: float = 4.0,
+    empty_seconds: float = 2.0,
+    seed: int = 0,
+) -> Path:
+    """Writes a video of fish-shaped blobs swimming over a noisy background, with
+    empty stretches between them, the same for the same arguments.
+
+    Args:
+        path: Where to write the video, with the extension of the codec, see
+              CODEC_EXTENSIONS.
+        frame_count: The number of frames.
+        size: The (width, height) of the frames.
+        fps: The frame rate.
+        codec: The fourcc of the OpenCV codec.
+        fish: The number of fish in view at a time.
+        fish_seconds: How long the fish are in view at a time.
+        empty_seconds: How long the view is empty between the fish.
+        seed: The seed of the background and the sizes, speeds and colors of the fish.
+
+    Returns:
+        The path of the video.
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    background = rng.integers(20, 60, (height, width, 3), dtype=np.uint8)
+    lengths = rng.uniform(0.05, 0.15, fish) * width
+    rows = rng.uniform(0.2, 0.8, fish) * height
+    speeds = rng.uniform(0.5, 1.5, fish) * width / max(1.0, fish_seconds * fps)
+    colors = rng.integers(120, 230, (fish, 3))
+    with_fish = set(fish_frames(frame_count, fps, fish_seconds, empty_seconds))
+
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*codec), fps, size)
+    if not writer.isOpened():
+        raise RuntimeError(f"OpenCV can't write {path} with the {codec} codec")
+    for index in range(frame_count):
+        frame = background.copy()
+        if index in with_fish:
+            for length, row, speed, color in zip(lengths, rows, speeds, colors):
+                x = (index * speed) % (width + length) - length / 2
+                y = row + np.sin(index / fps * 2) * length / 4
+                cv2.ellipse(
+                    frame,
+                    (int(x), int(y)),
+                    (int(length / 2), max(2, int(length / 6))),
+                    0,
+                    0,
+                    360,
+                    tuple(int(channel) for channel in color),
+                    -1,
+                )
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def write_random_weights(path: Path, classes: int = 2) -> Path:
+    """Saves randomly initialized yolov8n weights in the format of our trained models.
+
+    Args:
+        path: Where to write the .pt file.
+        classes: The number of classes of the model.
+
+    Returns:
+        The path of the weights.
+    """
+    torch.manual_seed(0)
+    model = DetectionModel("yolov8n.yaml", nc=classes, verbose=False)
+    model.names = {index: f"class{index}" for index in range(classes)}
+    torch.save({"model": model.half()}, path)
+    return path
@@ -0,0 +1,35 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import cv2
+import numpy as np
+import pytest
+import torch
+from ultralytics.nn.tasks import DetectionModel
+
+
+@pytest.fixture(scope="session")
+def tiny_weights(tmp_path_factory):
+    """Randomly initialized yolov8n weights, so the tests run without our models."""
+    torch.manual_seed(0)
+    model = DetectionModel("yolov8n.yaml", nc=2, verbose=False)
+    model.names = {0: "Gjedde", 1: "Abbor"}
+    weights_path = tmp_path_factory.mktemp("weights") / "tiny.pt"
+    torch.save({"model": model.half()}, weights_path)
+    return weights_path
+
+
+def write_test_video(path, frame_count=50, size=(160, 96), fps=25):
+    """Writes a video of a bright square moving over a dark background."""
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    for index in range(frame_count):
+        frame = np.full((size[1], size[0], 3), 40, dtype=np.uint8)
+        x = (index * 3) % (size[0] - 16)
+        frame[40:56, x : x + 16] = (40, 200, 220)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+@pytest.fixture(scope="session")
+def test_video(tmp_path_factory):
+    return write_test_video(tmp_path_factory.mktemp("videos") / "test.mp4")
@@ -0,0 +1,68 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import torch
+
+from app.common import Common
+from app.detection import autotune as autotune_module
+from app.detection.autotune import (
+    autotune,
+    candidates,
+    load_or_autotune,
+    load_tunings,
+    tuning_cache_path,
+)
+from app.detection.batch_yolov8 import BatchYolov8
+
+
+def test_autotune_picks_a_candidate(tiny_weights, test_video):
+    model = BatchYolov8(tiny_weights, "cpu", img_size=64)
+    threads = torch.get_num_threads()
+    tuning = autotune(
+        model,
+        test_video,
+        frames=16,
+        batch_sizes=[8, 16],
+        worker_counts=[1, 2],
+        thread_counts=[1],
+    )
+    assert tuning.batch_size in (8, 16)
+    assert tuning.grabber_workers in (1, 2)
+    assert tuning.torch_threads == 1
+    assert tuning.fps > 0 and tuning.decode_fps > 0 and tuning.inference_fps > 0
+    # The threads are only changed while measuring
+    assert torch.get_num_threads() == threads
+
+
+def test_candidates():
+    batch_sizes, worker_counts, thread_counts = candidates(cores=8, frames=64)
+    assert batch_sizes == [8, 16, 32, 64]
+    assert worker_counts == [1, 2, 4, 8]
+    assert thread_counts == [1, 4, 8]
+    assert candidates(cores=1, frames=4) == ([8], [1], [1])
+
+
+def test_tuning_is_cached_per_host_and_model(
+    tiny_weights, test_video, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(Common, "autotune_folder", tmp_path)
+    model = BatchYolov8(tiny_weights, "cpu", img_size=64)
+    tuned = []
+
+    def fake_autotune(model, video_path, cores, frames):
+        tuned.append(cores)
+        return autotune_module.Tuning(
+            batch_size=16, grabber_workers=cores, torch_threads=1, fps=10.0
+        )
+
+    monkeypatch.setattr(autotune_module, "autotune", fake_autotune)
+    first = load_or_autotune(model, tiny_weights, test_video, cores=2)
+    assert load_or_autotune(model, tiny_weights, test_video, cores=2) == first
+    assert tuned == [2]
+
+    # Another share of the cores is tuned again
+    assert (
+        load_or_autotune(model, tiny_weights, test_video, cores=4).grabber_workers == 4
+    )
+    assert tuned == [2, 4]
+    assert tuning_cache_path().exists()
+    assert len(load_tunings()) == 2
@@ -0,0 +1,72 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import numpy as np
+import pytest
+
+from app.detection.batch_yolov8 import DETECTION_DTYPE, BatchYolov8
+
+
+@pytest.fixture(scope="module")
+def model(tiny_weights):
+    return BatchYolov8(tiny_weights, "cpu", img_size=64, conf_thres=0.0)
+
+
+def test_detections_to_records():
+    det = np.array(
+        [
+            [10.0, 20.0, 5.0, 40.0, 0.875, 1.0],
+            [0.0, 3.0, 7.0, 1.0, 0.5, 0.0],
+        ],
+        dtype=np.float32,
+    )
+
+    records = BatchYolov8.detections_to_records(det)
+
+    assert records.dtype == DETECTION_DTYPE
+    assert records["xmin"].tolist() == [5, 0]
+    assert records["xmax"].tolist() == [10, 7]
+    assert records["ymin"].tolist() == [20, 1]
+    assert records["ymax"].tolist() == [40, 3]
+    assert records["width"].tolist() == [5, 7]
+    assert records["height"].tolist() == [20, 2]
+    assert records["class_id"].tolist() == [1, 0]
+    assert records["conf"].tolist() == [0.875, 0.5]
+
+
+def test_min_max_list(model):
+    det = np.array([[10.0, 20.0, 5.0, 40.0, 0.875, 1.0]], dtype=np.float32)
+
+    assert model.min_max_list(det) == [
+        {
+            "bndbox": {
+                "xmin": 5,
+                "xmax": 10,
+                "ymin": 20,
+                "ymax": 40,
+                "width": 5,
+                "height": 20,
+            },
+            "name": "Abbor",
+            "class_id": 1,
+            "conf": 0.875,
+            "color": model.colors[1],
+        }
+    ]
+    assert model.min_max_list(None) is None
+
+
+def test_predict_batch_matches_records(model):
+    rng = np.random.default_rng(0)
+    img0s = [rng.integers(0, 255, (48, 80, 3), dtype=np.uint8) for _ in range(3)]
+    imgs = model.prepare_images(img0s)
+
+    records = model.predict_batch_records(img0s, imgs, max_detections=5)
+    predictions = model.predict_batch(img0s, imgs, max_detections=5)
+
+    assert len(records) == len(predictions) == len(img0s)
+    for frame_records, frame_predictions in zip(records, predictions):
+        assert frame_records.dtype == DETECTION_DTYPE
+        assert len(frame_records) == len(frame_predictions) == 5
+        assert frame_predictions == model.records_to_min_max_list(frame_records)
+        assert (frame_records["xmax"] <= 80).all()
+        assert (frame_records["ymax"] <= 48).all()
@@ -0,0 +1,57 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import os
+
+import numpy as np
+
+from app.detection.batch_yolov8 import DETECTION_DTYPE
+from app.detection.detection_cache import DetectionCache, video_fingerprint
+from app.detection.detection_store import DetectionStore
+
+
+def write_store(path, frames_with_fish, frame_count=10):
+    with DetectionStore.create(path, ["Gjedde"]) as store:
+        for frame in range(frame_count):
+            frame_records = np.zeros(int(frame in frames_with_fish), DETECTION_DTYPE)
+            frame_records["conf"] = 0.9
+            store.append([frame], [frame_records])
+    return store
+
+
+def test_fingerprint_changes_with_the_content_but_not_the_name(tmp_path):
+    data = bytes(range(256)) * 4096
+    first, copy, changed = tmp_path / "a.mp4", tmp_path / "b.mp4", tmp_path / "c.mp4"
+    first.write_bytes(data)
+    copy.write_bytes(data)
+    changed.write_bytes(data[:-1] + b"x")
+
+    assert video_fingerprint(first, 4, 1024) == video_fingerprint(copy, 4, 1024)
+    assert video_fingerprint(first, 4, 1024) != video_fingerprint(changed, 4, 1024)
+
+
+def test_cache_round_trip_and_least_recently_used_eviction(tmp_path):
+    video, weights = tmp_path / "video.mp4", tmp_path / "weights.pt"
+    video.write_bytes(b"video")
+    weights.write_bytes(b"weights")
+    cache = DetectionCache(tmp_path / "cache", max_bytes=10**6)
+
+    key = cache.key(video, weights, img_size=640, conf_thres=0.5, iou_thres=0.5)
+    assert key != cache.key(video, weights, img_size=640, conf_thres=0.4, iou_thres=0.5)
+    assert cache.get(key, tmp_path / "out.bin") is None
+
+    cache.put(key, write_store(tmp_path / "first.bin", {3, 4}))
+    store = cache.get(key, tmp_path / "out.bin")
+    assert store.frame_count == 10
+    assert store.frames_with_fish() == [3, 4]
+
+    # Room for two entries, the one looked up least recently is removed
+    entry_size = sum(path.stat().st_size for path in (tmp_path / "cache").iterdir())
+    cache.max_bytes = 2 * entry_size
+    cache.put("second", write_store(tmp_path / "second.bin", {1}))
+    os.utime(tmp_path / "cache" / "second.bin", (0, 0))
+    cache.get(key, tmp_path / "out.bin")
+    cache.put("third", write_store(tmp_path / "third.bin", {7}))
+
+    assert cache.get("second", tmp_path / "out.bin") is None
+    assert cache.get(key, tmp_path / "out.bin") is not None
+    assert cache.get("third", tmp_path / "out.bin").frames_with_fish() == [7]
@@ -0,0 +1,168 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import threading
+
+import numpy as np
+import pytest
+
+from app.detection.batch_yolov8 import DETECTION_DTYPE, BatchYolov8
+from app.detection.detection import process_video
+from app.detection.detection_store import DetectionStore
+
+
+def records(*boxes):
+    frame_records = np.zeros(len(boxes), dtype=DETECTION_DTYPE)
+    for row, (class_id, conf, xmin) in zip(frame_records, boxes):
+        row["class_id"], row["conf"], row["xmin"], row["xmax"] = (
+            class_id,
+            conf,
+            xmin,
+            50,
+        )
+    return frame_records
+
+
+def test_store_holds_the_detections_of_the_last_sampled_frame(tmp_path):
+    path = tmp_path / "video_detections.bin"
+    with DetectionStore.create(path, ["Gjedde", "Abbor"]) as store:
+        store.append([0, 2], [records((1, 0.9, 10)), records()])
+        store.append([4], [records((0, 0.5, 20), (1, 0.7, 30))])
+        store.close(frame_count=6)
+
+    loaded = DetectionStore.load(path)
+    assert loaded.frame_count == 6
+    assert [detection.label for detection in loaded[1]] == ["Abbor"]
+    assert loaded[2] == [] and loaded[3] == []
+    assert [(d.label, d.xmin) for d in loaded[5]] == [("Gjedde", 20), ("Abbor", 30)]
+    assert loaded.get(6) is None
+    assert list(loaded) == list(range(6))
+    np.testing.assert_array_equal(loaded.frames_with_detections(), [0, 4])
+    assert path.stat().st_size == 4 * loaded.rows.itemsize
+
+
+def test_process_video_appends_to_the_store(tiny_weights, test_video, tmp_path):
+    model = BatchYolov8(tiny_weights, "cpu", img_size=64, conf_thres=0.0)
+    store = DetectionStore.create(tmp_path / "test_detections.bin", model.names)
+
+    frames_with_fish, predictions = process_video(
+        model, test_video, 8, 4, None, threading.Event(), detection_store=store
+    )
+
+    assert predictions == []
+    assert store.frame_count == 50
+    assert len(store) == 50
+    assert frames_with_fish == list(store.frames_with_detections())
+    boxes = store[frames_with_fish[0]]
+    assert boxes and boxes[0].label in model.names.values()
+
+
+@pytest.mark.parametrize("stride, decoders", [(1, 1), (2, 1), (1, 2)])
+def test_resumed_run_matches_an_uninterrupted_run(
+    tiny_weights, test_video, tmp_path, stride, decoders
+):
+    model = BatchYolov8(tiny_weights, "cpu", img_size=64, conf_thres=0.0)
+
+    def run(store, stop_event=threading.Event(), **kwargs):
+        return process_video(
+            model,
+            test_video,
+            8,
+            4,
+            None,
+            stop_event,
+            decoders=decoders,
+            stride=stride,
+            detection_store=store,
+            **kwargs,
+        )
+
+    full_store = DetectionStore.create(tmp_path / "full.bin", model.names)
+    expected, _ = run(full_store)
+
+    # Stop a batch after the second checkpoint, as if it crashed before the third
+    checkpoints = []
+    stop_event = threading.Event()
+
+    def checkpoint(frame):
+        checkpoints.append(frame)
+        if len(checkpoints) == 3:
+            stop_event.set()
+
+    path = tmp_path / "resumed.bin"
+    run(
+        DetectionStore.create(path, model.names),
+        stop_event,
+        notify_checkpoint=checkpoint,
+    )
+    assert checkpoints == [8 * stride, 16 * stride, 24 * stride]
+
+    store = DetectionStore.resume(path, checkpoints[1])
+    frames_with_fish, _ = run(store, start_frame=checkpoints[1])
+
+    assert frames_with_fish == expected
+    assert store.frame_count == full_store.frame_count == 50
+    np.testing.assert_array_equal(store.rows, full_store.rows)
+
+
+@pytest.mark.parametrize("stride, decoders", [(1, 1), (2, 1), (1, 2)])
+def test_resuming_after_the_last_checkpoint_reads_the_store(
+    tiny_weights, test_video, tmp_path, stride, decoders
+):
+    # 50 frames are not a multiple of the batch, the last checkpoint is the end
+    model = BatchYolov8(tiny_weights, "cpu", img_size=64, conf_thres=0.0)
+
+    def run(store, **kwargs):
+        return process_video(
+            model,
+            test_video,
+            8,
+            4,
+            None,
+            threading.Event(),
+            decoders=decoders,
+            stride=stride,
+            detection_store=store,
+            **kwargs,
+        )
+
+    checkpoints = []
+    path = tmp_path / "detections.bin"
+    expected, _ = run(
+        DetectionStore.create(path, model.names), notify_checkpoint=checkpoints.append
+    )
+    assert checkpoints[-1] == 50
+
+    # Stopped after detection, before the video was marked as done
+    store = DetectionStore.resume(path, checkpoints[-1])
+    frames_with_fish, _ = run(store, start_frame=checkpoints[-1])
+
+    assert frames_with_fish == expected
+    assert store.frame_count == 50
+
+
+def test_raising_the_threshold_matches_running_the_model_at_it(
+    tiny_weights, test_video, tmp_path
+):
+    model = BatchYolov8(tiny_weights, "cpu", img_size=64, conf_thres=0.0)
+    candidates = DetectionStore.create(tmp_path / "candidates.bin", model.names)
+    process_video(
+        model, test_video, 8, 4, None, threading.Event(), detection_store=candidates
+    )
+
+    # Halfway between two of the confidences, so some candidates are dropped
+    confidences = np.unique(candidates.rows["conf"])
+    conf_thres = float(confidences[len(confidences) // 2 :][:2].mean())
+    candidates.conf_thres = conf_thres
+
+    model.conf_thres = conf_thres
+    store = DetectionStore.create(tmp_path / "detections.bin", model.names)
+    expected, _ = process_video(
+        model, test_video, 8, 4, None, threading.Event(), detection_store=store
+    )
+
+    assert 0 < len(store.rows) < len(candidates.rows)
+    assert candidates.frames_with_fish() == expected
+    for frame in range(50):
+        assert [vars(box) for box in candidates[frame]] == [
+            vars(box) for box in store[frame]
+        ]
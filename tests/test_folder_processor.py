@@ -0,0 +1,56 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import sys
+
+import pytest
+
+pytest.importorskip("fpdf")
+pytest.importorskip("xlsxwriter")
+
+from app.detection import main as detection_main
+
+
+def test_folder_mode_processes_every_video_once(
+    tiny_weights, test_video, tmp_path, monkeypatch
+):
+    # The database and the detection cache live in the working directory
+    monkeypatch.chdir(tmp_path)
+    input_folder = tmp_path / "in"
+    input_folder.mkdir()
+    for name in ("a.mp4", "b.mp4", "c.mp4"):
+        (input_folder / name).write_bytes(test_video.read_bytes())
+
+    argv = [
+        "app.detection",
+        "--input_folder",
+        str(input_folder),
+        "--output_folder",
+        str(tmp_path / "out"),
+        "--weights_path",
+        str(tiny_weights),
+        "--device",
+        "cpu",
+        "--batch_size",
+        "8",
+        "--threshold",
+        "0",
+        "--workers",
+        "2",
+        "--threads",
+        "1",
+        "--report",
+        "CSV",
+    ]
+    monkeypatch.setattr(sys, "argv", argv)
+    assert detection_main.main() == 0
+
+    processed = sorted(path.name for path in (tmp_path / "out").glob("*_processed.mp4"))
+    assert processed == ["a_processed.mp4", "b_processed.mp4", "c_processed.mp4"]
+    report = (tmp_path / "out" / "Processing_report.csv").read_text()
+    assert all(name in report for name in ("a.mp4", "b.mp4", "c.mp4"))
+
+    # A second run finds the checkpoints and does nothing
+    for path in (tmp_path / "out").glob("*_processed.mp4"):
+        path.unlink()
+    assert detection_main.main() == 0
+    assert not list((tmp_path / "out").glob("*_processed.mp4"))
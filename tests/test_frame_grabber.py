@@ -0,0 +1,62 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import numpy as np
+import pytest
+
+from app.detection.batch_yolov8 import BatchYolov8
+from app.detection.frame_grabber import ThreadedFrameGrabber
+from app.detection.process_frame_grabber import ProcessFrameGrabber
+
+
+@pytest.fixture(scope="module")
+def model(tiny_weights):
+    return BatchYolov8(tiny_weights, "cpu", img_size=64)
+
+
+def test_grabber_returns_all_frames(model, test_video):
+    frames = 0
+    with ThreadedFrameGrabber(
+        batch_size=8, model=model, video_path=test_video
+    ) as frame_grabber:
+        while not frame_grabber.is_done():
+            batch = frame_grabber.get_batch()
+            if batch is None:
+                continue
+            processed_batch, original_batch, frame_indices = batch
+            assert processed_batch.shape == (len(original_batch), 3, 64, 64)
+            assert (
+                0.0
+                <= float(processed_batch.min())
+                <= float(processed_batch.max())
+                <= 1.0
+            )
+            np.testing.assert_allclose(
+                processed_batch.numpy(),
+                model.prepare_images(original_batch).numpy(),
+            )
+            assert frame_indices == list(range(frames, frames + len(original_batch)))
+            frames += len(original_batch)
+            frame_grabber.release_batch(processed_batch)
+
+    assert frames == frame_grabber.frame_count == 50
+
+
+def test_process_grabber_matches_threaded_grabber(model, test_video):
+    batches = []
+    with ProcessFrameGrabber(
+        batch_size=8, model=model, video_path=test_video
+    ) as frame_grabber:
+        while not frame_grabber.is_done():
+            batch = frame_grabber.get_batch()
+            if batch is None:
+                continue
+            processed_batch, original_batch, frame_indices = batch
+            np.testing.assert_allclose(
+                processed_batch.numpy(),
+                model.prepare_images(original_batch).numpy(),
+            )
+            batches.append(frame_indices)
+            frame_grabber.release_batch(processed_batch)
+
+    assert [index for batch in batches for index in batch] == list(range(50))
+    assert [len(batch) for batch in batches] == [8] * 6 + [2]
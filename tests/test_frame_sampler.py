@@ -0,0 +1,70 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import pytest
+
+from app.detection.batch_yolov8 import BatchYolov8
+from app.detection.frame_grabber import ThreadedFrameGrabber
+from app.detection.frame_sampler import FrameSampler, expand_sampled_frames
+
+
+def test_fixed_stride_samples_every_nth_frame():
+    sampler = FrameSampler(stride=4)
+    assert [index for index in range(10) if sampler.should_sample(index)] == [0, 4, 8]
+
+
+def test_adaptive_stride_samples_every_frame_after_detection():
+    sampler = FrameSampler(stride=3, adaptive=True, dense_frames=4)
+    sampled = []
+    for index in range(20):
+        if sampler.should_sample(index):
+            sampled.append(index)
+            if index == 6:
+                sampler.report_detection(index)
+
+    assert sampled == [0, 3, 6, 7, 8, 9, 10, 13, 16, 19]
+
+
+def test_expand_sampled_frames_back_fills_neighbours():
+    fish = [{"name": "Gjedde"}]
+    frames_with_fish, predictions = expand_sampled_frames(
+        [0, 5, 10, 15], [[], fish, [], []], frame_count=18
+    )
+
+    assert frames_with_fish == list(range(1, 10))
+    assert len(predictions) == 18
+    assert predictions[4] == [] and predictions[5:10] == [fish] * 5
+    assert predictions[10:] == [[]] * 8
+
+
+def test_expand_sampled_frames_at_full_rate_is_unchanged():
+    fish = [{"name": "Abbor"}]
+    sampled_predictions = [[], fish, fish, [], fish]
+    frames_with_fish, predictions = expand_sampled_frames(
+        list(range(5)), sampled_predictions, frame_count=5
+    )
+
+    assert frames_with_fish == [1, 2, 4]
+    assert predictions == sampled_predictions
+
+
+@pytest.mark.parametrize("decoders", [1, 2])
+def test_grabber_only_returns_sampled_frames(tiny_weights, test_video, decoders):
+    model = BatchYolov8(tiny_weights, "cpu", img_size=64)
+    returned = []
+    with ThreadedFrameGrabber(
+        batch_size=4,
+        model=model,
+        video_path=test_video,
+        decoders=decoders,
+        sampler=FrameSampler(stride=3),
+    ) as frame_grabber:
+        while not frame_grabber.is_done():
+            batch = frame_grabber.get_batch()
+            if batch is None:
+                continue
+            processed_batch, original_batch, frame_indices = batch
+            assert len(processed_batch) == len(original_batch) == len(frame_indices)
+            returned.extend(frame_indices)
+            frame_grabber.release_batch(processed_batch)
+
+    assert returned == list(range(0, 50, 3))
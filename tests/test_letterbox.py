@@ -0,0 +1,47 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import numpy as np
+import pytest
+from ultralytics.data.augment import LetterBox
+
+from app.detection.letterbox import BatchLetterbox, LetterboxParams
+
+
+def reference_letterbox(frame, new_shape):
+    image = LetterBox(stride=32, new_shape=new_shape)(image=frame)
+    return np.ascontiguousarray(image[:, :, ::-1].transpose(2, 0, 1))
+
+
+@pytest.mark.parametrize(
+    "frame_shape", [(1080, 1920), (360, 640), (640, 640), (100, 700), (701, 333)]
+)
+def test_batch_letterbox_matches_ultralytics(frame_shape):
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (*frame_shape, 3), dtype=np.uint8) for _ in range(3)]
+    letterbox = BatchLetterbox(LetterboxParams.from_shape(frame_shape, 320), 4)
+
+    images = letterbox(frames)
+
+    assert images.shape == (3, 3, 320, 320)
+    assert np.shares_memory(images, letterbox.buffer)
+    assert (images == np.array([reference_letterbox(f, 320) for f in frames])).all()
+
+
+def test_batch_letterbox_handles_other_frame_shapes():
+    rng = np.random.default_rng(0)
+    shapes = [(360, 640, 3), (640, 360, 3), (360, 640, 3)]
+    frames = [rng.integers(0, 255, shape, dtype=np.uint8) for shape in shapes]
+    letterbox = BatchLetterbox(LetterboxParams.from_shape((360, 640), 320), 3)
+
+    # Run twice in different orders so the padding of each slot is reused
+    for batch in (frames, frames[::-1]):
+        expected = np.array([reference_letterbox(f, 320) for f in batch])
+        assert (letterbox(batch) == expected).all()
+
+
+def test_batch_letterbox_too_many_frames():
+    letterbox = BatchLetterbox(LetterboxParams.from_shape((360, 640), 320), 1)
+    frames = [np.zeros((360, 640, 3), dtype=np.uint8)] * 2
+
+    with pytest.raises(ValueError):
+        letterbox(frames)
@@ -0,0 +1,55 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import numpy as np
+
+from app.detection.batch_yolov8 import BatchYolov8
+from app.detection.frame_grabber import ThreadedFrameGrabber
+from app.detection.motion_gate import MotionGate
+
+
+def frame_with_square(x):
+    frame = np.full((96, 160, 3), 40, dtype=np.uint8)
+    if x is not None:
+        frame[40:56, x : x + 16] = (40, 200, 220)
+    return frame
+
+
+def test_static_frames_are_gated_until_max_gap():
+    gate = MotionGate(max_gap=5)
+    inferred = [
+        index
+        for index in range(12)
+        if gate.should_infer(index, frame_with_square(None))
+    ]
+
+    assert inferred == [0, 5, 10]
+    assert gate.gated_frames == 9
+    assert gate.inferred_frames == 3
+
+
+def test_moving_object_is_inferred():
+    gate = MotionGate(max_gap=100)
+    gate.should_infer(0, frame_with_square(None))
+
+    assert gate.should_infer(1, frame_with_square(20))
+    assert gate.should_infer(2, frame_with_square(60))
+
+
+def test_gated_frames_count_toward_the_frame_total(tiny_weights, test_video):
+    model = BatchYolov8(tiny_weights, "cpu", img_size=64)
+    gate = MotionGate(max_gap=100)
+    returned = []
+    with ThreadedFrameGrabber(
+        batch_size=8, model=model, video_path=test_video, motion_gate=gate
+    ) as frame_grabber:
+        while not frame_grabber.is_done():
+            batch = frame_grabber.get_batch()
+            if batch is None:
+                continue
+            processed_batch, original_batch, frame_indices = batch
+            returned.extend(frame_indices)
+            frame_grabber.release_batch(processed_batch)
+
+    assert frame_grabber.frames_read == 50
+    assert len(returned) == gate.inferred_frames
+    assert gate.gated_frames + gate.inferred_frames == 50
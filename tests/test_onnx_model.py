@@ -0,0 +1,51 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+
+from app.common import Common
+from app.detection.batch_yolov8 import BatchYolov8
+
+
+@pytest.fixture
+def frames(test_video):
+    capture = cv2.VideoCapture(str(test_video))
+    frames = [capture.read()[1] for _ in range(6)]
+    capture.release()
+    return frames
+
+
+def test_onnx_backend_matches_torch(tiny_weights, frames, tmp_path, monkeypatch):
+    monkeypatch.setattr(Common, "exported_models_folder", tmp_path)
+    eager = BatchYolov8(tiny_weights, "cpu", img_size=64, conf_thres=0.0)
+    onnx = BatchYolov8(
+        tiny_weights, "cpu", img_size=64, conf_thres=0.0, backend="onnx", threads=1
+    )
+    assert len(list(tmp_path.glob("*.onnx"))) == 1
+
+    imgs = eager.prepare_images(frames)
+    eager_out, _ = eager.model(imgs)
+    onnx_out, _ = onnx.model(onnx.prepare_images(frames))
+    np.testing.assert_allclose(onnx_out.numpy(), eager_out.detach().numpy(), atol=1e-3)
+
+    # The random model has many overlapping boxes of about the same confidence, NMS
+    # can keep different ones of those, so only the most confident boxes are compared
+    for eager_records, onnx_records in zip(
+        eager.predict_batch_records(frames, imgs, 20),
+        onnx.predict_batch_records(frames, imgs, 20),
+    ):
+        eager_records, onnx_records = eager_records[:3], onnx_records[:3]
+        for field in ("xmin", "ymin", "xmax", "ymax", "class_id"):
+            np.testing.assert_allclose(
+                onnx_records[field], eager_records[field], atol=1
+            )
+        np.testing.assert_allclose(
+            onnx_records["conf"], eager_records["conf"], atol=1e-4
+        )
+
+    # The second model reuses the export
+    BatchYolov8(tiny_weights, "cpu", img_size=64, backend="onnx")
+    assert len(list(tmp_path.glob("*"))) == 1
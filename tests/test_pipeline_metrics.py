@@ -0,0 +1,69 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import json
+import threading
+
+import pytest
+
+from app.detection.batch_yolov8 import BatchYolov8
+from app.detection.detection import process_video
+from app.detection.pipeline_metrics import PipelineMetrics
+
+
+def test_summary_adds_up_the_stages(tmp_path):
+    metrics = PipelineMetrics()
+    metrics.add("inference", 0.0, 0.2)
+    metrics.add("inference", 1.0, 1.4)
+    metrics.add("decode", 0.0, 0.1)
+    metrics.sample_queue("processed", 1, capacity=4)
+    metrics.sample_queue("processed", 3)
+    metrics.finish_detection(10)
+
+    summary = metrics.summary()
+    assert list(summary["stages"]) == ["decode", "inference"]
+    inference = summary["stages"]["inference"]
+    assert inference["count"] == 2
+    assert inference["seconds"] == pytest.approx(0.6)
+    assert inference["max_ms"] == pytest.approx(400)
+    assert summary["queues"]["processed"] == {
+        "samples": 2,
+        "mean": 2,
+        "max": 3,
+        "capacity": 4,
+    }
+    assert summary["bound"] == "model"
+
+    with pytest.raises(ValueError):
+        metrics.write_trace(tmp_path / "trace.json")
+    metrics.write_summary(tmp_path / "metrics.json", video="a.mp4")
+    written = json.loads((tmp_path / "metrics.json").read_text())
+    assert written["video"] == "a.mp4" and written["frames"] == 10
+
+
+def test_process_video_records_every_stage(tiny_weights, test_video, tmp_path):
+    model = BatchYolov8(tiny_weights, "cpu", img_size=64)
+    metrics = PipelineMetrics(trace=True)
+    process_video(
+        model,
+        test_video,
+        batch_size=8,
+        max_batches_to_queue=2,
+        output_path=None,
+        stop_event=threading.Event(),
+        metrics=metrics,
+    )
+
+    summary = metrics.summary()
+    assert summary["frames"] == 50
+    for stage in ["decode", "letterbox", "processed_queue_get", "inference", "nms"]:
+        assert summary["stages"][stage]["count"] > 0
+    assert summary["stages"]["inference"]["count"] == 7
+    assert summary["queues"]["processed"]["samples"] > 0
+
+    metrics.write_trace(tmp_path / "trace.json")
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    spans = [event for event in events if event["ph"] == "X"]
+    assert {"decode", "letterbox", "inference"} <= {span["name"] for span in spans}
+    # The decoder, the letterbox workers and the model run on their own threads
+    assert len({span["tid"] for span in spans}) >= 3
+    assert any(event["ph"] == "C" for event in events)
@@ -0,0 +1,70 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import shutil
+
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnx")
+
+from app.detection.batch_yolov8 import DETECTION_DTYPE, BatchYolov8
+from app.detection.quantization import (
+    box_metrics,
+    evaluate,
+    quantize_weights,
+    quantized_weights_path,
+)
+from tools.generate_dataset.generate_dataset import extract_frames
+
+
+def test_quantized_model_runs_like_weights(tiny_weights, test_video, tmp_path):
+    weights = tmp_path / "tiny.pt"
+    shutil.copy(tiny_weights, weights)
+    (tmp_path / "frames").mkdir()
+    images = extract_frames(test_video, list(range(0, 50, 5)), tmp_path / "frames")
+    assert len(images) == 10
+
+    quantized = quantize_weights(weights, images, img_size=64, batch_size=4)
+    assert quantized == quantized_weights_path(weights) == tmp_path / "tiny-int8.onnx"
+    modified = quantized.stat().st_mtime_ns
+    assert quantize_weights(weights, images, img_size=64) == quantized
+    assert quantized.stat().st_mtime_ns == modified
+
+    model = BatchYolov8(quantized, "cpu", conf_thres=0.0)
+    original = BatchYolov8(weights, "cpu", img_size=64)
+    assert model.backend == "onnx"
+    assert model.names == original.names
+    assert model.imgsz == original.imgsz
+
+    frames = [np.zeros((96, 160, 3), dtype=np.uint8)] * 2
+    records = model.predict_batch_records(frames, model.prepare_images(frames))
+    assert len(records) == 2
+
+
+def test_box_metrics():
+    labels = [np.array([[0, 10, 10, 50, 50], [1, 60, 60, 90, 90]], dtype=np.float32)]
+    perfect = np.zeros(2, dtype=DETECTION_DTYPE)
+    for record, (class_id, *box) in zip(perfect, labels[0]):
+        record["xmin"], record["ymin"], record["xmax"], record["ymax"] = box
+        record["class_id"] = class_id
+        record["conf"] = 0.9
+    metrics = box_metrics([perfect], labels)
+    assert metrics["map50"] == pytest.approx(1, abs=0.01)
+    assert metrics["recall"] == pytest.approx(1)
+
+    # Missing a fish halves the recall
+    metrics = box_metrics([perfect[:1]], labels)
+    assert metrics["recall"] == pytest.approx(0.5)
+
+
+def test_evaluate_skips_unreadable_images(tiny_weights, test_video, tmp_path):
+    images = extract_frames(test_video, [0, 10], tmp_path)
+    images[0].with_suffix(".txt").write_text("0 0.5 0.5 0.2 0.2\n")
+    val_list = tmp_path / "val.txt"
+    val_list.write_text(
+        "\n".join([str(images[0]), str(tmp_path / "missing.jpg"), str(images[1])])
+    )
+    model = BatchYolov8(tiny_weights, "cpu", img_size=64, conf_thres=0.001)
+    metrics = evaluate(model, val_list, batch_size=2)
+    assert metrics["images"] == 2
@@ -1,10 +1,24 @@
 # pylint: skip-file
 # mypy: ignore-errors
 import pytest
+from PyQt6.QtCore import QSettings
 
 from app import settings
 
 
+@pytest.fixture(autouse=True)
+def settings_file(tmp_path, monkeypatch):
+    """Store the settings in a temporary ini file instead of the working directory,
+    and undo the changes of a test to the entries."""
+    monkeypatch.setattr(
+        settings,
+        "__settings",
+        QSettings(str(tmp_path / "settings.ini"), QSettings.Format.IniFormat),
+    )
+    settings.setup()
+    monkeypatch.setattr(settings, "__entries", dict(settings.__entries))
+
+
 def test_setup():
     """Tests the setup function"""
     settings.setup()
@@ -0,0 +1,67 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import cv2
+import numpy as np
+import pytest
+
+from app.detection.detection import detected_frames_to_ranges
+from app.video_processor import Detection
+from app.video_processor.streaming_cutter import StreamingCutter
+
+
+def two_pass_frames(frames_with_fish, frame_count, frame_buffer, before, after):
+    """The frames cut after detection, like DetectionWorker does."""
+    frames = set()
+    for start, end in detected_frames_to_ranges(frames_with_fish, frame_buffer):
+        frames.update(range(max(0, start - before), min(frame_count, end + after + 1)))
+    return sorted(frames)
+
+
+def count_frames(video_path):
+    capture = cv2.VideoCapture(str(video_path))
+    count = 0
+    while capture.read()[0]:
+        count += 1
+    capture.release()
+    return count
+
+
+@pytest.mark.parametrize(
+    "frame_buffer, before, after",
+    [(5, 0, 0), (5, 3, 2), (2, 6, 8)],
+)
+def test_streaming_cut_writes_the_frames_of_the_two_pass_cut(
+    tmp_path, frame_buffer, before, after
+):
+    frame_count = 80
+    frames_with_fish = [10, 12, 17, 30, 31, 45, 60, 62, 79]
+    fish = Detection("Abbor", 0.9, 4, 4, 20, 20)
+    output_path = tmp_path / "cut.mp4"
+
+    written = []
+    with StreamingCutter(output_path, 25, frame_buffer, before, after) as cutter:
+        for frame_index in range(frame_count):
+            frame = np.full((32, 48, 3), frame_index, dtype=np.uint8)
+            detections = [fish] if frame_index in frames_with_fish else []
+            cutter.add_frame(frame_index, frame, detections)
+            assert len(cutter.pending) <= max(frame_buffer, before) + 1
+        frame_ranges = cutter.close()
+        written = [
+            frame for start, end in frame_ranges for frame in range(start, end + 1)
+        ]
+
+    expected = two_pass_frames(
+        frames_with_fish, frame_count, frame_buffer, before, after
+    )
+    assert written == expected
+    assert count_frames(output_path) == len(expected)
+
+
+def test_streaming_cut_without_fish_writes_nothing(tmp_path):
+    output_path = tmp_path / "cut.mp4"
+    with StreamingCutter(output_path, 25, 5, 2, 2) as cutter:
+        for frame_index in range(20):
+            cutter.add_frame(frame_index, np.zeros((32, 48, 3), np.uint8), [])
+
+    assert cutter.frame_ranges == []
+    assert not output_path.exists()
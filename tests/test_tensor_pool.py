@@ -0,0 +1,47 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import numpy as np
+import pytest
+import torch
+
+from app.detection.tensor_pool import TensorPool
+
+
+@pytest.fixture
+def pool():
+    return TensorPool(2, (4, 3, 8, 8), torch.float32, torch.device("cpu"))
+
+
+def test_load_normalizes_host_buffer(pool):
+    slot = pool.acquire()
+    pool.host_array(slot)[:2] = 255
+
+    tensor = pool.load(slot, 2)
+
+    assert not pool.pinned
+    assert tensor.shape == (2, 3, 8, 8)
+    assert tensor.dtype == torch.float32
+    assert torch.all(tensor == 1.0)
+
+
+def test_pool_is_bounded_and_recycled(pool):
+    first = pool.acquire()
+    second = pool.acquire()
+
+    assert pool.acquire(timeout=0.01) is None
+
+    pool.release(pool.load(first, 3))
+    assert pool.acquire(timeout=0.01) == first
+
+    pool.release_slot(second)
+    assert pool.free_count() == 1
+
+
+def test_release_errors(pool):
+    slot = pool.acquire()
+    pool.release_slot(slot)
+
+    with pytest.raises(ValueError):
+        pool.release_slot(slot)
+    with pytest.raises(ValueError):
+        pool.release(torch.zeros(1))
@@ -0,0 +1,136 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import cv2
+import numpy as np
+
+from app.detection.video_segments import VideoIndex
+from app.video_processor import Detection
+from app.video_processor.video_processor import Annotator, cut_video, snap_to_keyframes
+
+
+def read_all_frames(video_path):
+    capture = cv2.VideoCapture(str(video_path))
+    frames = []
+    while True:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+def test_snap_to_keyframes_widens_and_merges_ranges():
+    index = VideoIndex(frame_pts=list(range(100)), keyframes=[0, 20, 40, 60, 80])
+
+    assert snap_to_keyframes([(25, 30), (61, 70), (85, 120)], index) == [
+        (20, 39),
+        (60, 99),
+    ]
+    # Ranges in neighbouring GOPs become one
+    assert snap_to_keyframes([(5, 10), (20, 20)], index) == [(0, 39)]
+
+
+def test_stream_copy_keeps_the_frames_of_the_snapped_ranges(test_video, tmp_path):
+    expected = read_all_frames(test_video)
+    index = VideoIndex.from_video(test_video)
+    frame_ranges = [(3, 8), (30, 32)]
+    output_path = tmp_path / "copy.mp4"
+    progress = []
+
+    cut_video(
+        test_video,
+        output_path,
+        frame_ranges,
+        notify_progress=progress.append,
+        stream_copy=True,
+    )
+
+    copied = read_all_frames(output_path)
+    snapped = snap_to_keyframes(frame_ranges, index)
+    frame_indices = [frame for start, end in snapped for frame in range(start, end + 1)]
+    assert len(copied) == len(frame_indices)
+    for frame, frame_index in zip(copied, frame_indices):
+        np.testing.assert_array_equal(frame, expected[frame_index])
+    assert progress[-1] == 100
+
+
+def test_encoding_ranges_in_workers_gives_the_serial_output(test_video, tmp_path):
+    frame_ranges = [(0, 9), (15, 24), (40, 49)]
+    outputs = []
+    progresses = []
+    for workers in (1, 2):
+        output_path = tmp_path / f"workers_{workers}.mp4"
+        progress = []
+        cut_video(
+            test_video,
+            output_path,
+            frame_ranges,
+            notify_progress=progress.append,
+            workers=workers,
+        )
+        assert progress[-1] == 100
+        progresses.append(progress)
+        outputs.append(read_all_frames(output_path))
+
+    # The workers report the progress of their frames, not only of whole segments
+    assert len(progresses[1]) > len(frame_ranges)
+    assert progresses[1] == sorted(progresses[1])
+
+    # One stream and joined segments are encoded apart, so only nearly the same
+    serial, parallel = outputs
+    assert len(serial) == 30
+    assert len(parallel) == len(serial)
+    for serial_frame, parallel_frame in zip(serial, parallel):
+        difference = np.abs(serial_frame.astype(int) - parallel_frame.astype(int))
+        assert difference.mean() < 1
+
+
+def test_annotator_draws_in_place_and_caches_labels():
+    annotator = Annotator((160, 96), line_width=2)
+    frame = np.zeros((96, 160, 3), dtype=np.uint8)
+    detections = [
+        Detection("Abbor", 0.9, 20, 40, 60, 80),
+        Detection("Abbor", 0.9, 150, 90, 170, 100),  # Partly outside the frame
+    ]
+
+    annotated = annotator.annotate(frame, detections)
+
+    assert annotated is frame
+    np.testing.assert_array_equal(frame[79, 20:61], [annotator.color] * 41)
+    np.testing.assert_array_equal(frame[50, 20:22], [annotator.color] * 2)
+    assert not frame[50, 22:58].any()
+    assert list(annotator.labels) == [("0.90 Abbor", annotator.color)]
+
+
+def test_annotator_draws_on_yuv420p_planes():
+    annotator = Annotator((160, 96), line_width=2)
+    bgr = np.full((96, 160, 3), 40, dtype=np.uint8)
+    image = cv2.cvtColor(bgr, cv2.COLOR_BGR2YUV_I420)
+    untouched = image.copy()
+    detections = [Detection("Abbor", 0.9, 20, 40, 60, 80)]
+
+    annotator.annotate_yuv420p(image, detections)
+
+    expected = annotator.annotate(bgr.copy(), detections)
+    drawn = cv2.cvtColor(image, cv2.COLOR_YUV2BGR_I420)
+    # The box lines, and the inside of the box which is left alone
+    for row, column in [(79, 40), (50, 20), (50, 59), (60, 40)]:
+        np.testing.assert_allclose(drawn[row, column], expected[row, column], atol=8)
+    np.testing.assert_array_equal(image[60, 30:50], untouched[60, 30:50])
+
+
+def test_cut_video_annotates_the_frames_with_detections(test_video, tmp_path):
+    detections = {
+        frame: [Detection("Abbor", 0.9, 20, 20, 60, 60)] for frame in range(5)
+    }
+    output_path = tmp_path / "annotated.mp4"
+
+    cut_video(test_video, output_path, [(0, 9)], detections)
+
+    frames = read_all_frames(output_path)
+    original = read_all_frames(test_video)
+    assert len(frames) == 10
+    # Blue box lines on the annotated frames only
+    assert frames[0][40, 20, 0] > 200 and original[0][40, 20, 0] < 100
+    assert frames[9][40, 20, 0] < 100
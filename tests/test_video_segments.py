@@ -0,0 +1,98 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import cv2
+import numpy as np
+import pytest
+
+from app.detection.batch_yolov8 import BatchYolov8
+from app.detection.frame_grabber import ThreadedFrameGrabber
+from app.detection.video_segments import (
+    Segment,
+    SegmentDecoder,
+    VideoIndex,
+    plan_segments,
+)
+
+
+def test_plan_segments_starts_at_batch_boundaries():
+    index = VideoIndex(frame_pts=list(range(0, 1000, 10)), keyframes=[0, 30, 45, 90])
+    segments = plan_segments(index, batch_size=16)
+
+    assert [(segment.start, segment.end) for segment in segments] == [
+        (0, 32),
+        (32, 48),
+        (48, 96),
+        (96, 100),
+    ]
+
+
+def read_all_frames(video_path):
+    capture = cv2.VideoCapture(str(video_path))
+    frames = []
+    while True:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+def test_segments_decode_the_same_frames_as_capture(test_video):
+    expected = read_all_frames(test_video)
+    index = VideoIndex.from_video(test_video)
+    assert index.frame_count == len(expected)
+    assert len(index.keyframes) > 1
+
+    with SegmentDecoder(test_video, index) as decoder:
+        # Out of order, as the decoder threads may see them
+        segments = plan_segments(index, batch_size=8)[::-1]
+        decoded = dict(
+            frame for segment in segments for frame in decoder.decode(segment)
+        )
+
+    assert sorted(decoded) == list(range(len(expected)))
+    for frame_index, frame in enumerate(expected):
+        np.testing.assert_array_equal(decoded[frame_index], frame)
+
+
+def test_decoder_seeks_past_frames_it_does_not_need(test_video):
+    expected = read_all_frames(test_video)
+    index = VideoIndex.from_video(test_video)
+    stride = index.keyframes[1] + 2
+
+    with SegmentDecoder(test_video, index) as decoder:
+        decoded = list(decoder.decode(Segment(0, index.frame_count), stride=stride))
+
+        assert [frame_index for frame_index, _ in decoded] == list(
+            range(0, index.frame_count, stride)
+        )
+        for frame_index, frame in decoded:
+            np.testing.assert_array_equal(frame, expected[frame_index])
+        assert decoder.seeks > 1
+        assert decoder.skipped_frames < index.frame_count - len(decoded)
+
+
+@pytest.mark.parametrize("decoders", [1, 3])
+def test_grabber_with_decoders_returns_frames_in_order(
+    tiny_weights, test_video, decoders
+):
+    model = BatchYolov8(tiny_weights, "cpu", img_size=64)
+    capture = cv2.VideoCapture(str(test_video))
+
+    with ThreadedFrameGrabber(
+        batch_size=8, model=model, video_path=test_video, decoders=decoders
+    ) as frame_grabber:
+        while not frame_grabber.is_done():
+            batch = frame_grabber.get_batch()
+            if batch is None:
+                continue
+            processed_batch, original_batch, frame_indices = batch
+            for frame in original_batch:
+                ret, expected = capture.read()
+                assert ret
+                np.testing.assert_array_equal(frame, expected)
+            frame_grabber.release_batch(processed_batch)
+
+    assert not capture.read()[0]
+    assert frame_grabber.frames_read == 50
@@ -0,0 +1,72 @@
+# pylint: skip-file
+# mypy: ignore-errors
+import multiprocessing as mp
+import time
+
+from app.detection.work_queue import DONE, FAILED, LEASED, PENDING, WorkQueue
+
+
+def test_claims_are_leased_to_one_worker_until_they_expire(tmp_path):
+    with WorkQueue(tmp_path / "queue.db", lease_seconds=0.2) as queue:
+        assert queue.add(["a.mp4", "b.mp4"]) == 2
+        assert queue.add(["a.mp4", "c.mp4"]) == 1
+
+        assert queue.claim("first") == (1, "a.mp4")
+        assert queue.claim("second") == (2, "b.mp4")
+        assert queue.complete("b.mp4", "second", {"frame_ranges": [[0, 5]]})
+        assert queue.counts() == {PENDING: 1, LEASED: 1, DONE: 1, FAILED: 0}
+
+        # The first worker stops renewing its lease, another worker takes the video
+        time.sleep(0.3)
+        assert queue.renew("second") == 0
+        assert queue.claim("second") == (1, "a.mp4")
+        assert not queue.complete("a.mp4", "first", {})
+        assert queue.complete("a.mp4", "second", {})
+
+        assert queue.results() == [("a.mp4", {}), ("b.mp4", {"frame_ranges": [[0, 5]]})]
+
+
+def test_videos_fail_after_the_last_attempt(tmp_path):
+    with WorkQueue(tmp_path / "queue.db", max_attempts=2) as queue:
+        queue.add(["a.mp4"])
+
+        queue.claim("worker")
+        queue.release("worker")  # Stopped, does not count as an attempt
+        queue.claim("worker")
+        queue.release("worker", "RuntimeError()")
+        assert queue.counts()[PENDING] == 1
+
+        queue.claim("worker")
+        queue.release("worker", "RuntimeError()")
+        assert queue.counts()[FAILED] == 1
+        assert queue.claim("worker") is None
+
+
+def claim_all(queue_path, worker, claimed):
+    with WorkQueue(queue_path) as queue:
+        while (video := queue.claim(worker)) is not None:
+            claimed.put(video[1])
+            assert queue.complete(video[1], worker, {"worker": worker})
+
+
+def test_worker_processes_claim_every_video_once(tmp_path):
+    queue_path = tmp_path / "queue.db"
+    videos = [f"{video}.mp4" for video in range(60)]
+    with WorkQueue(queue_path) as queue:
+        queue.add(videos)
+
+    context = mp.get_context("spawn")
+    claimed = context.Queue()
+    workers = [
+        context.Process(target=claim_all, args=(queue_path, f"worker{i}", claimed))
+        for i in range(3)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert all(worker.exitcode == 0 for worker in workers)
+    assert sorted(claimed.get() for _ in videos) == sorted(videos)
+    with WorkQueue(queue_path) as queue:
+        assert queue.counts()[DONE] == len(videos)
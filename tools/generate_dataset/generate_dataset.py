@@ -190,6 +190,31 @@ def parse_xml_annotation(
     return video_filename, video_original_size, frame_count, annotations
 
 
+def extract_frames(
+    video_path: Path, frame_numbers: List[int], output_folder: Path
+) -> List[Path]:
+    """Save frames of a video as <frame number>.png, returns the saved images.
+
+    Also used to sample calibration frames in tools/quantize_model.
+    """
+    video = cv2.VideoCapture(str(video_path))
+
+    images = []
+    for frame_number in frame_numbers:
+        video.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        success, frame = video.read()
+        if success:
+            image = output_folder / f"{frame_number:06}.png"
+            cv2.imwrite(
+                str(image),
+                frame,
+                [int(cv2.IMWRITE_PNG_COMPRESSION), PNG_QUALITY],
+            )
+            images.append(image)
+    video.release()
+    return images
+
+
 def generate_yolo_dataset(
     yolo_dataset_folder: Path,
     annotation_path: Path,
@@ -219,22 +244,6 @@ def generate_yolo_dataset(
 
     video_path = get_video_path(video_filename)
 
-    def extract_frames(video_path: Path) -> None:
-        video = cv2.VideoCapture(str(video_path))
-
-        frames_to_extract = list(filter(lambda n: n in annotations, range(frame_count)))
-
-        for frame_number in frames_to_extract:
-            video.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-            success, frame = video.read()
-            if success:
-                cv2.imwrite(
-                    str(yolo_dataset_folder / f"{frame_number:06}.png"),
-                    frame,
-                    [int(cv2.IMWRITE_PNG_COMPRESSION), PNG_QUALITY],
-                )
-        video.release()
-
     # Iterate all the annotations and generate the yolo dataset
     # Each entry of annotations contain the frame number as key and a dictionary of labels as value, with the bounding boxes as value
     video_width, video_height = video_resolution
@@ -268,7 +277,8 @@ def generate_yolo_dataset(
                     )
 
     # Extract annotation frames and background frames
-    extract_frames(video_path)
+    frames_to_extract = list(filter(lambda n: n in annotations, range(frame_count)))
+    extract_frames(video_path, frames_to_extract, yolo_dataset_folder)
 
 
 def get_background_images(images: List[Path]) -> List[Path]:
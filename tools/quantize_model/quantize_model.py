@@ -0,0 +1,122 @@
+# pylint: skip-file
+# mypy: ignore-errors
+"""
+Quantizes model weights to int8, calibrated on frames from our own videos, and
+compares the accuracy of the quantized model with the weights on a validation set.
+
+The quantized model is saved next to the weights as <name>-int8.onnx, so it shows
+up in the weights dropdown of the options. The comparison is saved next to it as
+<name>-int8.json.
+
+Usage (from the root of the repository):
+    python -m tools.quantize_model.quantize_model \\
+        --weights data/models/v8s-640-classes-augmented-backgrounds.pt \\
+        --videos "X:\\Myggbukta 2022" --frames 300 --val path\\to\\dataset\\val.txt
+"""
+import argparse
+import json
+import random
+import sys
+import tempfile
+from pathlib import Path
+from typing import List
+
+import cv2
+
+from app.detection.batch_yolov8 import BatchYolov8
+from app.detection.quantization import (
+    evaluate,
+    quantize_weights,
+    quantized_weights_path,
+)
+from tools.generate_dataset.generate_dataset import extract_frames
+
+VIDEO_EXTENSIONS = [".mp4", ".avi", ".m4v", ".mpg", ".mov"]
+# The confidence threshold of the YOLO validator
+VAL_CONF_THRESHOLD = 0.001
+
+
+def find_videos(folders: List[Path]) -> List[Path]:
+    videos = []
+    for folder in folders:
+        if folder.is_file():
+            videos.append(folder)
+            continue
+        videos += [
+            file
+            for file in folder.glob("**/*.*")
+            if file.suffix.lower() in VIDEO_EXTENSIONS
+        ]
+    return sorted(videos)
+
+
+def sample_frames(videos: List[Path], frames: int, output_folder: Path) -> List[Path]:
+    # Spread the frames evenly over the videos, at random positions in each video
+    images = []
+    frames_per_video = max(1, frames // len(videos))
+    for position, video_path in enumerate(videos):
+        video = cv2.VideoCapture(str(video_path))
+        frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        video.release()
+        if frame_count <= 0:
+            continue
+
+        frame_numbers = sorted(
+            random.sample(range(frame_count), min(frames_per_video, frame_count))
+        )
+        video_folder = output_folder / f"{position:04d}"
+        video_folder.mkdir()
+        images += extract_frames(video_path, frame_numbers, video_folder)
+    return images[:frames]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weights", type=Path, required=True)
+    parser.add_argument("--videos", type=Path, nargs="+", required=True)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--val", type=Path, default=None)
+    parser.add_argument("--img_size", type=int, default=640)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    videos = find_videos(args.videos)
+    if not videos:
+        print(f"No videos found in {args.videos}")
+        return 1
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        images = sample_frames(videos, args.frames, Path(tmp_dir))
+        print(f"Calibrating on {len(images)} frames from {len(videos)} videos")
+        quantized_path = quantize_weights(args.weights, images, args.img_size)
+
+    if args.val is None:
+        return 0
+
+    results = {}
+    for name, weights in [("fp32", args.weights), ("int8", quantized_path)]:
+        model = BatchYolov8(
+            weights, "cpu", img_size=args.img_size, conf_thres=VAL_CONF_THRESHOLD
+        )
+        results[name] = evaluate(model, args.val)
+    results["change"] = {
+        key: results["int8"][key] - results["fp32"][key]
+        for key in ["map50", "map50_95", "precision", "recall"]
+    }
+
+    report_path = quantized_weights_path(args.weights).with_suffix(".json")
+    report_path.write_text(json.dumps(results, indent=4), encoding="utf-8")
+
+    print(f"{'':>8} {'mAP50':>8} {'mAP50-95':>9} {'P':>7} {'R':>7}")
+    for name, metrics in results.items():
+        print(
+            f"{name:>8} {metrics['map50']:>8.3f} {metrics['map50_95']:>9.3f} "
+            f"{metrics['precision']:>7.3f} {metrics['recall']:>7.3f}"
+        )
+    print(f"Saved the comparison to {report_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())